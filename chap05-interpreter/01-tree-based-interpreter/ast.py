@@ -30,26 +30,17 @@ class AbstractNodeVisitor:
     __metaclass__ = ABCMeta
 
     def visit(self, node):
-        if isinstance(node, BinaryExpressionNode):
-            return self.visitBinaryExpressionNode(node)
-        elif isinstance(node, IntegerNode):
-            return self.visitIntegerNode(node)
-        elif isinstance(node, UnaryExpressionNode):
-            return self.visitUnaryExpressionNode(node)
-        elif isinstance(node, IdentifierNode):
-            return self.visitIdentifierNode(node)
-        elif isinstance(node, StatementListNode):
-            return self.visitStatementListNode(node)
-        elif isinstance(node, FunctionArgumentsNode):
-            return self.visitFunctionArgumentsNode(node)
-        elif isinstance(node, FunctionParametersNode):
-            return self.visitFunctionParametersNode(node)
-        elif isinstance(node, FunctionDefinitionNode):
-            return self.visitFunctionDefinitionNode(node)
-        elif isinstance(node, FunctionCallNode):
-            return self.visitFunctionCallNode(node)
-        elif isinstance(node, ReturnStatementNode):
-            return self.visitReturnStatementNode(node)
+        entry = VISIT_TABLES.get(self.__class__, EMPTY_TABLE).get(
+            node.__class__)
+        if entry is None:
+            entry = visitEntry(self.__class__, node.__class__)
+            if entry is None:
+                return None
+        name, function = entry
+        method = self.__dict__.get(name) # set on this very visitor
+        if method is not None:
+            return method(node)
+        return function(self, node)
 
     @abstractmethod
     def visitBinaryExpressionNode(self, node):
@@ -91,75 +82,204 @@ class AbstractNodeVisitor:
     def visitReturnStatementNode(self, node):
         raise NotImplementedError(NOT_IMPLEMENTED)
 
+# Visit methods, as (name, function), by visitor class, then by node class:
+# VISIT_TABLES for visit(), ACCEPT_TABLES for accept()
+VISIT_TABLES = {}
+ACCEPT_TABLES = {}
+EMPTY_TABLE = {}
+
+def visitEntry(visitorClass, nodeClass):
+    '''
+    Return the name and function of the visit method of a node class for
+    the visitors of a class, found once and kept in VISIT_TABLES. None for
+    a class that is no node.
+    '''
+    table = VISIT_TABLES.setdefault(visitorClass, {})
+    if nodeClass in table:
+        return table[nodeClass]
+    name = visitMethodName(nodeClass)
+    if name is None:
+        entry = None
+    else:
+        entry = (name, unboundFunction(getattr(visitorClass, name)))
+    table[nodeClass] = entry
+    return entry
+
+def acceptEntry(visitorClass, nodeClass):
+    '''
+    Return the name and function accept() calls for the nodes of a class
+    and the visitors of a class, kept in ACCEPT_TABLES: the visit() of the
+    visitor class if it overrides visit(), as visitEntry() otherwise.
+    '''
+    table = ACCEPT_TABLES.setdefault(visitorClass, {})
+    if nodeClass in table:
+        return table[nodeClass]
+    if visitMethodName(nodeClass) is None:
+        entry = None
+    elif (unboundFunction(visitorClass.visit) is not
+          unboundFunction(AbstractNodeVisitor.visit)):
+        entry = ('visit', unboundFunction(visitorClass.visit))
+    else:
+        entry = visitEntry(visitorClass, nodeClass)
+    table[nodeClass] = entry
+    return entry
+
+def unboundFunction(method):
+    # the plain function of an unbound method of Python 2
+    return getattr(method, '__func__', method)
+
+def visitMethodName(nodeClass):
+    '''
+    Return the name of the visit method of a node class, None for a class
+    that is no node.
+    '''
+    if issubclass(nodeClass, BinaryExpressionNode):
+        name = 'visitBinaryExpressionNode'
+    elif issubclass(nodeClass, IntegerNode):
+        name = 'visitIntegerNode'
+    elif issubclass(nodeClass, UnaryExpressionNode):
+        name = 'visitUnaryExpressionNode'
+    elif issubclass(nodeClass, IdentifierNode):
+        name = 'visitIdentifierNode'
+    elif issubclass(nodeClass, StatementListNode):
+        name = 'visitStatementListNode'
+    elif issubclass(nodeClass, FunctionArgumentsNode):
+        name = 'visitFunctionArgumentsNode'
+    elif issubclass(nodeClass, FunctionParametersNode):
+        name = 'visitFunctionParametersNode'
+    elif issubclass(nodeClass, FunctionDefinitionNode):
+        name = 'visitFunctionDefinitionNode'
+    elif issubclass(nodeClass, FunctionCallNode):
+        name = 'visitFunctionCallNode'
+    elif issubclass(nodeClass, ReturnStatementNode):
+        name = 'visitReturnStatementNode'
+    else:
+        name = None
+    return name
+
+def dispatch(node, visitor):
+    '''
+    The accept() of the nodes: the function visit() would call, or the
+    visit() of the visitor class if it overrides visit(), without calling
+    the visit() of AbstractNodeVisitor in between.
+    '''
+    entry = ACCEPT_TABLES.get(visitor.__class__, EMPTY_TABLE).get(
+        node.__class__)
+    if entry is None:
+        entry = acceptEntry(visitor.__class__, node.__class__)
+        if entry is None:
+            return None
+    name, function = entry
+    method = visitor.__dict__.get(name) # set on this very visitor
+    if method is not None:
+        return method(node)
+    return function(visitor, node)
+
 ###########################################################
 # BinaryExpressionNode -- AST Node of Expression
 ###########################################################
 class BinaryExpressionNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # IntegerNode -- AST Node of Integer
 ###########################################################
 class IntegerNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # UnaryExpressionNode -- AST Node of Unary Expression
 ###########################################################
 class UnaryExpressionNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # IdentifierNode -- AST Node of Variable
 ###########################################################
 class IdentifierNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # StatementListNode -- AST Node of Statement List
 ###########################################################
 class StatementListNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # FunctionArgumentsNode -- AST Node of arguments
 ###########################################################
 class FunctionArgumentsNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # FunctionParametersNode -- AST Node of parameters
 ###########################################################
 class FunctionParametersNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # FunctionDefinitionNode -- AST Node of function definition
 ###########################################################
 class FunctionDefinitionNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # FunctionCallNode -- AST Node of function call
 ###########################################################
 class FunctionCallNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
 
 ###########################################################
 # ReturnStatementNode -- AST Node of Return Statement
 ###########################################################
 class ReturnStatementNode(AbstractNode):
-    def accept(self, visitor):
-        return visitor.visit(self)
+    accept = dispatch
+
+###########################################################
+# NodeFactory -- creation of expression nodes
+###########################################################
+class NodeFactory:
+    '''
+    Creates the nodes for the parser: create() the expression nodes, which
+    a factory may share, createUnique() the statements, definitions and
+    parameters, which are never shared.
+    '''
+    def create(self, nodeClass, token, children):
+        node = nodeClass(token)
+        node.children = children
+        return node
+
+    def createUnique(self, nodeClass, token, children):
+        return NodeFactory.create(self, nodeClass, token, children)
+
+class HashConsingNodeFactory(NodeFactory):
+    '''
+    Creates every expression subtree only once: a node with the class, the
+    token type and text and the very children of an earlier node is that
+    earlier node, wherever it occurs. Shared nodes can not be changed (their
+    children are tuples) and keep the token of their first occurrence; the
+    positions of all occurrences are kept in the positions side table.
+    '''
+    def __init__(self):
+        self.nodes = {}      # (class, type, text, children ids) -> node
+        self.positions = {}  # node -> token positions of its occurrences
+        self.hits = 0        # number of nodes shared instead of created
+
+    def create(self, nodeClass, token, children):
+        # the children are interned and kept alive, so their ids identify
+        # their structure
+        key = (nodeClass, token.type, token.text) + tuple(
+            id(child) for child in children)
+        node = self.nodes.get(key)
+        if node is None:
+            node = nodeClass(token)
+            node.children = tuple(children)
+            self.nodes[key] = node
+            self.positions[node] = [token.position]
+        else:
+            self.positions[node].append(token.position)
+            self.hits += 1
+        return node
 
 ###########################################################
 # PrintVisitor
@@ -268,3 +388,22 @@ if __name__ == '__main__':
 
     visitor = PrintVisitor();
     root.accept(visitor)
+
+    # a visit() override calling the visit() it overrides sees every node
+    class TracingVisitor(PrintVisitor):
+        def visit(self, node):
+            self.traced.append(node.__class__)
+            return PrintVisitor.visit(self, node)
+    tracing = TracingVisitor()
+    tracing.traced = []
+    root.accept(tracing)
+    assert tracing.traced == [BinaryExpressionNode, BinaryExpressionNode,
+                              IntegerNode, IntegerNode, IntegerNode]
+
+    # a visit method set on a visitor is called instead of the class one
+    visitor = PrintVisitor()
+    visited = []
+    visitor.visitIntegerNode = visited.append
+    root.accept(visitor)
+    visitor.visit(operand1)
+    assert visited == [operand1, operand2, operand3, operand1]
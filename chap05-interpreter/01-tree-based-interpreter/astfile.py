@@ -0,0 +1,276 @@
+###########################################################
+# AST File -- versioned binary format of a FlatTree
+# Layout (little-endian, every section aligned to its item size):
+#     header            magic, version, counts, section offsets
+#     node table        opcodes (u8), operand kinds (u8), subtree ends
+#                       (u32), operands (u32), token positions (i64)
+#     constant pool     integer literals (i64)
+#     string table      offsets (u32, one more than strings) and the
+#                       UTF-8 bytes of the identifiers
+###########################################################
+
+import mmap, struct, sys
+from flatast import *
+
+FORMAT_MAGIC = b'IAST'
+FORMAT_VERSION = 1
+# magic, version, reserved, numbers of nodes, constants and strings, offsets
+# of opcodes, kinds, ends, operands, positions, constants, string offsets and
+# string bytes, and the size of the whole file
+HEADER = struct.Struct('<4sHHIII9I')
+
+# What the operand of a node refers to
+OPERAND_NONE, OPERAND_STRING, OPERAND_CONSTANT = range(3)
+
+# Token texts not stored, they follow from the opcode
+FIXED_TEXTS = {
+    OP_ADD: '+', OP_SUBTRACT: '-', OP_MULTIPLY: '*', OP_DIVIDE: '/',
+    OP_ASSIGN: '=', OP_PLUS: '+', OP_MINUS: '-', OP_RETURN: 'return',
+    OP_STATEMENTS: '_phony_', OP_ARGUMENTS: '_phony_',
+    OP_PARAMETERS: '_phony_', OP_DEFINE: '_phony_', OP_CALL: '_phony_',
+    }
+
+INT64_MAX = 2 ** 63 - 1
+
+def align(offset, size):
+    return (offset + size - 1) // size * size
+
+def pack(typecode, values):
+    return struct.pack('<{count}{typecode}'.format(
+        count = len(values), typecode = typecode), *values)
+
+###########################################################
+# Writer
+###########################################################
+def serialize(root):
+    '''
+    Return the AST file contents of a tree of nodes or of a FlatTree.
+    '''
+    tree = root if isinstance(root, FlatTree) else flatten(root)
+    count = len(tree)
+    kinds, operands = [], []
+    constants, constantIndex = [], {}
+    strings, stringIndex = [], {}
+    for index in range(count):
+        opcode, text = tree.opcodes[index], tree.text(index)
+        if text == FIXED_TEXTS.get(opcode):
+            kinds.append(OPERAND_NONE)
+            operands.append(0)
+        elif (opcode == OP_INTEGER and text.isdigit() and
+              str(int(text)) == text and int(text) <= INT64_MAX):
+            value = int(text)
+            if value not in constantIndex:
+                constantIndex[value] = len(constants)
+                constants.append(value)
+            kinds.append(OPERAND_CONSTANT)
+            operands.append(constantIndex[value])
+        else: # identifiers, and literals the constant pool can not keep
+            if text not in stringIndex:
+                stringIndex[text] = len(strings)
+                strings.append(text)
+            kinds.append(OPERAND_STRING)
+            operands.append(stringIndex[text])
+
+    stringBytes = [text if isinstance(text, bytes) else text.encode('utf-8')
+                   for text in strings]
+    stringOffsets = [0]
+    for text in stringBytes:
+        stringOffsets.append(stringOffsets[-1] + len(text))
+
+    offsets = []
+    offset = HEADER.size
+    for typecode, length in (('B', count), ('B', count), ('I', count),
+                             ('I', count), ('q', count), ('q', len(constants)),
+                             ('I', len(stringOffsets)), ('B', 0)):
+        size = struct.calcsize(typecode)
+        offset = align(offset, size)
+        offsets.append(offset)
+        offset += size * length
+    offset += stringOffsets[-1]
+
+    sections = [
+        pack('B', tree.opcodes), pack('B', kinds), pack('I', tree.ends),
+        pack('I', operands), pack('q', tree.positions), pack('q', constants),
+        pack('I', stringOffsets), b''.join(stringBytes)]
+    data = [HEADER.pack(FORMAT_MAGIC, FORMAT_VERSION, 0, count,
+                        len(constants), len(strings), *(offsets + [offset]))]
+    position = HEADER.size
+    for sectionOffset, section in zip(offsets, sections):
+        data.append(b'\0' * (sectionOffset - position))
+        data.append(section)
+        position = sectionOffset + len(section)
+    return b''.join(data)
+
+def write(root, path):
+    with open(path, 'wb') as file:
+        file.write(serialize(root))
+
+###########################################################
+# Reader
+###########################################################
+class StructColumn:
+    '''
+    Read-only array of little-endian numbers in a buffer, unpacked one at a
+    time; for buffers memoryview can not cast (Python 2, big-endian hosts).
+    '''
+    def __init__(self, buffer, offset, count, typecode):
+        self.buffer = buffer
+        self.offset = offset
+        self.count = count
+        self.struct = struct.Struct('<' + typecode)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError('column index out of range')
+        return self.struct.unpack_from(
+            self.buffer, self.offset + index * self.struct.size)[0]
+
+def column(buffer, offset, count, typecode):
+    '''
+    Return a typed view of count numbers at the offset of a buffer, without
+    copying them.
+    '''
+    if sys.byteorder == 'little':
+        try:
+            view = memoryview(buffer)[offset:offset +
+                                      count * struct.calcsize(typecode)]
+            return view.cast(typecode)
+        except (AttributeError, TypeError):
+            pass
+    return StructColumn(buffer, offset, count, typecode)
+
+class MappedTree(FlatTree):
+    '''
+    FlatTree read from AST file contents in place: the columns are views
+    of the buffer (bytes, or an mmap of the file), nothing is copied but
+    the identifiers, which are decoded on first use. FlatInterpreter runs
+    it directly.
+    '''
+    def __init__(self, buffer):
+        if len(buffer) < HEADER.size:
+            raise Exception('Not an AST file!')
+        fields = HEADER.unpack_from(buffer, 0)
+        magic, version, reserved, count, constants, strings = fields[:6]
+        if magic != FORMAT_MAGIC:
+            raise Exception('Not an AST file!')
+        if version != FORMAT_VERSION:
+            raise Exception('Unsupported AST file version {version}!'.format(
+                version = version))
+        (opcodes, kinds, ends, operands, positions, constantPool,
+         stringOffsets, stringData, size) = fields[6:]
+        if size > len(buffer):
+            raise Exception('Truncated AST file!')
+
+        self.buffer = buffer
+        self.opcodes = column(buffer, opcodes, count, 'B')
+        self.kinds = column(buffer, kinds, count, 'B')
+        self.ends = column(buffer, ends, count, 'I')
+        self.operands = column(buffer, operands, count, 'I')
+        self.positions = column(buffer, positions, count, 'q')
+        self.constants = column(buffer, constantPool, constants, 'q')
+        self.stringOffsets = column(buffer, stringOffsets, strings + 1, 'I')
+        self.stringData = stringData
+        self.strings = [None] * strings # decoded identifiers
+        self.size = size
+
+    def string(self, number):
+        text = self.strings[number]
+        if text is None:
+            start = self.stringData + self.stringOffsets[number]
+            text = bytes(self.buffer[start:self.stringData +
+                                     self.stringOffsets[number + 1]])
+            if not isinstance(text, str):
+                text = text.decode('utf-8')
+            self.strings[number] = text
+        return text
+
+    def text(self, index):
+        kind = self.kinds[index]
+        if kind == OPERAND_STRING:
+            return self.string(self.operands[index])
+        elif kind == OPERAND_CONSTANT:
+            return str(self.constants[self.operands[index]])
+        return FIXED_TEXTS[self.opcodes[index]]
+
+    def integer(self, index):
+        if self.kinds[index] == OPERAND_CONSTANT:
+            return self.constants[self.operands[index]]
+        return int(self.text(index))
+
+    def nbytes(self):
+        return self.size
+
+    def close(self):
+        '''
+        Release the views and unmap a mapped file.
+        '''
+        for view in (self.opcodes, self.kinds, self.ends, self.operands,
+                     self.positions, self.constants, self.stringOffsets):
+            if isinstance(view, memoryview):
+                view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+def load(path):
+    '''
+    Map an AST file into memory and return its MappedTree.
+    '''
+    with open(path, 'rb') as file:
+        mapping = mmap.mmap(file.fileno(), 0, access = mmap.ACCESS_READ)
+    return MappedTree(mapping)
+
+###########################################################
+# Top-level script tests
+###########################################################
+import os, tempfile
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+def printed(root):
+    '''
+    Return what PrintVisitor prints for a tree.
+    '''
+    saveStdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        root.accept(PrintVisitor())
+        return sys.stdout.getvalue()
+    finally:
+        sys.stdout = saveStdout
+
+if __name__ == '__main__':
+    texts = [
+        'f = function(x, y) return x+y end\nfunction g(z) return -z end\n'
+        'a = f(3, 4) * (2 - g(1))\nreturn a\n',
+        'b = 007 + 99999999999999999999 - + 12\nc = (b)(1)(2, b)\n',
+        'function h() k = function(u) return u / 2 end return k end\n'
+        'd = h()(10)\n',
+        'function e() end\n',
+        '',
+        ]
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'program.ast')
+    try:
+        for text in texts:
+            root = Parser(Scanner(CharStream(text))).statements()
+            write(root, path)
+            tree = load(path)
+            assert printed(unflatten(tree)) == printed(root)
+            if text.startswith('f ='):
+                interpreter = FlatInterpreter()
+                interpreter.run(tree)
+                print(interpreter.globalSpace)
+            print('{nodes} nodes, {size} bytes: round trip ok'.format(
+                nodes = len(tree), size = tree.nbytes()))
+            tree.close()
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rmdir(directory)
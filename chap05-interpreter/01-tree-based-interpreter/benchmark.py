@@ -0,0 +1,425 @@
+###########################################################
+# Benchmarks of the Interpreter Engines
+# Usage:
+#     python benchmark.py [statements]
+###########################################################
+
+import os, shutil, sys, tempfile, time
+import multiprocessing, pickle
+from parser import *
+from tokenbuffer import *
+from stackparser import StackParser
+from tableparser import TableParser
+import astfile, bulkparse, compactast, flatast
+from interpreter import Interpreter
+from closurecompiler import ClosureInterpreter
+from stackvm import Code, StackVM
+from registervm import RegisterVM
+from transpiler import TranspiledInterpreter
+from native import NativeInterpreter
+import vectorscan
+
+###########################################################
+# Program generator
+###########################################################
+def generateProgram(statements):
+    '''
+    Generate a script of the given number of assignments that exercises
+    every token type and stays integer valued when it is run.
+    '''
+    lines = ['function add(x, y) return x + y end', 'v0 = 1']
+    for i in range(1, statements):
+        lines.append('v{i} = add(v{j} * 3 / 4, {i} - (2 + {i}) / 5)'.format(
+            i = i, j = i - 1))
+    return '\n'.join(lines) + '\n'
+
+def generateFibonacci(statements):
+    '''
+    Generate a script of about the given number of statements computing
+    Fibonacci numbers with function calls, starting over every 50 numbers
+    so that they stay small.
+    '''
+    lines = ['function fib(a, b) return a + b end']
+    for i in range(statements // 3):
+        if i % 50 == 0:
+            lines.extend(['a = 0', 'b = 1'])
+        lines.extend(['c = fib(a, b)', 'a = b', 'b = c'])
+    return '\n'.join(lines) + '\n'
+
+###########################################################
+# Timing helpers
+###########################################################
+def bestTime(function, repeat = 3):
+    '''
+    Return the best wall-clock time of several runs of the function.
+    '''
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        function()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def report(name, elapsed, count, unit):
+    print('{name:<24} {elapsed:8.4f} s {rate:14.0f} {unit}/s'.format(
+        name = name,
+        elapsed = elapsed,
+        rate = count / elapsed if elapsed else 0,
+        unit = unit))
+
+###########################################################
+# Scanner engines
+###########################################################
+def scanAll(text, engine):
+    scanner = createScanner(CharStream(text), engine)
+    while scanner.currentToken.type != EOF:
+        scanner.nextToken()
+
+def tokenList(text, engine):
+    scanner = createScanner(CharStream(text), engine)
+    tokens = [str(scanner.currentToken)]
+    while scanner.currentToken.type != EOF:
+        scanner.nextToken()
+        tokens.append(str(scanner.currentToken))
+    return tokens
+
+def benchmarkScanners(text):
+    expected = tokenList(text, 'char')
+    for engine in SCANNERS:
+        if tokenList(text, engine) != expected:
+            raise Exception('Scanner \'{engine}\' disagrees!'.format(
+                engine = engine))
+    count = len(expected)
+    for engine in sorted(SCANNERS):
+        report('scanner ({engine})'.format(engine = engine),
+               bestTime(lambda: scanAll(text, engine)), count, 'tokens')
+
+###########################################################
+# Token buffer
+###########################################################
+def tokenObjects(text):
+    scanner = RegexScanner(CharStream(text))
+    tokens = []
+    while scanner.currentToken.type != EOF:
+        tokens.append(scanner.currentToken)
+        scanner.nextToken()
+    return tokens
+
+def benchmarkTokenBuffer(text):
+    tokens = tokenObjects(text)
+    buffer = tokenize(text)
+    report('Token objects', bestTime(lambda: tokenObjects(text)),
+           len(tokens), 'tokens')
+    report('TokenBuffer', bestTime(lambda: tokenize(text)),
+           len(buffer), 'tokens')
+    if vectorscan.numpy is not None:
+        report('TokenBuffer (NumPy)',
+               bestTime(lambda: vectorscan.tokenize(text)),
+               len(buffer), 'tokens')
+    objectBytes = sys.getsizeof(tokens) + sum(
+        sys.getsizeof(token) + sys.getsizeof(token.__dict__)
+        for token in tokens)
+    bufferBytes = buffer.nbytes() + sys.getsizeof(buffer.lexemeTable)
+    print('bytes per token: {objects:.1f} (Token objects), '
+          '{buffer:.1f} (TokenBuffer)'.format(
+              objects = float(objectBytes) / len(tokens),
+              buffer = float(bufferBytes) / len(buffer)))
+
+###########################################################
+# Parsers
+###########################################################
+def countNodes(root):
+    count, stack = 0, [root]
+    while stack:
+        node = stack.pop()
+        count += 1
+        stack.extend(node.children)
+    return count
+
+def benchmarkParsers(text):
+    # parse from a TokenBuffer, so that only the parsers are timed
+    buffer = tokenize(text)
+    parsers = [('Parser (recursive)', Parser),
+               ('StackParser', StackParser),
+               ('TableParser (LL(1))', TableParser)]
+    expected = countNodes(Parser(TokenCursor(buffer)).statements())
+    for name, parserClass in parsers:
+        if countNodes(parserClass(TokenCursor(buffer)).statements()) != expected:
+            raise Exception('Parser \'{name}\' disagrees!'.format(name = name))
+        report(name,
+               bestTime(lambda: parserClass(TokenCursor(buffer)).statements()),
+               len(buffer), 'tokens')
+
+def countDistinctNodes(root):
+    seen, stack = set(), [root]
+    while stack:
+        node = stack.pop()
+        if id(node) not in seen:
+            seen.add(id(node))
+            stack.extend(node.children)
+    return len(seen)
+
+def benchmarkHashConsing(text):
+    buffer = tokenize(text)
+    root = Parser(TokenCursor(buffer)).statements()
+    factory = HashConsingNodeFactory()
+    shared = Parser(TokenCursor(buffer), factory).statements()
+    report('Parser (hash-consing)',
+           bestTime(lambda: Parser(TokenCursor(buffer),
+                                   HashConsingNodeFactory()).statements()),
+           len(buffer), 'tokens')
+    print('nodes: {nodes} (plain), {shared} (hash-consed)'.format(
+        nodes = countDistinctNodes(root),
+        shared = countDistinctNodes(shared)))
+
+###########################################################
+# AST representations
+###########################################################
+def objectBytes(object):
+    size = sys.getsizeof(object)
+    if hasattr(object, '__dict__'):
+        size += sys.getsizeof(object.__dict__)
+    return size
+
+def storedChildren(node):
+    '''
+    Return the children container a node keeps, None for the compact nodes
+    building their children tuple on demand.
+    '''
+    if isinstance(getattr(type(node), 'children', None), (property, tuple)):
+        return None
+    return node.children
+
+def nodeBytes(root):
+    '''
+    Return the size of the nodes of a tree with their tokens and children
+    containers, counting shared objects once.
+    '''
+    size, seen, stack = 0, set(), [root]
+    while stack:
+        node = stack.pop()
+        for part in (node, node.token, storedChildren(node)):
+            if part is not None and id(part) not in seen:
+                seen.add(id(part))
+                size += objectBytes(part)
+        stack.extend(node.children)
+    return size
+
+def benchmarkFlatTree(text):
+    root = Parser(RegexScanner(CharStream(text))).statements()
+    tree = flatast.flatten(root)
+    report('flatten', bestTime(lambda: flatast.flatten(root)), len(tree),
+           'nodes')
+    report('unflatten', bestTime(lambda: flatast.unflatten(tree)), len(tree),
+           'nodes')
+    data = astfile.serialize(tree)
+    report('AST file (write)', bestTime(lambda: astfile.serialize(tree)),
+           len(tree), 'nodes')
+    report('AST file (load)', bestTime(lambda: astfile.MappedTree(data)),
+           len(tree), 'nodes')
+    print('bytes per node: {nodes:.1f} (node objects), '
+          '{flat:.1f} (FlatTree), {file:.1f} (AST file)'.format(
+              nodes = float(nodeBytes(root)) / len(tree),
+              flat = float(tree.nbytes() + sys.getsizeof(tree.texts)) /
+                     len(tree),
+              file = float(len(data)) / len(tree)))
+
+def benchmarkCompactNodes(text):
+    root = Parser(RegexScanner(CharStream(text))).statements()
+    nodes = countNodes(root)
+    report('compact', bestTime(lambda: compactast.compact(root)), nodes,
+           'nodes')
+    report('parse (node objects)',
+           bestTime(lambda: Parser(RegexScanner(CharStream(text)))
+                    .statements()), nodes, 'nodes')
+    report('parse (compact nodes)',
+           bestTime(lambda: Parser(RegexScanner(CharStream(text)),
+                                   compactast.CompactNodeFactory())
+                    .statements()), nodes, 'nodes')
+    print('bytes per node: {nodes:.1f} (node objects), '
+          '{compact:.1f} (compact nodes)'.format(
+              nodes = float(nodeBytes(root)) / nodes,
+              compact = float(nodeBytes(compactast.compact(root))) / nodes))
+
+###########################################################
+# Visitors
+###########################################################
+class CountingVisitor(AbstractNodeVisitor):
+    '''
+    Visits every node of a tree through visit() and counts them.
+    '''
+    def __init__(self):
+        self.count = 0
+
+    def visitChildren(self, node):
+        self.count += 1
+        for child in node.children:
+            self.visit(child)
+
+    visitBinaryExpressionNode = visitChildren
+    visitIntegerNode = visitChildren
+    visitUnaryExpressionNode = visitChildren
+    visitIdentifierNode = visitChildren
+    visitStatementListNode = visitChildren
+    visitFunctionArgumentsNode = visitChildren
+    visitFunctionParametersNode = visitChildren
+    visitFunctionDefinitionNode = visitChildren
+    visitFunctionCallNode = visitChildren
+    visitReturnStatementNode = visitChildren
+
+class IsinstanceCountingVisitor(CountingVisitor):
+    '''
+    CountingVisitor with the visit() AbstractNodeVisitor had before the
+    visit tables: a chain of isinstance() tests on every visit.
+    '''
+    def visit(self, node):
+        if isinstance(node, BinaryExpressionNode):
+            return self.visitBinaryExpressionNode(node)
+        elif isinstance(node, IntegerNode):
+            return self.visitIntegerNode(node)
+        elif isinstance(node, UnaryExpressionNode):
+            return self.visitUnaryExpressionNode(node)
+        elif isinstance(node, IdentifierNode):
+            return self.visitIdentifierNode(node)
+        elif isinstance(node, StatementListNode):
+            return self.visitStatementListNode(node)
+        elif isinstance(node, FunctionArgumentsNode):
+            return self.visitFunctionArgumentsNode(node)
+        elif isinstance(node, FunctionParametersNode):
+            return self.visitFunctionParametersNode(node)
+        elif isinstance(node, FunctionDefinitionNode):
+            return self.visitFunctionDefinitionNode(node)
+        elif isinstance(node, FunctionCallNode):
+            return self.visitFunctionCallNode(node)
+        elif isinstance(node, ReturnStatementNode):
+            return self.visitReturnStatementNode(node)
+
+def benchmarkVisitors(text):
+    root = Parser(RegexScanner(CharStream(text))).statements()
+    nodes = countNodes(root)
+    compactRoot = compactast.compact(root)
+    for name, visitorClass, tree in (
+            ('visit (isinstance chain)', IsinstanceCountingVisitor, root),
+            ('visit (tables)', CountingVisitor, root),
+            ('visit (chain, compact)', IsinstanceCountingVisitor,
+             compactRoot),
+            ('visit (tables, compact)', CountingVisitor, compactRoot)):
+        report(name, bestTime(lambda: visitorClass().visit(tree)), nodes,
+               'nodes')
+
+###########################################################
+# Execution engines
+###########################################################
+def instructionCount(code, width):
+    '''
+    Return the number of instructions of width integers in a Code and in
+    the functions it defines.
+    '''
+    count = len(code.instructions) // width
+    for value in code.constants:
+        if isinstance(value, Code):
+            count += instructionCount(value, width)
+    return count
+
+def benchmarkEngines(statements):
+    for name, text in (('arith', generateProgram(statements)),
+                       ('fib', generateFibonacci(statements))):
+        root = Parser(RegexScanner(CharStream(text))).statements()
+        nodes = countNodes(root)
+        report('Interpreter ({name})'.format(name = name),
+               bestTime(lambda: root.accept(Interpreter())), nodes, 'nodes')
+        report('closure compile ({name})'.format(name = name),
+               bestTime(lambda: ClosureInterpreter().compile(root)), nodes,
+               'nodes')
+        interpreter = ClosureInterpreter()
+        program = interpreter.compile(root)
+        symbols = interpreter.globalSpace.symval
+        report('closures ({name})'.format(name = name),
+               bestTime(lambda: (symbols.clear(), program(symbols))), nodes,
+               'nodes')
+        vm = StackVM()
+        code = vm.compile(root)
+        symbols = vm.globalSpace.symval
+        report('bytecode compile ({name})'.format(name = name),
+               bestTime(lambda: vm.compile(root)), nodes, 'nodes')
+        report('stack VM ({name})'.format(name = name),
+               bestTime(lambda: (symbols.clear(), vm.execute(code))), nodes,
+               'nodes')
+        registerVM = RegisterVM()
+        registerCode = registerVM.compile(root)
+        registerSymbols = registerVM.globalSpace.symval
+        report('register compile ({name})'.format(name = name),
+               bestTime(lambda: registerVM.compile(root)), nodes, 'nodes')
+        report('register VM ({name})'.format(name = name),
+               bestTime(lambda: (registerSymbols.clear(),
+                                 registerVM.execute(registerCode))),
+               nodes, 'nodes')
+        python = TranspiledInterpreter()
+        pythonCode, positions = python.compile(root)
+        pythonSymbols = python.globalSpace.symval
+        report('transpile ({name})'.format(name = name),
+               bestTime(lambda: python.transpiler.transpile(root)), nodes,
+               'nodes')
+        report('Python ({name})'.format(name = name),
+               bestTime(lambda: (pythonSymbols.clear(),
+                                 python.execute(pythonCode, positions))),
+               nodes, 'nodes')
+        native = NativeInterpreter()
+        nativeCode, positions = native.compile(root) # builds the C once
+        nativeSymbols = native.globalSpace.symval
+        report('native ({name})'.format(name = name),
+               bestTime(lambda: (nativeSymbols.clear(),
+                                 native.execute(nativeCode, positions))),
+               nodes, 'nodes')
+        print('instructions: {nodes} nodes, {stack} (stack VM), '
+              '{register} (register VM)'.format(
+                  nodes = nodes, stack = instructionCount(code, 2),
+                  register = instructionCount(registerCode, 4)))
+
+###########################################################
+# Bulk parsing
+###########################################################
+def benchmarkBulkParsing(text, files = 16):
+    directory = tempfile.mkdtemp()
+    try:
+        paths = []
+        for i in range(files):
+            paths.append(os.path.join(directory, '{i}.txt'.format(i = i)))
+            with open(paths[-1], 'w') as file:
+                file.write(text)
+        report('files (1 process)',
+               bestTime(lambda: [bulkparse.parseFile(path) for path in paths],
+                        1), files, 'files')
+        processes = 1
+        while processes <= multiprocessing.cpu_count():
+            report('files ({processes} in pool)'.format(processes = processes),
+                   bestTime(lambda: list(bulkparse.parseFiles(paths,
+                                                              processes)), 1),
+                   files, 'files')
+            processes *= 2
+    finally:
+        shutil.rmtree(directory)
+    root = Parser(RegexScanner(CharStream(text))).statements()
+    print('bytes per tree: {encoded} (encoded), {pickled} (pickled)'.format(
+        encoded = len(bulkparse.encode(root)),
+        pickled = len(pickle.dumps(root, pickle.HIGHEST_PROTOCOL))))
+
+###########################################################
+# Top-level script tests
+###########################################################
+if __name__ == '__main__':
+    statements = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    text = generateProgram(statements)
+    print('{statements} statements, {size} characters'.format(
+        statements = statements, size = len(text)))
+    benchmarkScanners(text)
+    benchmarkTokenBuffer(text)
+    benchmarkParsers(text)
+    benchmarkHashConsing(text)
+    benchmarkFlatTree(text)
+    benchmarkCompactNodes(text)
+    benchmarkVisitors(text)
+    benchmarkEngines(statements)
+    benchmarkBulkParsing(text)
@@ -0,0 +1,148 @@
+###########################################################
+# Bulk Parsing -- many script files parsed by a process pool
+###########################################################
+
+import marshal, multiprocessing
+from array import array
+from parser import *
+from tokenbuffer import POSITION_TYPECODE
+
+# Node classes and token types by their one-byte code
+NODE_CLASSES = (
+    BinaryExpressionNode, IntegerNode, UnaryExpressionNode, IdentifierNode,
+    StatementListNode, FunctionArgumentsNode, FunctionParametersNode,
+    FunctionDefinitionNode, FunctionCallNode, ReturnStatementNode)
+CODE_OF_CLASS = dict((nodeClass, code)
+                     for code, nodeClass in enumerate(NODE_CLASSES))
+
+PHONY_TYPES = (STATEMENTS, ARGUMENTS, PARAMETERS, CALL, DEFINE)
+TYPES = (
+    INTEGER, PLUS, MINUS, MUL, DIV, LPAREN, RPAREN, IDENTIFIER, ASSIGN, EOF,
+    COMMA, FUNCTION, END, RETURN) + PHONY_TYPES
+CODE_OF_TYPE = dict((type, code) for code, type in enumerate(TYPES))
+
+###########################################################
+# Compact AST encoding
+###########################################################
+def encode(root):
+    '''
+    Serialize a tree into a compact string: the nodes in preorder as
+    parallel arrays of node class, token type, token position, number of
+    children and token text, the texts interned in a table.
+    '''
+    classes, types, counts = array('B'), array('B'), array('I')
+    positions, texts = array(POSITION_TYPECODE), array('I')
+    textTable, textIndex = [], {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        token = node.token
+        classes.append(CODE_OF_CLASS[node.__class__])
+        types.append(CODE_OF_TYPE[token.type])
+        positions.append(token.position)
+        counts.append(len(node.children))
+        index = textIndex.get(token.text)
+        if index is None:
+            index = textIndex[token.text] = len(textTable)
+            textTable.append(token.text)
+        texts.append(index)
+        stack.extend(reversed(node.children))
+    return marshal.dumps((toBytes(classes), toBytes(types),
+                          toBytes(positions), toBytes(counts),
+                          toBytes(texts), textTable))
+
+def toBytes(column):
+    # Python 2 arrays only have tostring()
+    if hasattr(column, 'tobytes'):
+        return column.tobytes()
+    return column.tostring()
+
+def fromBytes(typecode, data):
+    column = array(typecode)
+    if hasattr(column, 'frombytes'):
+        column.frombytes(data)
+    else:
+        column.fromstring(data)
+    return column
+
+def decode(data):
+    '''
+    Rebuild the tree of an encode() result.
+    '''
+    classes, types, positions, counts, texts, textTable = marshal.loads(data)
+    classes, types = fromBytes('B', classes), fromBytes('B', types)
+    positions = fromBytes(POSITION_TYPECODE, positions)
+    counts, texts = fromBytes('I', counts), fromBytes('I', texts)
+
+    root = None
+    pending = [] # [node, number of children still to come]
+    for index in range(len(classes)):
+        type = TYPES[types[index]]
+        if type in PHONY_TYPES:
+            token = PhonyToken(type, positions[index])
+        else:
+            token = Token(type, textTable[texts[index]], positions[index])
+        node = NODE_CLASSES[classes[index]](token)
+        if pending:
+            parent = pending[-1]
+            parent[0].addChild(node)
+            parent[1] -= 1
+            if parent[1] == 0:
+                pending.pop()
+        else:
+            root = node
+        if counts[index]:
+            pending.append([node, counts[index]])
+    return root
+
+###########################################################
+# Process pool front end
+###########################################################
+def parseFile(path, engine = 'regex'):
+    '''
+    Parse one script file; return the path with the encoded tree or with
+    the error message.
+    '''
+    try:
+        with open(path, 'rb') as file, MMapCharStream(file) as charStream:
+            root = Parser(createScanner(charStream, engine)).statements()
+        return path, encode(root), None
+    except Exception as error:
+        return path, None, '{path}: {error}'.format(path = path, error = error)
+
+def parseFiles(paths, processes = None, chunkSize = 16):
+    '''
+    Parse script files in a pool of processes (one per core by default),
+    handing them out in chunks of chunkSize paths. Yield (path, data, error)
+    in the order the files are done: data is the encoded tree, to be
+    turned into nodes with decode(), or None with the error message of the
+    file.
+    '''
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(parseFile, paths, chunkSize):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+###########################################################
+# Top-level script tests
+###########################################################
+import sys
+if __name__ == '__main__':
+    '''
+    Parse the script files given, for example:
+    python bulkparse.py scripts/*.txt
+    '''
+    parsed = failed = size = 0
+    for path, data, error in parseFiles(sys.argv[1:]):
+        if error is not None:
+            print(error)
+            failed += 1
+        else:
+            decode(data)
+            parsed += 1
+            size += len(data)
+    print('{parsed} parsed ({size} bytes of trees), {failed} failed'.format(
+        parsed = parsed, size = size, failed = failed))
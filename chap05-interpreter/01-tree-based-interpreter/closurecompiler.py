@@ -0,0 +1,198 @@
+###########################################################
+# Closure Compiler -- the AST compiled once into Python closures
+###########################################################
+
+import gc
+from interpreter import *
+
+class CompiledFunction(object):
+    '''
+    Function value: the parameter names and the compiled body of a
+    function definition.
+    '''
+    def __init__(self, node, parameters, body):
+        self.node = node             # the FunctionDefinitionNode
+        self.name = node.token.text
+        self.parameters = parameters # names, in order
+        self.body = body             # closure of the statements
+
+class ClosureCompiler(AbstractNodeVisitor):
+    '''
+    Turns every node into a closure specialised for its node class and
+    token type, holding the closures of its children. A closure takes the
+    symbol table (dict) of the current memory space and returns the value
+    of its node; node types are only tested while compiling.
+    '''
+    def __init__(self, interpreter):
+        self.interpreter = interpreter # for the global memory, call stack
+                                       # and source of diagnostics
+
+    def compile(self, node):
+        return self.visit(node)
+
+    def visitBinaryExpressionNode(self, node):
+        type = node.token.type
+        if type == ASSIGN:
+            return self.compileAssignment(node)
+        lhs = self.visit(node.children[0])
+        rhs = self.visit(node.children[1])
+        if type == PLUS:
+            def add(scope):
+                return lhs(scope) + rhs(scope)
+            return add
+        elif type == MINUS:
+            def subtract(scope):
+                return lhs(scope) - rhs(scope)
+            return subtract
+        elif type == MUL:
+            def multiply(scope):
+                return lhs(scope) * rhs(scope)
+            return multiply
+        elif type == DIV:
+            def divide(scope):
+                return lhs(scope) / rhs(scope)
+            return divide
+        return self.nothing
+
+    def compileAssignment(self, node):
+        name = node.children[0].token.text
+        expression = self.visit(node.children[1])
+        globalSymbols = self.interpreter.globalSpace.symval
+        def assign(scope):
+            value = expression(scope)
+            # a global of the name is updated, unless it is shadowed
+            if (scope.get(name) is None and
+                globalSymbols.get(name) is not None):
+                globalSymbols[name] = value
+            scope[name] = value
+        return assign
+
+    def visitIntegerNode(self, node):
+        value = int(node.token.text)
+        def integer(scope):
+            return value
+        return integer
+
+    def visitUnaryExpressionNode(self, node):
+        operand = self.visit(node.children[0])
+        if node.token.type == PLUS:
+            return operand
+        elif node.token.type == MINUS:
+            def negate(scope):
+                return -operand(scope)
+            return negate
+        return self.nothing
+
+    def visitIdentifierNode(self, node):
+        name = node.token.text
+        position = node.token.position
+        interpreter = self.interpreter
+        globalSymbols = interpreter.globalSpace.symval
+        def identifier(scope):
+            value = scope.get(name)
+            if value is None:
+                value = globalSymbols.get(name)
+                if value is None:
+                    raise Exception(
+                        '{position} : Undefined symbol \'{name}\'!'.format(
+                            position = describePosition(
+                                interpreter.charStream, position),
+                            name = name))
+            return value
+        return identifier
+
+    def visitStatementListNode(self, node):
+        children = tuple(self.visit(child) for child in node.children)
+        def statements(scope):
+            for statement in children:
+                statement(scope)
+        return statements
+
+    def visitFunctionArgumentsNode(self, node):
+        return self.nothing # compiled with the function call
+
+    def visitFunctionParametersNode(self, node):
+        return self.nothing # compiled with the function definition
+
+    def visitFunctionCallNode(self, node):
+        # For the sake of simplicity, closures are not considered here.
+        callee = self.visit(node.children[0])
+        arguments = tuple(self.visit(child)
+                          for child in node.children[1].children)
+        position = node.token.position
+        interpreter = self.interpreter
+        callStack = interpreter.callStack
+        def call(scope):
+            function = callee(scope)
+            if len(function.parameters) != len(arguments):
+                raise Exception('{position}: Arguments mismatch!'.format(
+                    position = describePosition(interpreter.charStream,
+                                                position)))
+            funcspace = MemorySpace(function.name)
+            symval = funcspace.symval
+            symval['ans'] = None # return value
+            for parameter, argument in zip(function.parameters, arguments):
+                symval[parameter] = argument(scope)
+            callStack.append(funcspace)
+            function.body(symval)
+            callStack.pop()
+            return symval['ans']
+        return call
+
+    def visitFunctionDefinitionNode(self, node):
+        function = CompiledFunction(
+            node,
+            tuple(child.token.text for child in node.children[0].children),
+            self.visit(node.children[1]))
+        def define(scope):
+            return function
+        return define
+
+    def visitReturnStatementNode(self, node):
+        value = self.visit(node.children[0])
+        def returnValue(scope):
+            scope['ans'] = value(scope)
+        return returnValue
+
+    def nothing(self, scope):
+        pass
+
+class ClosureInterpreter(Interpreter):
+    '''
+    Interpreter compiling a tree with a ClosureCompiler, then running it by
+    calling its closure on the global memory.
+    '''
+    def __init__(self, charStream = None):
+        Interpreter.__init__(self, charStream)
+        self.compiler = ClosureCompiler(self)
+
+    def compile(self, root):
+        # Compiling allocates a few objects for every node and frees none,
+        # which would only make the garbage collector scan the growing
+        # heap over and over.
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self.compiler.compile(root)
+        finally:
+            if enabled:
+                gc.enable()
+
+    def run(self, root):
+        return self.compile(root)(self.globalSpace.symval)
+
+    def visit(self, node):
+        # accept() and runStream() run nodes through here
+        return self.run(node)
+
+###########################################################
+# Top-level script tests
+###########################################################
+if __name__ == '__main__':
+    texts = ENGINE_TEST_TEXTS + [
+        'f0 = 0\nf1 = 1\n' + ''.join(
+            'f{i} = f{j} + f{k}\n'.format(i = i, j = i - 1, k = i - 2)
+            for i in range(2, 50)),
+        ]
+    for engine, result in compareWithInterpreter(ClosureInterpreter, texts):
+        print(result)
@@ -0,0 +1,203 @@
+###########################################################
+# Compact AST -- memory-lean tokens and nodes using __slots__
+###########################################################
+
+from parser import *
+
+###########################################################
+# Compact tokens
+###########################################################
+class CompactToken(object):
+    __slots__ = ('type', 'text', 'position')
+
+    def __init__(self, type, text, position):
+        self.type = type         # token type
+        self.text = text         # token text
+        self.position = position # position of the first token character
+
+    def __str__(self):
+        return '{type}({position}): {text}'.format(
+            position = self.position,
+            type = self.type,
+            text = self.text)
+
+class CompactPhonyToken(CompactToken):
+    __slots__ = ()
+
+    def __init__(self, type, position = 0):
+        CompactToken.__init__(self, type, '_phony_', position)
+
+# The parsers put phony tokens at position 0, so one of each type is enough
+PHONY_TOKENS = dict((type, CompactPhonyToken(type))
+                    for type in (STATEMENTS, ARGUMENTS, PARAMETERS, CALL,
+                                 DEFINE))
+
+def compactToken(token):
+    '''
+    Return the CompactToken of a Token, shared for phony tokens.
+    '''
+    if isinstance(token, PhonyToken) and token.position == 0:
+        return PHONY_TOKENS[token.type]
+    return CompactToken(token.type, token.text, token.position)
+
+###########################################################
+# Compact nodes
+# Every node takes its token and the list of its children. Nodes with a
+# fixed number of children keep them in fields and build the children
+# tuple on demand; only the list nodes keep a children list.
+###########################################################
+class CompactLeafNode(object):
+    __slots__ = ('token',)
+    children = ()
+
+    def __init__(self, token, children = ()):
+        self.token = token
+
+class CompactUnaryNode(object):
+    __slots__ = ('token', 'operand')
+
+    def __init__(self, token, children):
+        self.token = token
+        self.operand, = children
+
+    @property
+    def children(self):
+        return (self.operand,)
+
+class CompactBinaryNode(object):
+    __slots__ = ('token', 'lhs', 'rhs')
+
+    def __init__(self, token, children):
+        self.token = token
+        self.lhs, self.rhs = children
+
+    @property
+    def children(self):
+        return (self.lhs, self.rhs)
+
+class CompactListNode(object):
+    __slots__ = ('token', 'children')
+
+    def __init__(self, token, children = ()):
+        self.token = token
+        self.children = list(children)
+
+    def addChild(self, node):
+        self.children.append(node)
+
+class CompactBinaryExpressionNode(CompactBinaryNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactIntegerNode(CompactLeafNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactUnaryExpressionNode(CompactUnaryNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactIdentifierNode(CompactLeafNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactStatementListNode(CompactListNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactFunctionArgumentsNode(CompactListNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactFunctionParametersNode(CompactListNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactFunctionDefinitionNode(CompactBinaryNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactFunctionCallNode(CompactBinaryNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+class CompactReturnStatementNode(CompactUnaryNode):
+    __slots__ = ()
+
+    accept = dispatch
+
+COMPACT_CLASSES = {
+    BinaryExpressionNode: CompactBinaryExpressionNode,
+    IntegerNode: CompactIntegerNode,
+    UnaryExpressionNode: CompactUnaryExpressionNode,
+    IdentifierNode: CompactIdentifierNode,
+    StatementListNode: CompactStatementListNode,
+    FunctionArgumentsNode: CompactFunctionArgumentsNode,
+    FunctionParametersNode: CompactFunctionParametersNode,
+    FunctionDefinitionNode: CompactFunctionDefinitionNode,
+    FunctionCallNode: CompactFunctionCallNode,
+    ReturnStatementNode: CompactReturnStatementNode,
+    }
+
+# The node classes are abstract base classes: registering the compact
+# classes makes the visitors take them for the nodes they stand for.
+for nodeClass, compactClass in COMPACT_CLASSES.items():
+    nodeClass.register(compactClass)
+
+class CompactNodeFactory(NodeFactory):
+    '''
+    Makes a parser build compact nodes and tokens directly, so no tree of
+    node objects is ever built: Parser(scanner, CompactNodeFactory()).
+    '''
+    def create(self, nodeClass, token, children):
+        return COMPACT_CLASSES[nodeClass](compactToken(token), children)
+
+    createUnique = create
+
+def compact(root):
+    '''
+    Return the compact copy of a tree of nodes, e.g. of a tree loaded from
+    elsewhere; parsers build compact trees with a CompactNodeFactory.
+    '''
+    done = [] # compact subtrees waiting for their parent
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            start = len(done) - len(node.children)
+            children = done[start:]
+            del done[start:]
+            done.append(COMPACT_CLASSES[node.__class__](
+                compactToken(node.token), children))
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+    return done[0]
+
+###########################################################
+# Top-level script tests
+###########################################################
+from interpreter import Interpreter
+from astfile import printed
+from parsecache import nodes
+if __name__ == '__main__':
+    text = 'f = function(x, y) return x+y end\nfunction g(z) return -z end\n' \
+           'a = f(3, 4) * (2 - g(1))\nreturn a\n'
+    root = Parser(Scanner(CharStream(text)),
+                  CompactNodeFactory()).statements()
+    assert (printed(root) ==
+            printed(compact(Parser(Scanner(CharStream(text))).statements())))
+    assert all(type(node) in COMPACT_CLASSES.values() for node in nodes(root))
+    root.accept(PrintVisitor())
+    interpreter = Interpreter()
+    root.accept(interpreter)
+    print(interpreter.globalSpace)
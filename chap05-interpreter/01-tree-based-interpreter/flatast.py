@@ -0,0 +1,371 @@
+###########################################################
+# Flat AST -- a tree as preorder arrays instead of node objects
+###########################################################
+
+import weakref
+from array import array
+from parser import *
+from tokenbuffer import POSITION_TYPECODE
+from interpreter import Interpreter
+from memory import *
+
+# Opcodes, one for every node class and token type pair of the parser
+OP_ADD, OP_SUBTRACT, OP_MULTIPLY, OP_DIVIDE, OP_ASSIGN, OP_PLUS, OP_MINUS, \
+OP_INTEGER, OP_IDENTIFIER, OP_STATEMENTS, OP_ARGUMENTS, OP_PARAMETERS,     \
+OP_DEFINE, OP_CALL, OP_RETURN = range(15)
+
+OPCODE_NODES = (
+    (BinaryExpressionNode, PLUS), (BinaryExpressionNode, MINUS),
+    (BinaryExpressionNode, MUL), (BinaryExpressionNode, DIV),
+    (BinaryExpressionNode, ASSIGN),
+    (UnaryExpressionNode, PLUS), (UnaryExpressionNode, MINUS),
+    (IntegerNode, INTEGER), (IdentifierNode, IDENTIFIER),
+    (StatementListNode, STATEMENTS), (FunctionArgumentsNode, ARGUMENTS),
+    (FunctionParametersNode, PARAMETERS), (FunctionDefinitionNode, DEFINE),
+    (FunctionCallNode, CALL), (ReturnStatementNode, RETURN),
+    )
+OPCODE_OF_NODE = dict((node, opcode)
+                      for opcode, node in enumerate(OPCODE_NODES))
+PHONY_OPCODES = (OP_STATEMENTS, OP_ARGUMENTS, OP_PARAMETERS, OP_DEFINE,
+                 OP_CALL)
+
+class FlatTree:
+    '''
+    An AST as parallel arrays over its nodes in preorder: the opcode, the
+    index of the end of the subtree (which is where the next sibling
+    starts), the index of the token text in the texts table and the token
+    position. The first child of node i is node i + 1.
+    '''
+    def __init__(self):
+        self.opcodes = array('B')
+        self.ends = array('I')
+        self.operands = array('I')
+        self.positions = array(POSITION_TYPECODE)
+        self.texts = []
+        self.textIndex = {}
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def intern(self, text):
+        index = self.textIndex.get(text)
+        if index is None:
+            index = self.textIndex[text] = len(self.texts)
+            self.texts.append(text)
+        return index
+
+    def text(self, index):
+        return self.texts[self.operands[index]]
+
+    def integer(self, index):
+        '''
+        Return the value of the integer literal at the index.
+        '''
+        return int(self.texts[self.operands[index]])
+
+    def children(self, index):
+        '''
+        Iterate over the indexes of the children of the node at the index.
+        '''
+        child, end = index + 1, self.ends[index]
+        ends = self.ends
+        while child < end:
+            yield child
+            child = ends[child]
+
+    def child(self, index, number):
+        '''
+        Return the index of a child of the node at the index.
+        '''
+        child = index + 1
+        for i in range(number):
+            child = self.ends[child]
+        return child
+
+    def nbytes(self):
+        return sum(column.buffer_info()[1] * column.itemsize for column in
+                   (self.opcodes, self.ends, self.operands, self.positions))
+
+###########################################################
+# Converters
+###########################################################
+def flatten(root):
+    '''
+    Return the FlatTree of a tree of nodes.
+    '''
+    tree = FlatTree()
+    opcodes, ends = tree.opcodes, tree.ends
+    operands, positions = tree.operands, tree.positions
+    stack = [root]
+    unfinished = [] # indexes of the nodes whose subtrees are not done yet
+    while stack:
+        node = stack.pop()
+        if node is None: # all children of the innermost open node are done
+            ends[unfinished.pop()] = len(opcodes)
+            continue
+        token = node.token
+        unfinished.append(len(opcodes))
+        opcodes.append(OPCODE_OF_NODE[(node.__class__, token.type)])
+        ends.append(0)
+        operands.append(tree.intern(token.text))
+        positions.append(token.position)
+        stack.append(None)
+        stack.extend(reversed(node.children))
+    return tree
+
+def unflatten(tree, index = 0):
+    '''
+    Rebuild the node tree of the subtree at the index of a FlatTree.
+    '''
+    root = None
+    pending = [] # (node, end of its subtree)
+    for i in range(index, tree.ends[index]):
+        nodeClass, type = OPCODE_NODES[tree.opcodes[i]]
+        if tree.opcodes[i] in PHONY_OPCODES:
+            token = PhonyToken(type, tree.positions[i])
+        else:
+            token = Token(type, tree.text(i), tree.positions[i])
+        node = nodeClass(token)
+        while pending and pending[-1][1] <= i:
+            pending.pop()
+        if pending:
+            pending[-1][0].addChild(node)
+        else:
+            root = node
+        pending.append((node, tree.ends[i]))
+    return root
+
+###########################################################
+# FlatCursor -- navigation over a FlatTree
+###########################################################
+class FlatCursor:
+    '''
+    Points at one node of a FlatTree and moves to its relatives.
+    '''
+    def __init__(self, tree, index = 0):
+        self.tree = tree
+        self.index = index
+        self.parents = []  # indexes of the ancestors, innermost last
+
+    def opcode(self):
+        return self.tree.opcodes[self.index]
+
+    def token(self):
+        '''
+        Build the Token of the current node.
+        '''
+        nodeClass, type = OPCODE_NODES[self.opcode()]
+        return Token(type, self.tree.text(self.index),
+                     self.tree.positions[self.index])
+
+    def gotoFirstChild(self):
+        if self.index + 1 >= self.tree.ends[self.index]:
+            return False
+        self.parents.append(self.index)
+        self.index += 1
+        return True
+
+    def gotoNextSibling(self):
+        if (not self.parents or
+            self.tree.ends[self.index] >= self.tree.ends[self.parents[-1]]):
+            return False
+        self.index = self.tree.ends[self.index]
+        return True
+
+    def gotoParent(self):
+        if not self.parents:
+            return False
+        self.index = self.parents.pop()
+        return True
+
+###########################################################
+# FlatInterpreter -- runs a FlatTree without node objects
+###########################################################
+class FlatFunction:
+    '''
+    Function value: the definition at an index of a FlatTree, with its
+    name, parameter names and body index looked up once.
+    '''
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+        self.name = tree.text(index)
+        self.parameters = tuple(tree.text(parameter)
+                                for parameter in tree.children(index + 1))
+        self.body = tree.ends[index + 1]
+
+class FlatInterpreter(Interpreter):
+    '''
+    The Interpreter on the indexes of a FlatTree: visit() dispatches on
+    the opcode through a table of methods taking the node index.
+    '''
+    def __init__(self, charStream = None):
+        Interpreter.__init__(self, charStream)
+        self.tree = None
+        # tree -> {call index: argument indexes}, filled on the first call
+        self.callArguments = weakref.WeakKeyDictionary()
+        self.freeSpaces = [] # memory spaces of returned calls, for reuse
+        self.dispatch = [None] * len(OPCODE_NODES)
+        for opcode, method in (
+            (OP_ADD, self.visitAdd), (OP_SUBTRACT, self.visitSubtract),
+            (OP_MULTIPLY, self.visitMultiply), (OP_DIVIDE, self.visitDivide),
+            (OP_ASSIGN, self.visitAssign), (OP_PLUS, self.visitPlus),
+            (OP_MINUS, self.visitMinus), (OP_INTEGER, self.visitInteger),
+            (OP_IDENTIFIER, self.visitIdentifier),
+            (OP_STATEMENTS, self.visitStatements),
+            (OP_ARGUMENTS, self.visitNothing),
+            (OP_PARAMETERS, self.visitNothing),
+            (OP_DEFINE, self.visitDefine), (OP_CALL, self.visitCall),
+            (OP_RETURN, self.visitReturn)):
+            self.dispatch[opcode] = method
+
+    def run(self, tree, index = 0):
+        self.tree = tree
+        return self.visitIndex(index)
+
+    def visitIndex(self, index):
+        return self.dispatch[self.tree.opcodes[index]](index)
+
+    def operands(self, index):
+        return self.visitIndex(index + 1), self.visitIndex(
+            self.tree.ends[index + 1])
+
+    def visitAdd(self, index):
+        lhs, rhs = self.operands(index)
+        return lhs + rhs
+
+    def visitSubtract(self, index):
+        lhs, rhs = self.operands(index)
+        return lhs - rhs
+
+    def visitMultiply(self, index):
+        lhs, rhs = self.operands(index)
+        return lhs * rhs
+
+    def visitDivide(self, index):
+        lhs, rhs = self.operands(index)
+        return lhs / rhs
+
+    def visitAssign(self, index):
+        name = self.tree.text(index + 1)
+        value = self.visitIndex(self.tree.ends[index + 1])
+        space = self.getSpaceWithSymbol(name)
+        if space is not None:
+            space.update(name, value)
+        self.currentSpace.enter(name, value)
+
+    def visitPlus(self, index):
+        return self.visitIndex(index + 1)
+
+    def visitMinus(self, index):
+        return -self.visitIndex(index + 1)
+
+    def visitInteger(self, index):
+        return self.tree.integer(index)
+
+    def visitIdentifier(self, index):
+        name = self.tree.text(index)
+        space = self.getSpaceWithSymbol(name)
+        if space is None:
+            raise Exception('{position} : Undefined symbol \'{name}\'!'.format(
+                position = describePosition(self.charStream,
+                                            self.tree.positions[index]),
+                name = name))
+        return space.retrieve(name)
+
+    def visitStatements(self, index):
+        for child in self.tree.children(index):
+            self.visitIndex(child)
+
+    def visitNothing(self, index):
+        pass # arguments and parameters are processed in function calls
+
+    def visitDefine(self, index):
+        return FlatFunction(self.tree, index)
+
+    def visitCall(self, index):
+        # For the sake of simplicity, closures are not considered here.
+        tree = self.tree
+        function = self.visitIndex(index + 1)
+        calls = self.callArguments.get(tree)
+        if calls is None:
+            calls = self.callArguments[tree] = {}
+        arguments = calls.get(index)
+        if arguments is None:
+            arguments = calls[index] = tuple(
+                tree.children(tree.ends[index + 1]))
+
+        # check arguments and parameters number
+        if len(function.parameters) != len(arguments):
+            raise Exception('{position}: Arguments mismatch!'.format(
+                position = describePosition(self.charStream,
+                                            tree.positions[index])))
+
+        # take a memory space for calling function, the arguments may
+        # take others for their calls
+        if self.freeSpaces:
+            funcspace = self.freeSpaces.pop()
+            funcspace.name = function.name
+        else:
+            funcspace = MemorySpace(function.name)
+        saveSpace = self.currentSpace
+        try:
+            funcspace.enter('ans', None)  # return value
+            for parameter, argument in zip(function.parameters, arguments):
+                funcspace.enter(parameter, self.visitIndex(argument))
+
+            # call function
+            self.callStack.append(funcspace)
+            self.currentSpace = funcspace
+            self.tree = function.tree # the tree the function is defined in
+            self.visitIndex(function.body)
+            return funcspace.retrieve('ans')
+        finally:
+            if self.callStack and self.callStack[-1] is funcspace:
+                self.callStack.pop()
+            self.tree = tree
+            self.currentSpace = saveSpace
+            funcspace.symval.clear()
+            self.freeSpaces.append(funcspace)
+
+    def visitReturn(self, index):
+        self.currentSpace.enter('ans', self.visitIndex(index + 1))
+
+###########################################################
+# Top-level script tests
+###########################################################
+if __name__ == '__main__':
+    text = 'f = function(x, y) return x+y end\nfunction g(z) return -z end\n' \
+           'a = f(3, 4) * (2 - g(1))\nreturn a\n'
+    root = Parser(Scanner(CharStream(text))).statements()
+    tree = flatten(root)
+    print('{count} nodes in {nbytes} bytes, texts: {texts}'.format(
+        count = len(tree), nbytes = tree.nbytes(), texts = tree.texts))
+    unflatten(tree).accept(PrintVisitor())
+
+    # walk the assignments with a cursor
+    cursor = FlatCursor(tree)
+    cursor.gotoFirstChild()
+    while True:
+        cursor.gotoFirstChild()
+        print(cursor.token())
+        cursor.gotoParent()
+        if not cursor.gotoNextSibling():
+            break
+
+    interpreter = FlatInterpreter()
+    interpreter.run(tree)
+    print(interpreter.globalSpace)
+
+    # a failing call leaves the interpreter on the tree of the caller
+    library = flatten(Parser(Scanner(CharStream(
+        'function h(x) y = x / 0 return y end\n'))).statements())
+    interpreter.run(library)
+    try:
+        interpreter.run(tree)
+        interpreter.run(flatten(Parser(Scanner(CharStream(
+            'v = h(1)\n'))).statements()))
+    except ZeroDivisionError:
+        pass
+    assert interpreter.tree is not library and not interpreter.callStack
+    assert interpreter.currentSpace is interpreter.globalSpace
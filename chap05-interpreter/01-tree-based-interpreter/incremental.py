@@ -0,0 +1,347 @@
+###########################################################
+# Incremental Lexing -- rescan only around an edit
+###########################################################
+
+from array import array
+from bisect import bisect_left, bisect_right
+from tokenbuffer import *
+
+class TokenStarts:
+    '''
+    Read-only sequence of the real token positions of an IncrementalLexer,
+    so that bisect can search them.
+    '''
+    def __init__(self, lexer):
+        self.lexer = lexer
+
+    def __len__(self):
+        return len(self.lexer.buffer)
+
+    def __getitem__(self, index):
+        return self.lexer.start(index)
+
+class IncrementalLexer:
+    '''
+    Keeps the tokens of a document in a TokenBuffer. After an edit only the
+    text from the last token boundary before the edit is rescanned, until
+    the new tokens fall in step with the old ones again.
+
+    The positions of the tokens after an edit are not shifted right away.
+    As in a gap buffer, the tokens from gapIndex on are stored gapDelta
+    too small, and the shift is only carried out when a later edit moves
+    the gap. So an edit costs time in proportion to the edit and to its
+    distance from the previous one, not to the document size.
+    '''
+    def __init__(self, text):
+        self.text = text
+        self.buffer = tokenize(text)
+        self.gapIndex = len(self.buffer) # tokens from here on are shifted
+        self.gapDelta = 0                # by this much
+
+    def start(self, index):
+        '''
+        Return the position of the token at the index.
+        '''
+        if index >= self.gapIndex:
+            return self.buffer.starts[index] + self.gapDelta
+        return self.buffer.starts[index]
+
+    def token(self, index):
+        '''
+        Build the Token at the index; the index past the last token is EOF.
+        '''
+        token = self.buffer.token(index)
+        if token.type != EOF:
+            token.position = self.start(index)
+        return token
+
+    def moveGap(self, index):
+        '''
+        Move the start of the shifted tokens to the index.
+        '''
+        starts = self.buffer.starts
+        for i in range(index, self.gapIndex):
+            starts[i] -= self.gapDelta
+        for i in range(self.gapIndex, index):
+            starts[i] += self.gapDelta
+        self.gapIndex = index
+
+    def flush(self):
+        '''
+        Shift all pending token positions and return the up-to-date buffer.
+        '''
+        self.moveGap(len(self.buffer))
+        self.gapDelta = 0
+        return self.buffer
+
+    def edit(self, offset, removedLength, insertedText):
+        '''
+        Replace removedLength characters at the offset with insertedText.
+        Return the index of the first changed token together with the
+        numbers of removed and inserted tokens.
+        '''
+        text = (self.text[:offset] + insertedText +
+                self.text[offset + removedLength:])
+        delta = len(insertedText) - removedLength
+        editEnd = offset + len(insertedText) # end of the edit in the new text
+        buffer = self.buffer
+        count = len(buffer)
+
+        # rescan from the last token starting before the edit, it may grow;
+        # without one, only white space comes before the edit
+        first = bisect_left(TokenStarts(self), offset) - 1
+        if first >= 0:
+            position = self.start(first)
+        else:
+            first, position = 0, offset
+
+        types, starts, lengths, lexemes = (
+            array('B'), array(POSITION_TYPECODE), array('I'), array('I'))
+        old = first # old token to compare new tokens with
+        while True:
+            match = TOKEN_PATTERN.match(text, position)
+            if match is None:
+                position = WHITESPACE_PATTERN.match(text, position).end()
+                raise Exception('{position} : Invalid character \'{char}\'!'.format(
+                    position = describePosition(CharStream(text), position),
+                    char = text[position]))
+            type = match.lastgroup
+            if type == EOF:
+                old = count
+                break
+            start, position = match.span(type)
+
+            # in step again when an old token past the edit starts here
+            if start >= editEnd:
+                while old < count and self.start(old) < start - delta:
+                    old += 1
+                if (old < count and self.start(old) == start - delta and
+                    TOKEN_CODES[buffer.types[old]] == type and
+                    buffer.lengths[old] == position - start):
+                    break
+
+            types.append(CODE_OF_TYPE[type])
+            starts.append(start)
+            lengths.append(position - start)
+            lexemes.append(buffer.intern(text[start:position]))
+
+        # tokens from 'old' on are kept; give them a common pending shift
+        self.moveGap(old)
+        buffer.types[first:old] = types
+        buffer.starts[first:old] = starts
+        buffer.lengths[first:old] = lengths
+        buffer.lexemes[first:old] = lexemes
+        self.gapIndex = first + len(types)
+        self.gapDelta += delta
+
+        self.text = text
+        buffer.source = text
+        buffer.lineIndex = None
+        buffer.eofPosition = len(text) - 1
+        return first, old - first, len(types)
+
+###########################################################
+# Incremental Parsing -- reparse only the edited statements
+###########################################################
+from ast import *
+
+class LexerCursor(TokenCursor):
+    '''
+    TokenCursor over the tokens of an IncrementalLexer, whose positions may
+    still carry a pending shift.
+    '''
+    def __init__(self, lexer, index = 0):
+        TokenCursor.__init__(self, lexer.buffer, index)
+        self.lexer = lexer
+
+    @property
+    def currentToken(self):
+        if self.token is None:
+            self.token = self.lexer.token(self.index)
+        return self.token
+
+    @property
+    def position(self):
+        buffer = self.buffer
+        if self.index >= len(buffer):
+            return buffer.eofPosition
+        return min(self.lexer.start(self.index) + buffer.lengths[self.index],
+                   buffer.eofPosition)
+
+def shiftPositions(root, delta):
+    '''
+    Move the tokens of a subtree by delta characters.
+    '''
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node.token, PhonyToken):
+            node.token.position += delta
+        stack.extend(node.children)
+
+class IncrementalParser:
+    '''
+    Keeps the StatementListNode of a document together with the token range
+    of every top-level statement. After an edit only the statements whose
+    tokens (or whose lookahead token) changed are parsed again, until a new
+    statement ends where an unchanged old one begins; the old subtrees from
+    there on are kept.
+
+    The top-level statements are contiguous, statement i covers the tokens
+    from ends[i - 1] (0 for the first) up to ends[i].
+    '''
+    def __init__(self, text):
+        self.lexer = IncrementalLexer(text)
+        self.root = None
+        self.ends = []
+        self.reparse(0, 0, 0, 0)
+
+    def statementAt(self, index):
+        '''
+        Return the index of the top-level statement holding the token at
+        the index, or None for tokens after the last statement.
+        '''
+        statement = bisect_right(self.ends, index)
+        if statement < len(self.ends):
+            return statement
+        return None
+
+    def edit(self, offset, removedLength, insertedText):
+        '''
+        Replace removedLength characters at the offset with insertedText and
+        update the tree. Return the index of the first changed top-level
+        statement together with the numbers of removed and inserted ones:
+        root.children[first:first + inserted] are the new subtrees.
+        '''
+        first, removed, inserted = self.lexer.edit(offset, removedLength,
+                                                   insertedText)
+        delta = len(insertedText) - removedLength
+        if self.root is None: # the last parse failed, start all over
+            return self.reparse(0, 0, 0, 0)
+        # the first statement that saw a changed token, as lookahead too
+        statement = bisect_left(self.ends, first)
+        return self.reparse(statement, first + removed, inserted - removed,
+                            delta)
+
+    def reparse(self, first, changeEnd, tokenDelta, delta):
+        '''
+        Parse the top-level statements from the first one on, reusing the old
+        statements starting after the old token index changeEnd. tokenDelta
+        and delta are the shifts in tokens and in characters of the tokens
+        after the change.
+        '''
+        if self.root is None:
+            self.root = StatementListNode(PhonyToken(STATEMENTS, 0))
+        children = self.root.children
+        ends = self.ends
+        if first > 0 and isinstance(children[first - 1], ReturnStatementNode):
+            return first, 0, 0 # nothing is parsed after a return
+
+        cursor = LexerCursor(self.lexer, ends[first - 1] if first > 0 else 0)
+        parser = Parser(cursor)
+        nodes, nodeEnds = [], []
+        old = first # old statement to compare the new ones with
+        try:
+            while True:
+                type = cursor.currentToken.type
+                if type == IDENTIFIER or type == FUNCTION:
+                    nodes.append(parser.assignment())
+                elif type == RETURN:
+                    nodes.append(parser.returnstmt())
+                else:
+                    old = len(children)
+                    break
+                nodeEnds.append(cursor.index)
+                if type == RETURN:
+                    old = len(children)
+                    break
+
+                # in step again when an old statement past the change
+                # starts here
+                while (old < len(children) and
+                       (ends[old - 1] if old > 0 else 0) + tokenDelta <
+                       cursor.index):
+                    old += 1
+                start = ends[old - 1] if old > 0 else 0
+                if (old < len(children) and start >= changeEnd and
+                    start + tokenDelta == cursor.index):
+                    break
+        except Exception:
+            self.root = None
+            self.ends = []
+            raise
+
+        if delta:
+            for node in children[old:]:
+                shiftPositions(node, delta)
+        for index in range(old, len(ends)):
+            ends[index] += tokenDelta
+        removed = old - first
+        children[first:old] = nodes
+        ends[first:old] = nodeEnds
+        return first, removed, len(nodes)
+
+###########################################################
+# Top-level script tests
+###########################################################
+import random
+if __name__ == '__main__':
+    pieces = ['function', 'end', 'return', 'x', 'ab1', '12', ' ', '\n', '+',
+              '(', ')', '=', ',']
+    text = ''.join(random.choice(pieces) for i in range(200))
+    lexer = IncrementalLexer(text)
+    for i in range(2000):
+        offset = random.randint(0, len(lexer.text))
+        removed = random.randint(0, min(5, len(lexer.text) - offset))
+        inserted = ''.join(random.choice(pieces)
+                           for j in range(random.randint(0, 3)))
+        lexer.edit(offset, removed, inserted)
+        expected = tokenize(lexer.text)
+        assert len(lexer.buffer) == len(expected)
+        for index in range(len(expected) + 1):
+            assert str(lexer.token(index)) == str(expected.token(index))
+    flushed = lexer.flush()
+    assert list(flushed.starts) == list(tokenize(lexer.text).starts)
+    print('{count} tokens after 2000 random edits, all as rescanned'.format(
+        count = len(flushed)))
+
+    def describe(root):
+        # the tokens of a tree in preorder, with their depths
+        stack, tokens = [(root, 0)], []
+        while stack:
+            node, depth = stack.pop()
+            tokens.append((depth, node.__class__.__name__, node.token.type,
+                           node.token.text, node.token.position))
+            stack.extend((child, depth + 1) for child in reversed(node.children))
+        return tokens
+
+    lines = ['a = f(1, 2)\n', 'b = a * (3 - c)\n', 'g = function() end\n',
+             'function f(x, y) z = x / y return z end\n']
+    def document():
+        return ''.join(random.choice(lines) for i in range(30)) + 'return a\n'
+    incremental = IncrementalParser(document())
+    pieces += ['a', '* 2', 'f(', ')\n', '\n', 'end']
+    reparsed = 0
+    for i in range(2000):
+        offset = random.randint(0, len(incremental.lexer.text))
+        removed = random.randint(0, min(8, len(incremental.lexer.text) - offset))
+        inserted = ''.join(random.choice(pieces)
+                           for j in range(random.randint(0, 3)))
+        text = incremental.lexer.text
+        text = text[:offset] + inserted + text[offset + removed:]
+        try:
+            expected = describe(Parser(RegexScanner(CharStream(text))).statements())
+        except Exception as e:
+            expected = str(e)
+        try:
+            first, removedCount, insertedCount = incremental.edit(
+                offset, removed, inserted)
+            reparsed += insertedCount
+            actual = describe(incremental.root)
+        except Exception as e:
+            actual = str(e)
+        assert actual == expected, (text, actual, expected)
+        if random.random() < 0.1: # keep the document mostly valid
+            incremental = IncrementalParser(document())
+    print('{reparsed} statements reparsed in 2000 random edits'.format(
+        reparsed = reparsed))
@@ -19,6 +19,7 @@
 
 from ast import *
 from parser import *
+from streaming import *
 from memory import *
 ###########################################################
 # Interpreter
@@ -26,19 +27,20 @@ from memory import *
 # in visitors and method 'accept' in ASTs.
 ###########################################################
 class Interpreter(AbstractNodeVisitor):
-    def __init__(self):
+    def __init__(self, charStream = None):
         # self.globalScope = Scope() # global scope is filled by the parser
         self.globalSpace = MemorySpace('globals')  # global memory
         self.currentSpace = self.globalSpace
         self.callStack = [] # call stack
+        self.charStream = charStream # source of the program, for diagnostics
 
     def getSpaceWithSymbol(self, id):
         '''
         Return scope holding id's value; current func space or global.
         '''
-        if self.currentSpace.retrieve(id):
+        if self.currentSpace.retrieve(id) is not None:
             return self.currentSpace
-        elif self.globalSpace.retrieve(id):
+        elif self.globalSpace.retrieve(id) is not None:
             return self.globalSpace
         else:
             return None
@@ -74,7 +76,8 @@ class Interpreter(AbstractNodeVisitor):
         space = self.getSpaceWithSymbol(name)
         if space is None:
             raise Exception('{position} : Undefined symbol \'{name}\'!'.format(
-                position = node.token.position,
+                position = describePosition(self.charStream,
+                                            node.token.position),
                 name = name))
         return space.retrieve(name)
 
@@ -82,6 +85,16 @@ class Interpreter(AbstractNodeVisitor):
         for child in node.children:
             self.visit(child)
 
+    def runStream(self, statements):
+        '''
+        Run the top-level statements of an iterable, e.g. the generator of
+        Parser.statementStream(), each one as soon as it is there. No
+        statement is kept after it has run, except for function
+        definitions stored in the memory.
+        '''
+        for statement in statements:
+            self.visit(statement)
+
     def visitFunctionArgumentsNode(self, node):
         pass # do nothing here, process it in function call
 
@@ -105,7 +118,8 @@ class Interpreter(AbstractNodeVisitor):
         # check arguments and parameters number
         if len(funcpars.children) != len(funcargs.children):
             raise Exception('{position}: Arguments mismatch!'.format(
-                position = node.token.position))
+                position = describePosition(self.charStream,
+                                            node.token.position)))
 
         # create a new memory space for calling function
         funcspace = MemorySpace('{function}'.format(
@@ -133,6 +147,48 @@ class Interpreter(AbstractNodeVisitor):
     def visitReturnStatementNode(self, node):
         self.currentSpace.enter('ans', node.children[0].accept(self))
 
+###########################################################
+# Engine tests -- other execution engines against Interpreter
+###########################################################
+# Scripts every engine must run as Interpreter does: calls, operators,
+# a function assigning a global, a function without return, too many
+# arguments and an undefined name
+ENGINE_TEST_TEXTS = [
+    'f = function(x, y) return x+y end\nfunction g(z) return -z end\n'
+    'a = f(3, 4) * (2 - g(1))\nreturn a\n',
+    'a = 0\nb = a + 1\nc = - + - b / 2 * 7\n',
+    'n = 5\nfunction h(m) n = m * 2 k = n + 1 return k end\n'
+    'r = h(3)\n',
+    'function w() end\nv = w()\n',
+    'f = function(x) return x end\nv = f(1, 2)\n',
+    'v = u + 1\n',
+    ]
+
+def compareWithInterpreter(createEngine, texts, describeError = str):
+    '''
+    Run every script with Interpreter and with the engine createEngine()
+    creates from a CharStream. Both must end with the same integer and
+    None globals, or with the same error as describeError() gives it.
+    Return the engine and its result of every script.
+    '''
+    runs = []
+    for text in texts:
+        results = []
+        for create in (Interpreter, createEngine):
+            interpreter = create(CharStream(text))
+            try:
+                Parser(Scanner(interpreter.charStream)).statements().accept(
+                    interpreter)
+                results.append(sorted(
+                    (name, value) for name, value in
+                    interpreter.globalSpace.symval.items()
+                    if isinstance(value, (int, type(None), type(2 ** 64)))))
+            except Exception as error:
+                results.append(describeError(error))
+        assert results[0] == results[1], results
+        runs.append((interpreter, results[1]))
+    return runs
+
 ###########################################################
 # Top-level script tests
 ###########################################################
@@ -144,6 +200,24 @@ if __name__ == '__main__':
     a = f(3, 4)
     '''
     interpreter = Interpreter()
+    if len(sys.argv) > 1:
+        # run a script file, mapped into memory instead of read into a str
+        with open(sys.argv[1], 'rb') as file, \
+             MMapCharStream(file) as charStream:
+            interpreter.charStream = charStream
+            parser = Parser(RegexScanner(charStream))
+            interpreter.runStream(parser.statementStream())
+        print(interpreter.globalSpace)
+        sys.exit(0)
+    elif not sys.stdin.isatty():
+        # a piped script is scanned chunk by chunk as it arrives, and every
+        # statement is run as soon as it is parsed
+        scanner = FileScanner(sys.stdin)
+        interpreter.charStream = scanner.charStream
+        interpreter.runStream(Parser(scanner).statementStream())
+        print(interpreter.globalSpace)
+        sys.exit(0)
+
     while True:
         try:
             if sys.version_info >= (3, 0):
@@ -151,7 +225,8 @@ if __name__ == '__main__':
             elif sys.version_info >= (2, 0):
                 text = raw_input('calc> ')
 
-            scanner = Scanner(CharStream(text))
+            interpreter.charStream = CharStream(text)
+            scanner = Scanner(interpreter.charStream)
             parser = Parser(scanner)
             root = parser.statements()
             root.accept(interpreter)
@@ -0,0 +1,523 @@
+###########################################################
+# Native Backend -- script functions compiled to C, loaded with ctypes
+###########################################################
+
+import ctypes, os, stat, subprocess, tempfile
+from transpiler import *
+from parsecache import checkPrivate, nodes, sourceKey
+
+# Whether '/' of two integers gives an integer, as in Interpreter on
+# Python 2; on Python 3 it gives a float and division stays in Python
+INTEGER_DIVISION = 7 / 2 == 3
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+INTEGER_TYPES = (int, type(2 ** 64))
+
+# Every operation returns 1 instead of overflowing or dividing by zero;
+# a function returns 1 as soon as an operation or a call does, and its
+# Python version is run instead.
+C_PRELUDE = '''#include <stdint.h>
+
+static int add(int64_t a, int64_t b, int64_t *r)
+{
+    return __builtin_add_overflow(a, b, r);
+}
+
+static int subtract(int64_t a, int64_t b, int64_t *r)
+{
+    return __builtin_sub_overflow(a, b, r);
+}
+
+static int multiply(int64_t a, int64_t b, int64_t *r)
+{
+    return __builtin_mul_overflow(a, b, r);
+}
+
+static int divide(int64_t a, int64_t b, int64_t *r)
+{
+    /* rounded down, as Python divides integers */
+    if (b == 0 || (a == INT64_MIN && b == -1))
+        return 1;
+    *r = a / b - (a % b != 0 && (a < 0) != (b < 0));
+    return 0;
+}
+
+static int negate(int64_t a, int64_t *r)
+{
+    return __builtin_sub_overflow((int64_t)0, a, r);
+}
+'''
+
+class NotCompilable(Exception):
+    pass
+
+###########################################################
+# Function selection
+###########################################################
+def scriptFunctions(root):
+    '''
+    Return {name: definition} of the functions a script defines at the top
+    level under a name nothing else assigns, and the set of the global
+    names (the names assigned at the top level).
+    '''
+    if not isinstance(root, StatementListNode):
+        return {}, set()
+    counts, definitions = {}, {}
+    for statement in root.children:
+        if isinstance(statement, BinaryExpressionNode):
+            name = statement.children[0].token.text
+            counts[name] = counts.get(name, 0) + 1
+            if isinstance(statement.children[1], FunctionDefinitionNode):
+                definitions[name] = statement.children[1]
+    # an assignment in a function changes the global of its name
+    inner = set()
+    for node in nodes(root):
+        if isinstance(node, FunctionDefinitionNode):
+            for statement in node.children[1].children:
+                if isinstance(statement, BinaryExpressionNode):
+                    inner.add(statement.children[0].token.text)
+    functions = dict((name, definition)
+                     for name, definition in definitions.items()
+                     if counts[name] == 1 and name not in inner)
+    return functions, set(counts)
+
+###########################################################
+# CGenerator
+###########################################################
+class CGenerator(AbstractNodeVisitor):
+    '''
+    Lowers script functions to C functions on int64_t:
+        int script_<name>(int64_t p0, ..., int64_t *result)
+    returning 0, or 1 when an operation could not be done in 64 bits.
+    Only functions giving the same results as Interpreter for integer
+    arguments are lowered: a body of assignments to new local names
+    ending with a return, reading parameters and assigned locals only,
+    and calling other script functions by name. Anything else raises
+    NotCompilable.
+    '''
+    def __init__(self, functions, globalNames):
+        self.functions = functions     # {name: definition} to call
+        self.globalNames = globalNames
+
+    def lower(self, name, definition):
+        '''
+        Return the C text of a function, the names of the functions it
+        calls and the names it assigns besides its parameters.
+        '''
+        parameters = [child.token.text
+                      for child in definition.children[0].children]
+        if len(set(parameters)) != len(parameters) or 'ans' in parameters:
+            raise NotCompilable()
+        self.lines = []
+        self.temporaries = 0
+        self.callees = set()
+        self.locals = set(parameters)
+        statements = definition.children[1].children
+        if not statements or not isinstance(statements[-1],
+                                            ReturnStatementNode):
+            raise NotCompilable() # it would return None
+        for statement in statements:
+            self.visit(statement)
+
+        declarations = ['    int64_t l_{parameter} = p{i};'.format(
+                        parameter = parameter, i = i)
+                        for i, parameter in enumerate(parameters)]
+        declarations.extend('    int64_t l_{local};'.format(local = local)
+                            for local in sorted(self.locals -
+                                                set(parameters)))
+        declarations.extend('    int64_t t{i};'.format(i = i)
+                            for i in range(self.temporaries))
+        text = '{prototype}\n{{\n{body}\n}}\n'.format(
+            prototype = prototype(name, len(parameters)),
+            body = '\n'.join(declarations + self.lines))
+        return text, self.callees, self.locals - set(parameters)
+
+    def temporary(self):
+        self.temporaries += 1
+        return 't{i}'.format(i = self.temporaries - 1)
+
+    def check(self, call):
+        self.lines.append('    if ({call})\n        return 1;'.format(
+            call = call))
+
+    def visitBinaryExpressionNode(self, node):
+        type = node.token.type
+        if type == ASSIGN:
+            name = node.children[0].token.text
+            if name == 'ans' or name in self.globalNames:
+                raise NotCompilable() # it could change a global
+            value = self.visit(node.children[1])
+            self.locals.add(name)
+            self.lines.append('    l_{name} = {value};'.format(
+                name = name, value = value))
+            return None
+        if type == DIV and not INTEGER_DIVISION:
+            raise NotCompilable()
+        lhs = self.visit(node.children[0])
+        rhs = self.visit(node.children[1])
+        result = self.temporary()
+        self.check('{operation}({lhs}, {rhs}, &{result})'.format(
+            operation = {PLUS: 'add', MINUS: 'subtract', MUL: 'multiply',
+                         DIV: 'divide'}[type],
+            lhs = lhs, rhs = rhs, result = result))
+        return result
+
+    def visitIntegerNode(self, node):
+        value = int(node.token.text)
+        if value > INT64_MAX:
+            raise NotCompilable()
+        return 'INT64_C({value})'.format(value = value)
+
+    def visitUnaryExpressionNode(self, node):
+        operand = self.visit(node.children[0])
+        if node.token.type == PLUS:
+            return operand
+        result = self.temporary()
+        self.check('negate({operand}, &{result})'.format(
+            operand = operand, result = result))
+        return result
+
+    def visitIdentifierNode(self, node):
+        name = node.token.text
+        if name not in self.locals:
+            raise NotCompilable() # a global, read when the function runs
+        return 'l_' + name
+
+    def visitStatementListNode(self, node):
+        raise NotCompilable()
+
+    def visitFunctionArgumentsNode(self, node):
+        raise NotCompilable()
+
+    def visitFunctionParametersNode(self, node):
+        raise NotCompilable()
+
+    def visitFunctionCallNode(self, node):
+        callee = node.children[0]
+        arguments = node.children[1].children
+        if not isinstance(callee, IdentifierNode):
+            raise NotCompilable()
+        name = callee.token.text
+        definition = self.functions.get(name)
+        if (name in self.locals or definition is None or
+            len(definition.children[0].children) != len(arguments)):
+            raise NotCompilable()
+        values = [self.visit(argument) for argument in arguments]
+        result = self.temporary()
+        self.check('script_{name}({arguments})'.format(
+            name = name,
+            arguments = ', '.join(values + ['&' + result])))
+        self.callees.add(name)
+        return result
+
+    def visitFunctionDefinitionNode(self, node):
+        raise NotCompilable()
+
+    def visitReturnStatementNode(self, node):
+        # the last statement of the body
+        self.lines.append('    *result = {value};\n    return 0;'.format(
+            value = self.visit(node.children[0])))
+
+def prototype(name, count):
+    return 'int script_{name}({parameters})'.format(
+        name = name,
+        parameters = ', '.join(['int64_t p{i}'.format(i = i)
+                                for i in range(count)] +
+                               ['int64_t *result']))
+
+def generateC(root):
+    '''
+    Return the C source of the functions of a script that can be lowered,
+    and {name: (number of parameters, names of the functions it calls,
+    names assigned)} of these functions, counting what the functions they
+    call do.
+    '''
+    functions, globalNames = scriptFunctions(root)
+    generator = CGenerator(functions, globalNames)
+    texts, callees, assigned = {}, {}, {}
+    for name, definition in functions.items():
+        try:
+            texts[name], callees[name], assigned[name] = generator.lower(
+                name, definition)
+        except NotCompilable:
+            pass
+
+    # drop the functions calling dropped functions, or calling themselves
+    # through other functions (they could only run out of stack)
+    reached = {}
+    def reach(name, path):
+        if name not in reached:
+            if name in path or name not in texts:
+                return None
+            path.add(name)
+            names = set([name])
+            for callee in callees[name]:
+                calleeNames = reach(callee, path)
+                if calleeNames is None:
+                    names = None
+                    break
+                names |= calleeNames
+            path.discard(name)
+            reached[name] = names
+        return reached[name]
+    compiled = {}
+    for name in sorted(texts):
+        names = reach(name, set())
+        if names is not None:
+            compiled[name] = (len(functions[name].children[0].children),
+                              names,
+                              set().union(*[assigned[calleeName]
+                                            for calleeName in names]))
+
+    source = [C_PRELUDE]
+    source.extend(prototype(name, compiled[name][0]) + ';'
+                  for name in sorted(compiled))
+    source.extend(texts[name] for name in sorted(compiled))
+    return '\n'.join(source), compiled
+
+###########################################################
+# Building and loading
+###########################################################
+def defaultCacheDirectory():
+    # per user: a shared directory could hold libraries of another user
+    cache = (os.environ.get('XDG_CACHE_HOME') or
+             os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(cache, 'chap05-native')
+
+def build(source, directory):
+    '''
+    Return the path of the shared object of a C source, compiled with the
+    system C compiler ($CC, cc by default) unless the cache directory has
+    it already; it is named after the hash of the source. Directories or
+    libraries other users could have written to are refused.
+    '''
+    if not os.path.lexists(directory):
+        os.makedirs(directory, 0o700)
+    checkPrivate(directory, stat.S_ISDIR)
+    path = os.path.join(directory, sourceKey(source) + '.so')
+    if os.path.lexists(path):
+        checkPrivate(path, stat.S_ISREG)
+        return path
+    handle, cPath = tempfile.mkstemp('.c', dir = directory)
+    with os.fdopen(handle, 'w') as file:
+        file.write(source)
+    handle, temporaryPath = tempfile.mkstemp('.so', dir = directory)
+    os.close(handle)
+    try:
+        process = subprocess.Popen(
+            [os.environ.get('CC', 'cc'), '-O2', '-shared', '-fPIC', '-o',
+             temporaryPath, cPath],
+            stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode != 0:
+            raise Exception('C compiler failed: {output}'.format(
+                output = output.decode('utf-8', 'replace')))
+        os.rename(temporaryPath, path)
+    finally:
+        os.remove(cPath)
+        if os.path.exists(temporaryPath):
+            os.remove(temporaryPath)
+    return path
+
+class NativeFunction(object):
+    '''
+    Function value of a script function with a C version: called with
+    64-bit integers while the functions it calls are still bound to their
+    definitions and no global has the name of a local it assigns, it runs
+    the C version, otherwise or when that fails the Python version.
+    '''
+    def __init__(self, python, native, parameterCount, callees, assigned,
+                 bound, globalSymbols):
+        self.python = python
+        self.native = native
+        self.parameterCount = parameterCount
+        self.callees = callees     # names of the functions it calls
+        self.assigned = assigned   # local names it assigns
+        self.bound = bound         # name -> NativeFunction of this run
+        self.globalSymbols = globalSymbols
+        self.calls = self.fallbacks = 0
+
+    def __call__(self, *arguments):
+        for argument in arguments:
+            if (not isinstance(argument, INTEGER_TYPES) or
+                not INT64_MIN <= argument <= INT64_MAX):
+                return self.python(*arguments)
+        for name in self.callees:
+            if self.globalSymbols.get(name) is not self.bound[name]:
+                return self.python(*arguments)
+        for name in self.assigned:
+            # globals of later runs would be updated by the assignment
+            if self.globalSymbols.get(name) is not None:
+                return self.python(*arguments)
+        result = ctypes.c_int64()
+        self.calls += 1
+        if self.native(*(arguments + (ctypes.byref(result),))) == 0:
+            return result.value
+        self.fallbacks += 1
+        return self.python(*arguments)
+
+###########################################################
+# NativeInterpreter
+###########################################################
+class NativeTranspiler(PythonTranspiler):
+    '''
+    PythonTranspiler wrapping the functions having a C version into a
+    NativeFunction.
+    '''
+    def __init__(self):
+        self.natives = {} # definition node -> script name
+
+    def visitFunctionDefinitionNode(self, node):
+        name = PythonTranspiler.visitFunctionDefinitionNode(self, node)
+        if node in self.natives:
+            self.definitions.append((
+                '{name} = native({name}, {script!r})'.format(
+                    name = name, script = self.natives[node]),
+                node.token.position))
+        return name
+
+class NativeInterpreter(TranspiledInterpreter):
+    '''
+    TranspiledInterpreter running the script functions it can lower to C
+    as machine code. The C source is built into a shared object in the
+    cache directory, named after its hash, so it is only compiled again
+    when the script functions change. Without a working C compiler all of
+    the script runs as Python (buildError tells why).
+    '''
+    def __init__(self, charStream = None, directory = None):
+        TranspiledInterpreter.__init__(self, charStream)
+        self.transpiler = NativeTranspiler()
+        self.directory = directory or defaultCacheDirectory() # private
+        self.libraries = {}  # shared object path -> CDLL
+        self.compiled = {}   # name -> (parameter count, called names,
+                             # assigned names)
+        self.library = None
+        self.natives = {}    # code object -> (compiled, library)
+        self.buildError = None
+        self.bound = None
+
+    def translate(self, root):
+        source, compiled = generateC(root)
+        library = None
+        if compiled:
+            try:
+                path = build(source, self.directory)
+                if path not in self.libraries:
+                    self.libraries[path] = ctypes.CDLL(path)
+                library = self.libraries[path]
+            except Exception as error:
+                self.buildError = error
+                compiled = {}
+        functions, globalNames = scriptFunctions(root)
+        self.transpiler.natives = dict((functions[name], name)
+                                       for name in compiled)
+        code, positions = TranspiledInterpreter.translate(self, root)
+        self.natives[code] = (compiled, library)
+        return code, positions
+
+    def forget(self, code):
+        TranspiledInterpreter.forget(self, code)
+        del self.natives[code]
+
+    def execute(self, code, positions):
+        self.compiled, self.library = self.natives[code]
+        return TranspiledInterpreter.execute(self, code, positions)
+
+    def namespace(self):
+        namespace = TranspiledInterpreter.namespace(self)
+        namespace['native'] = self.native
+        self.bound = {}
+        return namespace
+
+    def native(self, python, name):
+        '''
+        Return the NativeFunction of the Python version of a function.
+        '''
+        count, callees, assigned = self.compiled[name]
+        function = getattr(self.library, 'script_' + name)
+        function.argtypes = [ctypes.c_int64] * count + [
+            ctypes.POINTER(ctypes.c_int64)]
+        function.restype = ctypes.c_int
+        self.bound[name] = NativeFunction(
+            python, function, count, tuple(sorted(callees)),
+            tuple(sorted(assigned)), self.bound, self.globalSpace.symval)
+        return self.bound[name]
+
+###########################################################
+# Top-level script tests
+###########################################################
+if __name__ == '__main__':
+    texts = ENGINE_TEST_TEXTS + [
+        'function sq(x) return x * x end\n'
+        'function f(a, b) s = sq(a) + sq(b) d = s / 7 return d - -a end\n'
+        'a = f(3, 4)\nb = f(-3, 4)\nc = f(3037000500, 1)\n'
+        'e = f(99999999999999999999, 1)\nreturn a\n',
+        'f = function(x, y) return x+y end\nfunction g(z) return -z end\n'
+        'a = f(3, 4) * (2 - g(1))\n',
+        'function h(x) y = x / 0 return y end\nv = 1\nw = h(v)\n',
+        'function k(x) return x + n end\nn = 1\nv = k(2)\n',
+        ]
+    directory = tempfile.mkdtemp()
+    try:
+        runs = compareWithInterpreter(
+            lambda charStream: NativeInterpreter(charStream, directory),
+            texts, lambda error: type(error).__name__)
+        for interpreter, result in runs:
+            print('{result} native: {names}'.format(
+                result = result,
+                names = ', '.join(sorted(interpreter.compiled))))
+
+        # products beyond 64 bits are computed again by Python
+        text = ('function p(x) y = x * x return y * y end\n'
+                'a = p(1000)\nb = p(100000)\n')
+        interpreter = NativeInterpreter(CharStream(text), directory)
+        Parser(Scanner(interpreter.charStream)).statements().accept(
+            interpreter)
+        function = interpreter.globalSpace.symval['p']
+        assert interpreter.globalSpace.symval['b'] == 10 ** 20
+        assert (function.calls, function.fallbacks) == (2, 1)
+        print('p: {calls} calls, {fallbacks} in Python'.format(
+            calls = function.calls, fallbacks = function.fallbacks))
+        # and called from Python, as a ctypes function
+        result = ctypes.c_int64()
+        assert function.native(12, ctypes.byref(result)) == 0
+        assert result.value == 12 ** 4
+
+        # the shared object is built once for the same functions
+        built = len(os.listdir(directory))
+        interpreter = NativeInterpreter(CharStream(text + 'c = p(2)\n'),
+                                        directory)
+        Parser(Scanner(interpreter.charStream)).statements().accept(
+            interpreter)
+        assert len(os.listdir(directory)) == built
+
+        # libraries others may have planted are not loaded
+        os.chmod(directory, 0o777)
+        interpreter = NativeInterpreter(CharStream(text), directory)
+        Parser(Scanner(interpreter.charStream)).statements().accept(
+            interpreter)
+        os.chmod(directory, 0o700)
+        assert interpreter.buildError is not None
+        assert interpreter.globalSpace.symval['b'] == 10 ** 20
+        print(interpreter.buildError)
+        for name in os.listdir(directory):
+            os.chmod(os.path.join(directory, name), 0o666)
+        interpreter = NativeInterpreter(CharStream(text), directory)
+        Parser(Scanner(interpreter.charStream)).statements().accept(
+            interpreter)
+        assert interpreter.buildError is not None
+        for name in os.listdir(directory):
+            os.chmod(os.path.join(directory, name), 0o755)
+
+        # a global defined by a later run is updated by the assignments of
+        # the function, as in Interpreter
+        interpreter = NativeInterpreter(CharStream(text), directory)
+        Parser(Scanner(interpreter.charStream)).statements().accept(
+            interpreter)
+        interpreter.runStream(Parser(Scanner(CharStream(
+            'y = 1\nd = p(3)\n'))).statementStream())
+        assert interpreter.globalSpace.symval['y'] == 9
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
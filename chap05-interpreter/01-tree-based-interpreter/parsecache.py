@@ -0,0 +1,339 @@
+###########################################################
+# ParseCache -- ASTs of repeated sources, keyed by content
+###########################################################
+
+import hashlib, os, stat, sys, tempfile, time
+from collections import OrderedDict
+from parser import *
+
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+# Token types by name, to turn unpickled type strings back into the very
+# constants the parser compares with 'is'
+TYPE_CONSTANTS = dict((type, type) for type in (
+    INTEGER, PLUS, MINUS, MUL, DIV, LPAREN, RPAREN, IDENTIFIER, ASSIGN, EOF,
+    COMMA, FUNCTION, END, RETURN, STATEMENTS, ARGUMENTS, PARAMETERS, CALL,
+    DEFINE))
+
+def sourceKey(text):
+    '''
+    Return the content hash of a source, the cache key.
+    '''
+    if not isinstance(text, bytes):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+def layoutTag():
+    '''
+    Return a short hash of what a pickled tree depends on: the node and
+    token classes with their attributes, and the Python major version.
+    Pickles of trees made with other classes are never loaded.
+    '''
+    token = Token(INTEGER, '0', 0)
+    layout = [(nodeClass.__module__, nodeClass.__name__,
+               sorted(vars(nodeClass(token))))
+              for nodeClass in (
+                  BinaryExpressionNode, IntegerNode, UnaryExpressionNode,
+                  IdentifierNode, StatementListNode, FunctionArgumentsNode,
+                  FunctionParametersNode, FunctionDefinitionNode,
+                  FunctionCallNode, ReturnStatementNode)]
+    for token in (token, PhonyToken(CALL, 0)):
+        layout.append((token.__class__.__module__, token.__class__.__name__,
+                       sorted(vars(token))))
+    layout.append(sys.version_info[0])
+    return sourceKey(repr(layout))[:12]
+
+LAYOUT_TAG = layoutTag()
+
+def isPrivate(status, isKind):
+    '''
+    Whether the status is of a file of the kind owned by the user that
+    nobody else may write to.
+    '''
+    return (isKind(status.st_mode) and status.st_uid == os.getuid() and
+            not status.st_mode & (stat.S_IWGRP | stat.S_IWOTH))
+
+def checkPrivate(path, isKind):
+    '''
+    Raise an exception unless path is a file of the kind (not a symbolic
+    link) owned by the user that nobody else may write to: what is found
+    there gets loaded and run.
+    '''
+    if not isPrivate(os.lstat(path), isKind):
+        raise Exception('{path} is not private to the user!'.format(
+            path = path))
+
+def nodes(root):
+    '''
+    Iterate over all nodes of a tree, without recursion.
+    '''
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children)
+
+def objectSize(object):
+    size = sys.getsizeof(object)
+    if hasattr(object, '__dict__'):
+        size += sys.getsizeof(object.__dict__)
+    return size
+
+def freeze(root):
+    '''
+    Make a tree shareable: the children lists become tuples, so addChild()
+    fails on it. Return the number of bytes the tree takes, roughly.
+    '''
+    size = 0
+    for node in nodes(root):
+        node.children = tuple(node.children)
+        token = node.token
+        token.type = TYPE_CONSTANTS.get(token.type, token.type)
+        size += (objectSize(node) + sys.getsizeof(node.children) +
+                 objectSize(token) + sys.getsizeof(token.text))
+    return size
+
+class ParseCache:
+    '''
+    LRU cache of the ASTs of sources, keyed by a hash of the source text.
+    The roots it returns are frozen and shared between all users of the
+    same source, so they must not be changed.
+
+    Entries are evicted in least recently used order when there are more
+    than maxEntries of them or they take more than maxBytes. With a
+    directory, parsed trees are also pickled there, so that a new process
+    finds them without parsing. The file names carry the LAYOUT_TAG of
+    the node classes, and files that can not be loaded are misses. The
+    least recently used files are deleted when the files take more than
+    maxDiskBytes, and files older than maxDiskAge seconds are not used.
+    Unpickling runs code, so the directory and the files are only used
+    while they are private to the user (see checkPrivate()).
+    '''
+    def __init__(self, maxEntries = 1024, maxBytes = 64 * 1024 * 1024,
+                 directory = None, engine = 'regex',
+                 maxDiskBytes = 256 * 1024 * 1024, maxDiskAge = None):
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.directory = directory
+        self.engine = engine
+        self.maxDiskBytes = maxDiskBytes
+        self.maxDiskAge = maxDiskAge
+        self.entries = OrderedDict() # key -> (root, size), oldest first
+        self.nbytes = 0
+        self.diskBytes = None # of the files, counted on the first store
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.diskHits = 0
+        self.diskWrites = 0
+        self.diskEvictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __str__(self):
+        return ('ParseCache: {entries} entries, {nbytes} bytes, '
+                '{hits} hits ({diskHits} from disk), {misses} misses, '
+                '{evictions} evictions ({diskEvictions} from disk)'.format(
+                    entries = len(self.entries),
+                    nbytes = self.nbytes,
+                    hits = self.hits,
+                    diskHits = self.diskHits,
+                    misses = self.misses,
+                    evictions = self.evictions,
+                    diskEvictions = self.diskEvictions))
+
+    def parse(self, text):
+        '''
+        Return the frozen AST of the source, parsing it only on a miss.
+        Syntax errors are raised and not cached.
+        '''
+        key = sourceKey(text)
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry # most recently used now
+            self.hits += 1
+            return entry[0]
+
+        root = self.load(key)
+        if root is not None:
+            self.diskHits += 1
+            self.hits += 1
+            size = freeze(root)
+        else:
+            self.misses += 1
+            charStream = CharStream(text)
+            root = Parser(createScanner(charStream, self.engine)).statements()
+            size = freeze(root)
+            self.store(key, root)
+        self.insert(key, root, size)
+        return root
+
+    def insert(self, key, root, size):
+        self.entries[key] = (root, size)
+        self.nbytes += size
+        while self.entries and (len(self.entries) > self.maxEntries or
+                                self.nbytes > self.maxBytes):
+            oldKey, (oldRoot, oldSize) = self.entries.popitem(last = False)
+            self.nbytes -= oldSize
+            self.evictions += 1
+
+    def path(self, key):
+        return os.path.join(self.directory, '{key}.{tag}.ast'.format(
+            key = key, tag = LAYOUT_TAG))
+
+    def load(self, key):
+        '''
+        Return the tree stored on disk for the key, or None.
+        '''
+        if self.directory is None:
+            return None
+        path = self.path(key)
+        try:
+            checkPrivate(self.directory, stat.S_ISDIR)
+            with open(path, 'rb') as file:
+                # the status of the file opened, not of what is at path now
+                status = os.fstat(file.fileno())
+                if not isPrivate(status, stat.S_ISREG):
+                    return None
+                if (self.maxDiskAge is not None and
+                    time.time() - status.st_mtime > self.maxDiskAge):
+                    return None
+                root = pickle.load(file)
+            os.utime(path, None) # recently used
+        except Exception:
+            return None # missing, truncated, or of other node classes
+        if not isinstance(root, StatementListNode):
+            return None
+        return root
+
+    def store(self, key, root):
+        '''
+        Write a tree to disk; the file appears at once or not at all.
+        '''
+        if self.directory is None:
+            return
+        try:
+            checkPrivate(self.directory, stat.S_ISDIR)
+        except Exception:
+            return # other users could read or replace the file
+        try:
+            data = pickle.dumps(root, pickle.HIGHEST_PROTOCOL)
+        except RuntimeError:
+            return # nested too deeply for pickle, keep it in memory only
+        descriptor, temporary = tempfile.mkstemp(dir = self.directory)
+        with os.fdopen(descriptor, 'wb') as file:
+            file.write(data)
+        os.rename(temporary, self.path(key))
+        self.diskWrites += 1
+        if self.diskBytes is None:
+            self.trim()
+        else:
+            self.diskBytes += len(data)
+            if self.diskBytes > self.maxDiskBytes:
+                self.trim()
+
+    def trim(self):
+        '''
+        Delete the least recently used files of the directory, of any
+        layout, until they fit in maxDiskBytes, and those too old to use.
+        '''
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.ast'):
+                path = os.path.join(self.directory, name)
+                try:
+                    status = os.stat(path)
+                except OSError:
+                    continue # deleted by another process
+                files.append((status.st_mtime, status.st_size, path))
+        files.sort()
+        total = sum(size for mtime, size, path in files)
+        now = time.time()
+        for mtime, size, path in files:
+            if total <= self.maxDiskBytes and (
+                self.maxDiskAge is None or now - mtime <= self.maxDiskAge):
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.diskEvictions += 1
+        self.diskBytes = total
+
+    def clear(self):
+        '''
+        Drop the in-memory entries; the disk tier is kept.
+        '''
+        self.entries.clear()
+        self.nbytes = 0
+
+###########################################################
+# Top-level script tests
+###########################################################
+import shutil
+from interpreter import Interpreter
+if __name__ == '__main__':
+    scripts = [
+        'f = function(x, y) return x+y end\na = f(3, 4)\n',
+        'b = 7 * (2 - 5)\nreturn b\n',
+        'function g(n) m = n * n return m end\nc = g(9)\n',
+        ]
+    directory = tempfile.mkdtemp()
+    try:
+        cache = ParseCache(maxEntries = 2, directory = directory)
+        for i in range(10):
+            for text in scripts:
+                root = cache.parse(text)
+                interpreter = Interpreter()
+                root.accept(interpreter)
+        assert root is cache.parse(scripts[-1]) # shared, not reparsed
+        print(cache)
+        print(interpreter.globalSpace)
+
+        # a cold process only reads the trees back from disk
+        cold = ParseCache(directory = directory)
+        for text in scripts:
+            cold.parse(text)
+        print(cold)
+        assert cold.misses == 0 and cold.diskHits == len(scripts)
+
+        # files that do not load, e.g. of other node classes, are misses
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), 'wb') as file:
+                file.write(b'\x80\x02cast\nNoSuchNode\n.')
+        broken = ParseCache(directory = directory)
+        for text in scripts:
+            broken.parse(text)
+        assert broken.diskHits == 0 and broken.misses == len(scripts)
+
+        # the files are kept within maxDiskBytes, oldest first out
+        small = ParseCache(directory = directory, maxDiskBytes = 1)
+        small.parse('d = 1\n')
+        assert os.listdir(directory) == [] and small.diskEvictions == 4
+        print(small)
+
+        # files or directories others may write to are not unpickled
+        shared = ParseCache(directory = directory)
+        shared.parse(scripts[0])
+        name, = os.listdir(directory)
+        os.chmod(os.path.join(directory, name), 0o666)
+        shared.clear()
+        shared.parse(scripts[0])
+        assert shared.diskHits == 0 and shared.misses == 2
+        os.chmod(os.path.join(directory, name), 0o600)
+        os.chmod(directory, 0o777)
+        shared.clear()
+        shared.parse(scripts[0])
+        assert shared.diskHits == 0 and shared.misses == 3
+        os.chmod(directory, 0o700)
+        shared.clear()
+        shared.parse(scripts[0])
+        assert shared.diskHits == 1 and shared.misses == 3
+    finally:
+        shutil.rmtree(directory)
@@ -17,13 +17,67 @@
 #     identifier ::= letter (letter | digit) *
 ###########################################################
 
+###########################################################
+# LineIndex -- line starts of a source, for diagnostics
+###########################################################
+from array import array
+from bisect import bisect_right
+
+class LineIndex:
+    '''
+    Positions of the first characters of the source lines, so that a
+    position turns into a line and a column with one binary search.
+    '''
+    def __init__(self, text = ''):
+        self.lineStarts = array('l', [0])
+        self.add(text, 0)
+
+    def add(self, text, offset):
+        '''
+        Record the line starts of a piece of source placed at the offset.
+        '''
+        position = text.find('\n')
+        while position >= 0:
+            self.lineStarts.append(offset + position + 1)
+            position = text.find('\n', position + 1)
+
+    def lineColumn(self, position):
+        '''
+        Return the line and the column (both counted from 1) of a position.
+        '''
+        line = max(bisect_right(self.lineStarts, position), 1)
+        return line, position - self.lineStarts[line - 1] + 1
+
+def describePosition(charStream, position):
+    '''
+    Format a position for diagnostics, adding its line and column when the
+    char stream is known.
+    '''
+    if charStream is None:
+        return str(position)
+    line, column = charStream.lineColumn(position)
+    return '{position} (line {line}, column {column})'.format(
+        position = position,
+        line = line,
+        column = column)
+
 ###########################################################
 # CharStream -- an input stream of characters
 ###########################################################
+# The characters of the language, ASCII as in every scanner engine:
+# str.isdigit() and the like also take other characters of unicode sources
+# or of the locale
+WHITESPACE_CHARS = frozenset(' \t\n\r\v\f')
+DIGIT_CHARS = frozenset('0123456789')
+LETTER_CHARS = frozenset('abcdefghijklmnopqrstuvwxyz'
+                         'ABCDEFGHIJKLMNOPQRSTUVWXYZ')
+WORD_CHARS = LETTER_CHARS | DIGIT_CHARS
+
 class CharStream:
     def __init__(self, text):
-        self.text = text     # source code
-        self.position = -1   # current position
+        self.text = text       # source code
+        self.position = -1     # current position
+        self.lineIndex = None  # built on the first lineColumn() call
         self.nextChar()
 
     def nextChar(self):
@@ -37,9 +91,64 @@ class CharStream:
             self.currentChar = None
 
     def skipWhiteSpace(self):
-        while self.currentChar is not None and self.currentChar.isspace():
+        while (self.currentChar is not None and
+               self.currentChar in WHITESPACE_CHARS):
             self.nextChar()
 
+    def seek(self, position):
+        '''
+        Move to the given position, leaving the stream in the same state as
+        consuming characters one by one up to that position would.
+        '''
+        if position < len(self.text):
+            self.position = position
+            self.currentChar = self.text[position]
+        else:
+            self.position = len(self.text) - 1
+            self.currentChar = None
+
+    def lineColumn(self, position):
+        '''
+        Return the line and the column (both counted from 1) of a position.
+        Scanning never tracks lines, the line index is only built here.
+        '''
+        if self.lineIndex is None:
+            self.lineIndex = LineIndex(self.text)
+        return self.lineIndex.lineColumn(position)
+
+###########################################################
+# MMapCharStream -- a char stream over a memory-mapped file
+###########################################################
+import mmap, os
+
+class MMapCharStream(CharStream):
+    '''
+    The source file is mapped read-only and its ASCII bytes are scanned in
+    place, so only token lexemes are ever copied into strings. The mapped
+    pages belong to the page cache, not to the process heap.
+    '''
+    def __init__(self, file):
+        fileno = file if isinstance(file, int) else file.fileno()
+        if os.fstat(fileno).st_size > 0:
+            self.text = mmap.mmap(fileno, 0, access = mmap.ACCESS_READ)
+        else:
+            self.text = '' # empty files can not be mapped
+        self.position = -1
+        self.lineIndex = None
+        self.nextChar()
+
+    def close(self):
+        if isinstance(self.text, mmap.mmap):
+            self.text.close()
+        self.text = ''
+        self.currentChar = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close() # errors of the script included
+
 ###########################################################
 # Token
 ###########################################################
@@ -83,7 +192,8 @@ class Scanner:
 
     def error(self):
         raise Exception('{position} : Invalid character \'{char}\'!'.format(
-            position = self.charStream.position,
+            position = describePosition(self.charStream,
+                                        self.charStream.position),
             char = self.charStream.currentChar))
 
     def nextToken(self):
@@ -96,9 +206,9 @@ class Scanner:
 
         if charStream.currentChar is None:
             self.currentToken = Token(EOF, None, position)
-        elif charStream.currentChar.isdigit():
+        elif charStream.currentChar in DIGIT_CHARS:
             self.currentToken = self.digits()
-        elif charStream.currentChar.isalpha():
+        elif charStream.currentChar in LETTER_CHARS:
             self.currentToken = self.word()
         elif charStream.currentChar == '+':
             self.currentToken = Token(PLUS, '+', position)
@@ -126,6 +236,7 @@ class Scanner:
             self.charStream.nextChar()
         else:
             self.error()
+        self.currentType = self.currentToken.type
 
     def digits(self):
         '''
@@ -135,7 +246,7 @@ class Scanner:
         position = self.charStream.position
         text = ''
         while(self.charStream.currentChar is not None and
-        self.charStream.currentChar.isdigit()):
+        self.charStream.currentChar in DIGIT_CHARS):
             text += self.charStream.currentChar
             self.charStream.nextChar()
         return Token(INTEGER, text, position)
@@ -148,8 +259,7 @@ class Scanner:
         position = self.charStream.position
         text = ''
         while(self.charStream.currentChar is not None and
-        (self.charStream.currentChar.isdigit() or
-        self.charStream.currentChar.isalpha())):
+        self.charStream.currentChar in WORD_CHARS):
             text += self.charStream.currentChar
             self.charStream.nextChar()
         if text == 'function':
@@ -161,18 +271,125 @@ class Scanner:
         else:
             return Token(IDENTIFIER, text, position)
 
+###########################################################
+# RegexScanner -- matches whole tokens with one master regex
+###########################################################
+import re
+
+# Every group is named after the token type it produces, so the type of a
+# match is simply its 'lastgroup'. Keywords come before identifiers and must
+# not be followed by another word character. The character classes are
+# spelt out: \s, \d and \w would take more than the ASCII characters of
+# Scanner on Python 3 or with re.UNICODE.
+TOKEN_PATTERN = re.compile(r'''
+    [ \t\n\r\v\f]*
+    (?:
+        (?P<INTEGER>[0-9]+)
+      | (?P<FUNCTION>function)(?![A-Za-z0-9])
+      | (?P<END>end)(?![A-Za-z0-9])
+      | (?P<RETURN>return)(?![A-Za-z0-9])
+      | (?P<IDENTIFIER>[A-Za-z][A-Za-z0-9]*)
+      | (?P<PLUS>\+)
+      | (?P<MINUS>-)
+      | (?P<MUL>\*)
+      | (?P<DIV>/)
+      | (?P<LPAREN>\()
+      | (?P<RPAREN>\))
+      | (?P<ASSIGN>=)
+      | (?P<COMMA>,)
+      | (?P<EOF>\Z)
+    )''', re.VERBOSE)
+
+WHITESPACE_PATTERN = re.compile(r'[ \t\n\r\v\f]*')
+
+# Group names back to the token type constants, the parser compares some
+# token types by identity
+TOKEN_TYPES = dict((type, type) for type in (
+    INTEGER, PLUS, MINUS, MUL, DIV, LPAREN, RPAREN, IDENTIFIER, ASSIGN, EOF,
+    COMMA, FUNCTION, END, RETURN))
+
+class RegexScanner(Scanner):
+    '''
+    Drop-in replacement of Scanner: produces the same tokens and positions
+    and leaves its CharStream at the same place after every token.
+    '''
+    def __init__(self, charStream):
+        self.charStream = charStream # source code
+        if charStream.currentChar is None:
+            self.offset = len(charStream.text)
+        else:
+            self.offset = charStream.position # scanning position
+        self.nextToken()
+
+    def nextToken(self):
+        '''
+        Consume the current token and return the next token.
+        '''
+        charStream = self.charStream
+        match = TOKEN_PATTERN.match(charStream.text, self.offset)
+        if match is None:
+            charStream.seek(
+                WHITESPACE_PATTERN.match(charStream.text, self.offset).end())
+            self.error()
+
+        type = TOKEN_TYPES[match.lastgroup]
+        self.offset = match.end()
+        charStream.seek(self.offset)
+        if type == EOF:
+            self.currentToken = Token(EOF, None, charStream.position)
+        else:
+            self.currentToken = Token(type, match.group(type), match.start(type))
+        self.currentType = type
+
+# Scanner engines selectable by name
+SCANNERS = {
+    'char': Scanner,
+    'regex': RegexScanner,
+    }
+
+def createScanner(charStream, engine = 'char'):
+    '''
+    Create a scanner over the char stream with the named engine.
+    '''
+    if engine not in SCANNERS:
+        raise Exception('Unknown scanner engine \'{engine}\'!'.format(
+            engine = engine))
+    return SCANNERS[engine](charStream)
+
 ###########################################################
 # Parser
 ###########################################################
 from ast import *
+
+# Binding powers of the expression operators; an operator takes the operands
+# of all operators binding tighter than itself. A new operator is one more
+# entry here.
+INFIX_POWERS = {
+    PLUS: 10, MINUS: 10,   # term (('+'|'-') term)*
+    MUL: 20, DIV: 20,      # factor (('*'|'/') factor)*
+    }
+PREFIX_POWERS = {
+    PLUS: 30, MINUS: 30,   # ('+'|'-') factor
+    }
+
+class ParseError(Exception):
+    '''
+    Syntax error found by the parser, as opposed to the errors of the
+    scanner which can not be recovered from.
+    '''
+    pass
+
 class Parser:
-    def __init__(self, scanner):
+    def __init__(self, scanner, factory = None):
         self.scanner = scanner
+        # creates the expression nodes, e.g. a HashConsingNodeFactory
+        self.factory = factory if factory is not None else NodeFactory()
 
     def error(self):
         text = self.scanner.currentToken.text
-        raise Exception('{position} : Syntax error around \'{text}\'!'.format(
-            position = self.scanner.currentToken.position,
+        raise ParseError('{position} : Syntax error around \'{text}\'!'.format(
+            position = describePosition(self.scanner.charStream,
+                                        self.scanner.currentToken.position),
             text = text if text else 'EOF'))
 
     def match(self, type):
@@ -180,51 +397,64 @@ class Parser:
         Compare the current token type with the passed token type and if they
         match then consume the current token otherwise raise an exception.
         '''
-        token = self.scanner.currentToken
-        if token.type == type:
+        if self.scanner.currentType == type:
+            token = self.scanner.currentToken
             self.scanner.nextToken()
             return token
         else:
             self.error()
 
+    def skip(self, type):
+        '''
+        Consume the current token like match(), for the tokens no node
+        keeps: their Token is never asked for, so a TokenCursor does not
+        build it.
+        '''
+        if self.scanner.currentType == type:
+            self.scanner.nextToken()
+        else:
+            self.error()
+
     def arguments(self):
         '''
         Recursive-descent parsing procedure for arguments:
         arguments ::= (expression(',' expression)*)?
         '''
-        root = FunctionArgumentsNode(PhonyToken(ARGUMENTS, 0))
-        while (self.scanner.currentToken is not None and
-        self.scanner.currentToken.type is not RPAREN):
-            root.addChild(self.expression())
-            if self.scanner.currentToken.type == COMMA:
+        children = []
+        while self.scanner.currentType is not RPAREN:
+            children.append(self.expression())
+            if self.scanner.currentType == COMMA:
                 self.scanner.nextToken()
-        return root
+        return self.factory.create(FunctionArgumentsNode,
+                                   PhonyToken(ARGUMENTS, 0), children)
 
     def parameters(self):
         '''
         Recursive-descent parsing procedure for parameters:
         parameters ::= (identifier(',' identifier)*) ?
         '''
-        root = FunctionParametersNode(PhonyToken(PARAMETERS, 0))
-        while (self.scanner.currentToken is not None and
-        self.scanner.currentToken.type is not RPAREN):
-            root.addChild(IdentifierNode(self.match(IDENTIFIER)))
-            if self.scanner.currentToken.type == COMMA:
+        children = []
+        while self.scanner.currentType is not RPAREN:
+            children.append(self.factory.createUnique(
+                IdentifierNode, self.match(IDENTIFIER), []))
+            if self.scanner.currentType == COMMA:
                 self.scanner.nextToken()
-        return root
+        return self.factory.createUnique(FunctionParametersNode,
+                                         PhonyToken(PARAMETERS, 0), children)
 
     def definition(self):
         '''
         Recursive-descent parsing procedure for function:
         definition ::= '(' parameters ')' statements 'end'
         '''
-        root = FunctionDefinitionNode(PhonyToken(DEFINE, 0))
-        self.match(LPAREN)
-        root.addChild(self.parameters())
-        self.match(RPAREN)
-        root.addChild(self.statements())
-        self.match(END)
-        return root
+        self.skip(LPAREN)
+        parameters = self.parameters()
+        self.skip(RPAREN)
+        statements = self.statements()
+        self.skip(END)
+        return self.factory.createUnique(FunctionDefinitionNode,
+                                         PhonyToken(DEFINE, 0),
+                                         [parameters, statements])
 
     def prefixexp(self):
         '''
@@ -232,106 +462,86 @@ class Parser:
         prefixexp ::= (identifier | '(' expression ')') ('(' arguments ')')*
         '''
         root = None
-        if self.scanner.currentToken.type == IDENTIFIER:
-            root = IdentifierNode(self.match(IDENTIFIER))
-        elif self.scanner.currentToken.type == LPAREN:
-            self.match(LPAREN)
+        if self.scanner.currentType == IDENTIFIER:
+            root = self.factory.create(IdentifierNode,
+                                       self.match(IDENTIFIER), [])
+        elif self.scanner.currentType == LPAREN:
+            self.skip(LPAREN)
             root = self.expression()
-            self.match(RPAREN)
+            self.skip(RPAREN)
 
-        while (self.scanner.currentToken is not None and
-        self.scanner.currentToken.type == LPAREN):
-            prefix = root
-            root = FunctionCallNode(PhonyToken(CALL, 0))
-            root.addChild(prefix)
-            self.match(LPAREN)
-            root.addChild(self.arguments())
-            self.match(RPAREN)
+        while self.scanner.currentType == LPAREN:
+            self.skip(LPAREN)
+            arguments = self.arguments()
+            self.skip(RPAREN)
+            root = self.factory.create(FunctionCallNode, PhonyToken(CALL, 0),
+                                       [root, arguments])
 
         return root
 
-    def factor(self):
+    def expression(self):
         '''
-        Recursive-descent parsing procedure for factor:
+        Precedence-climbing parsing procedure for expression:
+        expression ::= term (('+'|'-') term)* | function
+        term ::= factor (('*'|'/') factor)*
         factor ::= integer | ('+'|'-') factor | prefixexp
         '''
-        token = self.scanner.currentToken
-        if token.type in (PLUS, MINUS):
-            self.scanner.nextToken()
-            root = UnaryExpressionNode(token)
-            root.addChild(self.factor())
-            return root
-        elif token.type == INTEGER:
-            self.match(INTEGER)
-            return IntegerNode(token)
-        elif token.type in (IDENTIFIER, LPAREN):
-            return self.prefixexp()
+        if self.scanner.currentType == FUNCTION:
+            self.skip(FUNCTION)
+            return self.definition()
         else:
-            self.error()
+            return self.operatorExpression(0)
 
-    def term(self):
+    def operatorExpression(self, minPower):
         '''
-        Recursive-descent parsing procedure for term:
-        term ::= factor (('*'|'/') factor)*
+        Parse an operand and then every binary operator binding tighter
+        than minPower, taking binding powers from the operator tables.
         '''
-        root = self.factor()
-
-        while self.scanner.currentToken.type in (MUL, DIV):
+        type = self.scanner.currentType
+        power = PREFIX_POWERS.get(type)
+        if power is not None:
             token = self.scanner.currentToken
             self.scanner.nextToken()
-            lhs = root
-            rhs = self.factor()
-            root = BinaryExpressionNode(token)
-            root.addChild(lhs)
-            root.addChild(rhs)
-
-        return root
-
-    def expression(self):
-        '''
-        Recursive-descent parsing procedure for expression:
-        expression ::= term (('+'|'-') term)* | function
-        '''
-        if self.scanner.currentToken.type == FUNCTION:
-            self.match(FUNCTION)
-            return self.definition()
+            root = self.factory.create(UnaryExpressionNode, token,
+                                       [self.operatorExpression(power)])
+        elif type == INTEGER:
+            token = self.scanner.currentToken
+            self.scanner.nextToken()
+            root = self.factory.create(IntegerNode, token, [])
+        elif type in (IDENTIFIER, LPAREN):
+            root = self.prefixexp()
         else:
-            root = self.term()
-
-            while self.scanner.currentToken.type in (PLUS, MINUS):
-                token = self.scanner.currentToken
-                self.scanner.nextToken()
-                lhs = root
-                rhs = self.term()
-                root = BinaryExpressionNode(token)
-                root.addChild(lhs)
-                root.addChild(rhs)
+            self.error()
 
-            return root
+        while True:
+            power = INFIX_POWERS.get(self.scanner.currentType)
+            if power is None or power <= minPower:
+                return root
+            token = self.scanner.currentToken
+            self.scanner.nextToken()
+            rhs = self.operatorExpression(power) # left associative
+            root = self.factory.create(BinaryExpressionNode, token,
+                                       [root, rhs])
 
     def assignment(self):
         '''
         Recursive-descent parsing procedure for assignment:
         assignment ::= identifier '=' expression | 'function' identifier definition
         '''
-
-	root = None
-
-        if self.scanner.currentToken.type == FUNCTION:
-            self.match(FUNCTION)
+        if self.scanner.currentType == FUNCTION:
+            self.skip(FUNCTION)
             target = self.match(IDENTIFIER)
             # phony assign token
             token = Token(ASSIGN, '=', self.scanner.charStream.position)
-            root = BinaryExpressionNode(token)
-            root.addChild(IdentifierNode(target))
-            root.addChild(self.definition())
+            value = self.definition()
         else:
             target = self.match(IDENTIFIER)
-            root = BinaryExpressionNode(self.match(ASSIGN))
-            root.addChild(IdentifierNode(target))
-            root.addChild(self.expression())
+            token = self.match(ASSIGN)
+            value = self.expression()
 
-        return root
+        return self.factory.createUnique(
+            BinaryExpressionNode, token,
+            [self.factory.createUnique(IdentifierNode, target, []), value])
 
     def returnstmt(self):
         '''
@@ -339,33 +549,139 @@ class Parser:
         returnstmt ::= 'return' expression
         '''
         token = self.match(RETURN)
-        root = ReturnStatementNode(token)
-        root.addChild(self.expression())
-        return root
+        return self.factory.createUnique(ReturnStatementNode, token,
+                                         [self.expression()])
 
     def statements(self):
         '''
         Recursive-descent parsing procedure for statements:
         statements ::= assignment * returnstmt ?
         '''
-        root = StatementListNode(PhonyToken(STATEMENTS, 0))
+        root = self.factory.createUnique(StatementListNode,
+                                         PhonyToken(STATEMENTS, 0), [])
 
-        while (self.scanner.currentToken is not None and
-        self.scanner.currentToken.type == IDENTIFIER or 
-        self.scanner.currentToken.type == FUNCTION):
+        while (self.scanner.currentType == IDENTIFIER or
+        self.scanner.currentType == FUNCTION):
             root.addChild(self.assignment())
 
-        if (self.scanner.currentToken is not None and
-        self.scanner.currentToken.type == RETURN):
+        if self.scanner.currentType == RETURN:
             root.addChild(self.returnstmt())
 
         return root
 
+    def statementStream(self):
+        '''
+        Generator version of statements for the top level: yield every
+        statement as soon as it is parsed instead of collecting them in a
+        StatementListNode, so a caller can run and drop them one by one.
+        '''
+        while (self.scanner.currentType == IDENTIFIER or
+        self.scanner.currentType == FUNCTION):
+            yield self.assignment()
+
+        if self.scanner.currentType == RETURN:
+            yield self.returnstmt()
+
+###########################################################
+# RecoveringParser -- all syntax errors of a source in one pass
+###########################################################
+# Token types a statement list can continue at after a syntax error
+SYNC_TOKEN_TYPES = (IDENTIFIER, FUNCTION, RETURN, END, EOF)
+
+class RecoveringParser(Parser):
+    '''
+    Parser that records syntax errors instead of stopping at the first one.
+    After an error the tokens up to the next statement start are skipped and
+    parsing goes on, the statement in error is left out of the tree. Tokens
+    after the statements, which Parser ignores, are reported as errors too.
+    '''
+    def __init__(self, scanner, factory = None):
+        Parser.__init__(self, scanner, factory)
+        self.errors = []  # messages of the syntax errors, in source order
+        self.depth = 0    # nesting of statement lists
+
+    def parse(self):
+        '''
+        Return the partial AST and the list of error messages.
+        '''
+        root = self.statements()
+        return root, self.errors
+
+    def synchronize(self, start):
+        '''
+        Skip to the next token a statement list can continue at, skipping at
+        least one token if the statement in error did not get past its
+        first token (start).
+        '''
+        if self.scanner.currentToken is start:
+            self.scanner.nextToken()
+        while self.scanner.currentType not in SYNC_TOKEN_TYPES:
+            self.scanner.nextToken()
+
+    def statements(self):
+        '''
+        Recovering parsing procedure for statements:
+        statements ::= assignment * returnstmt ?
+        '''
+        root = self.factory.createUnique(StatementListNode,
+                                         PhonyToken(STATEMENTS, 0), [])
+        self.depth += 1
+        closing = END if self.depth > 1 else EOF # what ends the list
+        returned = False
+
+        while True:
+            start = self.scanner.currentToken
+            if start.type == closing or start.type == EOF:
+                break
+            try:
+                if returned:
+                    self.error() # nothing may follow a return statement
+                elif start.type == IDENTIFIER or start.type == FUNCTION:
+                    root.addChild(self.assignment())
+                elif start.type == RETURN:
+                    root.addChild(self.returnstmt())
+                    returned = True
+                else:
+                    self.error()
+            except ParseError as error:
+                self.errors.append(str(error))
+                self.synchronize(start)
+
+        self.depth -= 1
+        return root
+
 ###########################################################
 # Top-level script tests
 ###########################################################
-import sys
+import sys, tempfile
 if __name__ == '__main__':
+    # the scanner engines agree on characters outside ASCII
+    for text in (u'a = 1\nb\u00e9 = 2\n', u'c = 2\u00b2\n',
+                 u'd =\u00a01\n', 'e = 1\n\xe9 = 2\n'):
+        results = []
+        for engine in SCANNERS:
+            scanner = createScanner(CharStream(text), engine)
+            tokens = []
+            try:
+                while scanner.currentToken.type != EOF:
+                    tokens.append(str(scanner.currentToken))
+                    scanner.nextToken()
+            except Exception as error:
+                tokens.append(str(error))
+            results.append(tokens)
+        assert results[0] == results[1], results
+
+    # a mapped source is closed when its script fails
+    with tempfile.TemporaryFile() as file:
+        file.write(b'a = (1\n')
+        file.flush()
+        try:
+            with MMapCharStream(file) as charStream:
+                Parser(Scanner(charStream)).statements()
+        except ParseError:
+            pass
+        assert charStream.text == '' and charStream.currentChar is None
+
     while True:
         try:
             if sys.version_info >= (3, 0):
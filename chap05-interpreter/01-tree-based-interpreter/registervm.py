@@ -0,0 +1,377 @@
+###########################################################
+# Register VM -- three-address code on a register file
+###########################################################
+
+from heapq import heappush, heappop
+from interpreter import *
+from stackvm import Code
+
+# Opcodes; every instruction is an opcode followed by three operands
+LOAD_NAME, STORE_NAME, ADD, SUBTRACT, MULTIPLY, DIVIDE, NEGATE, CALL, \
+STORE_ANS, RETURN = range(10)
+
+OPCODE_NAMES = (
+    'LOAD_NAME', 'STORE_NAME', 'ADD', 'SUBTRACT', 'MULTIPLY', 'DIVIDE',
+    'NEGATE', 'CALL', 'STORE_ANS', 'RETURN')
+
+ARITHMETIC_OPCODES = {PLUS: ADD, MINUS: SUBTRACT, MUL: MULTIPLY, DIV: DIVIDE}
+
+# Operands of every opcode that are registers: (written, read). The reads
+# of CALL also include the registers of its argument list.
+REGISTER_OPERANDS = {
+    LOAD_NAME: ((0,), ()),
+    STORE_NAME: ((), (1,)),
+    ADD: ((0,), (1, 2)), SUBTRACT: ((0,), (1, 2)),
+    MULTIPLY: ((0,), (1, 2)), DIVIDE: ((0,), (1, 2)),
+    NEGATE: ((0,), (1,)),
+    CALL: ((0,), (1,)),
+    STORE_ANS: ((), (0,)),
+    RETURN: ((), ()),
+    }
+
+class RegisterCode(Code):
+    '''
+    Code of the register VM. The register file of a frame starts with the
+    constant pool, so that constants are operands like any register, and
+    goes on with the temporaries. CALL names its argument registers by an
+    index into the argument lists.
+    '''
+    def __init__(self, name, parameters = ()):
+        Code.__init__(self, name, parameters)
+        self.temporaries = 0    # number of registers after the constants
+        self.argumentLists = [] # tuples of registers
+
+    def emit(self, opcode, a = 0, b = 0, c = 0, position = 0):
+        self.instructions.extend((opcode, a, b, c))
+        self.positions.append(position)
+
+###########################################################
+# Linear-scan register allocation
+###########################################################
+def linearScan(starts, ends):
+    '''
+    Assign registers to live intervals given in the order of their starts:
+    an interval takes the lowest register free at its start, the register
+    of an interval is free from the instruction it ends at on (operands are
+    read before the result is written). Return the register of every
+    interval and the number of registers used.
+    '''
+    registers = [0] * len(starts)
+    free = []   # heap of free registers
+    active = [] # heap of (end, register) of the live intervals
+    count = 0
+    for interval, start in enumerate(starts):
+        while active and active[0][0] <= start:
+            heappush(free, heappop(active)[1])
+        if free:
+            register = heappop(free)
+        else:
+            register = count
+            count += 1
+        registers[interval] = register
+        heappush(active, (ends[interval], register))
+    return registers, count
+
+def allocateRegisters(code, instructions, temporaries):
+    '''
+    Emit the instructions of a RegisterCode, written with virtual
+    registers: constant i as ~i and every temporary as a number of its own,
+    numbered in the order they are written.
+    '''
+    starts = [0] * temporaries
+    ends = [0] * temporaries
+    for index, instruction in enumerate(instructions):
+        opcode = instruction[0]
+        written, read = REGISTER_OPERANDS[opcode]
+        used = [instruction[1 + operand] for operand in read]
+        if opcode == CALL:
+            used.extend(code.argumentLists[instruction[3]])
+        for register in used:
+            if register >= 0:
+                ends[register] = index
+        for operand in written:
+            register = instruction[1 + operand]
+            starts[register] = ends[register] = index
+
+    registers, code.temporaries = linearScan(starts, ends)
+    constants = len(code.constants)
+    def physical(register):
+        if register < 0:
+            return ~register
+        return constants + registers[register]
+
+    code.argumentLists = [tuple(physical(register) for register in arguments)
+                          for arguments in code.argumentLists]
+    for instruction in instructions:
+        opcode, operands = instruction[0], list(instruction[1:4])
+        written, read = REGISTER_OPERANDS[opcode]
+        for operand in written + read:
+            operands[operand] = physical(operands[operand])
+        code.emit(opcode, operands[0], operands[1], operands[2],
+                  instruction[4])
+
+###########################################################
+# RegisterCompiler
+###########################################################
+class RegisterCompiler(AbstractNodeVisitor):
+    '''
+    Emits three-address instructions for the nodes: an expression returns
+    the virtual register holding its value, a new temporary for every
+    result, and the registers are allocated once a Code is complete.
+    '''
+    def __init__(self):
+        self.code = None
+        self.instructions = None # [opcode, a, b, c, position]
+        self.temporaries = 0
+
+    def compile(self, root, name = '_main_', parameters = ()):
+        '''
+        Return the RegisterCode of the statements (a StatementListNode or
+        one statement) of the root.
+        '''
+        saved = self.code, self.instructions, self.temporaries
+        self.code = code = RegisterCode(name, parameters)
+        self.instructions = []
+        self.temporaries = 0
+        self.visit(root)
+        self.add(RETURN)
+        allocateRegisters(code, self.instructions, self.temporaries)
+        self.code, self.instructions, self.temporaries = saved
+        return code
+
+    def add(self, opcode, a = 0, b = 0, c = 0, position = 0):
+        self.instructions.append((opcode, a, b, c, position))
+
+    def temporary(self):
+        self.temporaries += 1
+        return self.temporaries - 1
+
+    def visitBinaryExpressionNode(self, node):
+        if node.token.type == ASSIGN:
+            value = self.visit(node.children[1])
+            target = node.children[0].token
+            self.add(STORE_NAME, self.code.intern(target.text), value, 0,
+                     target.position)
+            return None
+        lhs = self.visit(node.children[0])
+        rhs = self.visit(node.children[1])
+        result = self.temporary()
+        self.add(ARITHMETIC_OPCODES[node.token.type], result, lhs, rhs,
+                 node.token.position)
+        return result
+
+    def visitIntegerNode(self, node):
+        return ~self.code.constant(int(node.token.text))
+
+    def visitUnaryExpressionNode(self, node):
+        operand = self.visit(node.children[0])
+        if node.token.type == MINUS:
+            result = self.temporary()
+            self.add(NEGATE, result, operand, 0, node.token.position)
+            return result
+        return operand
+
+    def visitIdentifierNode(self, node):
+        result = self.temporary()
+        self.add(LOAD_NAME, result, self.code.intern(node.token.text), 0,
+                 node.token.position)
+        return result
+
+    def visitStatementListNode(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visitFunctionArgumentsNode(self, node):
+        pass # compiled with the function call
+
+    def visitFunctionParametersNode(self, node):
+        pass # compiled with the function definition
+
+    def visitFunctionCallNode(self, node):
+        function = self.visit(node.children[0])
+        arguments = tuple(self.visit(child)
+                          for child in node.children[1].children)
+        self.code.argumentLists.append(arguments)
+        result = self.temporary()
+        self.add(CALL, result, function, len(self.code.argumentLists) - 1,
+                 node.token.position)
+        return result
+
+    def visitFunctionDefinitionNode(self, node):
+        parameters = tuple(child.token.text
+                           for child in node.children[0].children)
+        function = self.compile(node.children[1], node.token.text, parameters)
+        return ~self.code.function(function)
+
+    def visitReturnStatementNode(self, node):
+        value = self.visit(node.children[0])
+        self.add(STORE_ANS, value, 0, 0, node.token.position)
+
+###########################################################
+# Disassembler
+###########################################################
+def disassemble(code, lines = None):
+    '''
+    Return the listing of a RegisterCode and of the functions it defines:
+    temporaries show as r<n>, constants as their value.
+    '''
+    if lines is None:
+        lines = []
+    lines.append('code {name}({parameters}): {registers} registers'.format(
+        name = code.name, parameters = ', '.join(code.parameters),
+        registers = code.temporaries))
+    constants = len(code.constants)
+    def register(number):
+        if number >= constants:
+            return 'r{number}'.format(number = number - constants)
+        elif isinstance(code.constants[number], Code):
+            return '<function>'
+        return '#{value}'.format(value = code.constants[number])
+
+    instructions = code.instructions
+    for pc in range(0, len(instructions), 4):
+        opcode, a, b, c = instructions[pc:pc + 4]
+        if opcode == LOAD_NAME:
+            operands = [register(a), code.names[b]]
+        elif opcode == STORE_NAME:
+            operands = [code.names[a], register(b)]
+        elif opcode == CALL:
+            operands = [register(a), register(b)] + [
+                register(argument) for argument in code.argumentLists[c]]
+        else:
+            written, read = REGISTER_OPERANDS[opcode]
+            operands = [register((a, b, c)[operand])
+                        for operand in written + read]
+        lines.append('{pc:>6} {opcode:<12} {operands}'.format(
+            pc = pc, opcode = OPCODE_NAMES[opcode],
+            operands = ', '.join(operands)).rstrip())
+    for function in code.constants:
+        if isinstance(function, Code):
+            disassemble(function, lines)
+    return lines
+
+###########################################################
+# RegisterVM
+###########################################################
+class Frame:
+    '''
+    Saved state of a calling function: its code, the program counter to
+    go on at, its symbol table, its register file and the register the
+    result of the call goes to.
+    '''
+    def __init__(self, code, pc, symbols, registers, result):
+        self.code = code
+        self.pc = pc
+        self.symbols = symbols
+        self.registers = registers
+        self.result = result
+
+class RegisterVM(Interpreter):
+    '''
+    Runs RegisterCode in one dispatch loop; every frame has its register
+    file, a list of the constants followed by the temporaries.
+    '''
+    def __init__(self, charStream = None):
+        Interpreter.__init__(self, charStream)
+        self.compiler = RegisterCompiler()
+
+    def compile(self, root):
+        return self.compiler.compile(root)
+
+    def run(self, root):
+        return self.execute(self.compile(root))
+
+    def visit(self, node):
+        # accept() and runStream() run nodes through here
+        return self.run(node)
+
+    def error(self, message, code, pc):
+        raise Exception('{position}{message}'.format(
+            position = describePosition(self.charStream,
+                                        code.positions[pc // 4]),
+            message = message))
+
+    def execute(self, code):
+        '''
+        Run RegisterCode on the global memory.
+        '''
+        globalSymbols = symbols = self.globalSpace.symval
+        callStack = self.callStack
+        frames = []
+        registers = code.constants + [None] * code.temporaries
+        instructions, names = code.instructions, code.names
+        pc = 0
+        while True:
+            opcode = instructions[pc]
+            a = instructions[pc + 1]
+            b = instructions[pc + 2]
+            c = instructions[pc + 3]
+            pc += 4
+            if opcode == LOAD_NAME:
+                name = names[b]
+                value = symbols.get(name)
+                if value is None:
+                    value = globalSymbols.get(name)
+                    if value is None:
+                        self.error(' : Undefined symbol \'{name}\'!'.format(
+                            name = name), code, pc - 4)
+                registers[a] = value
+            elif opcode == ADD:
+                registers[a] = registers[b] + registers[c]
+            elif opcode == SUBTRACT:
+                registers[a] = registers[b] - registers[c]
+            elif opcode == MULTIPLY:
+                registers[a] = registers[b] * registers[c]
+            elif opcode == DIVIDE:
+                registers[a] = registers[b] / registers[c]
+            elif opcode == STORE_NAME:
+                name = names[a]
+                value = registers[b]
+                # a global of the name is updated, unless it is shadowed
+                if (symbols.get(name) is None and
+                    globalSymbols.get(name) is not None):
+                    globalSymbols[name] = value
+                symbols[name] = value
+            elif opcode == NEGATE:
+                registers[a] = -registers[b]
+            elif opcode == CALL:
+                function = registers[b]
+                arguments = code.argumentLists[c]
+                if len(function.parameters) != len(arguments):
+                    self.error(': Arguments mismatch!', code, pc - 4)
+                funcspace = MemorySpace(function.name)
+                funcsymbols = funcspace.symval
+                funcsymbols['ans'] = None # return value
+                for parameter, argument in zip(function.parameters,
+                                               arguments):
+                    funcsymbols[parameter] = registers[argument]
+                callStack.append(funcspace)
+                frames.append(Frame(code, pc, symbols, registers, a))
+                code, symbols, pc = function, funcsymbols, 0
+                registers = code.constants + [None] * code.temporaries
+                instructions, names = code.instructions, code.names
+            elif opcode == STORE_ANS:
+                symbols['ans'] = registers[a]
+            elif opcode == RETURN:
+                if not frames:
+                    return None
+                value = symbols['ans']
+                callStack.pop()
+                frame = frames.pop()
+                code, symbols, pc = frame.code, frame.symbols, frame.pc
+                registers = frame.registers
+                instructions, names = code.instructions, code.names
+                registers[frame.result] = value
+
+###########################################################
+# Top-level script tests
+###########################################################
+if __name__ == '__main__':
+    texts = ENGINE_TEST_TEXTS + [
+        'a = 2\nb = 3\nc = 4\nd = 5\nx = a * b + c * d - (a - b) * (c - d)\n',
+        ]
+    for engine, result in compareWithInterpreter(RegisterVM, texts):
+        print(result)
+    for text in (texts[0], texts[-1]):
+        root = Parser(Scanner(CharStream(text))).statements()
+        print('\n'.join(disassemble(RegisterCompiler().compile(root))))
@@ -0,0 +1,194 @@
+###########################################################
+# StackParser -- parsing without Python recursion
+###########################################################
+
+from types import GeneratorType
+from parser import *
+
+class StackParser(Parser):
+    '''
+    Parser building the same trees as Parser, for any nesting depth.
+
+    Every parsing procedure is a generator. Instead of calling the procedure
+    of a nested construct it yields that procedure's generator, and it
+    yields a node to give its result back. The generators waiting for a
+    nested result are kept on an explicit stack, so the memory used grows
+    with the nesting depth but the Python call stack does not.
+    '''
+    def run(self, procedure):
+        '''
+        Drive a generator procedure and its nested procedures to the end and
+        return its result.
+        '''
+        stack = [procedure]
+        value = None
+        while True:
+            result = stack[-1].send(value)
+            if isinstance(result, GeneratorType):
+                stack.append(result) # call a nested procedure
+                value = None
+            else:
+                stack.pop()          # return from a procedure
+                if not stack:
+                    return result
+                value = result
+
+    def statements(self):
+        return self.run(self.statementsSteps())
+
+    def expression(self):
+        return self.run(self.expressionSteps())
+
+    def argumentsSteps(self):
+        '''
+        arguments ::= (expression(',' expression)*)?
+        '''
+        children = []
+        while (self.scanner.currentToken is not None and
+        self.scanner.currentToken.type is not RPAREN):
+            children.append((yield self.expressionSteps()))
+            if self.scanner.currentToken.type == COMMA:
+                self.scanner.nextToken()
+        yield self.factory.create(FunctionArgumentsNode,
+                                  PhonyToken(ARGUMENTS, 0), children)
+
+    def definitionSteps(self):
+        '''
+        definition ::= '(' parameters ')' statements 'end'
+        '''
+        self.match(LPAREN)
+        parameters = self.parameters() # identifiers only, never nested
+        self.match(RPAREN)
+        statements = yield self.statementsSteps()
+        self.match(END)
+        yield self.factory.createUnique(FunctionDefinitionNode,
+                                        PhonyToken(DEFINE, 0),
+                                        [parameters, statements])
+
+    def prefixexpSteps(self):
+        '''
+        prefixexp ::= (identifier | '(' expression ')') ('(' arguments ')')*
+        '''
+        root = None
+        if self.scanner.currentToken.type == IDENTIFIER:
+            root = self.factory.create(IdentifierNode,
+                                       self.match(IDENTIFIER), [])
+        elif self.scanner.currentToken.type == LPAREN:
+            self.match(LPAREN)
+            root = yield self.expressionSteps()
+            self.match(RPAREN)
+
+        while (self.scanner.currentToken is not None and
+        self.scanner.currentToken.type == LPAREN):
+            self.match(LPAREN)
+            arguments = yield self.argumentsSteps()
+            self.match(RPAREN)
+            root = self.factory.create(FunctionCallNode, PhonyToken(CALL, 0),
+                                       [root, arguments])
+
+        yield root
+
+    def expressionSteps(self):
+        '''
+        expression ::= term (('+'|'-') term)* | function
+        '''
+        if self.scanner.currentToken.type == FUNCTION:
+            self.match(FUNCTION)
+            yield (yield self.definitionSteps())
+        else:
+            yield (yield self.operatorExpressionSteps(0))
+
+    def operatorExpressionSteps(self, minPower):
+        '''
+        Operand followed by the binary operators binding tighter than
+        minPower, as in Parser.operatorExpression().
+        '''
+        token = self.scanner.currentToken
+        power = PREFIX_POWERS.get(token.type)
+        if power is not None:
+            self.scanner.nextToken()
+            operand = yield self.operatorExpressionSteps(power)
+            root = self.factory.create(UnaryExpressionNode, token, [operand])
+        elif token.type == INTEGER:
+            self.scanner.nextToken()
+            root = self.factory.create(IntegerNode, token, [])
+        elif token.type in (IDENTIFIER, LPAREN):
+            root = yield self.prefixexpSteps()
+        else:
+            self.error()
+
+        while True:
+            token = self.scanner.currentToken
+            power = INFIX_POWERS.get(token.type)
+            if power is None or power <= minPower:
+                break
+            self.scanner.nextToken()
+            rhs = yield self.operatorExpressionSteps(power)
+            root = self.factory.create(BinaryExpressionNode, token,
+                                       [root, rhs])
+        yield root
+
+    def assignmentSteps(self):
+        '''
+        assignment ::= identifier '=' expression | 'function' identifier definition
+        '''
+        if self.scanner.currentToken.type == FUNCTION:
+            self.match(FUNCTION)
+            target = self.match(IDENTIFIER)
+            # phony assign token
+            token = Token(ASSIGN, '=', self.scanner.charStream.position)
+            value = yield self.definitionSteps()
+        else:
+            target = self.match(IDENTIFIER)
+            token = self.match(ASSIGN)
+            value = yield self.expressionSteps()
+        yield self.factory.createUnique(
+            BinaryExpressionNode, token,
+            [self.factory.createUnique(IdentifierNode, target, []), value])
+
+    def returnstmtSteps(self):
+        '''
+        returnstmt ::= 'return' expression
+        '''
+        token = self.match(RETURN)
+        value = yield self.expressionSteps()
+        yield self.factory.createUnique(ReturnStatementNode, token, [value])
+
+    def statementsSteps(self):
+        '''
+        statements ::= assignment * returnstmt ?
+        '''
+        root = self.factory.createUnique(StatementListNode,
+                                         PhonyToken(STATEMENTS, 0), [])
+
+        while (self.scanner.currentToken is not None and
+        self.scanner.currentToken.type == IDENTIFIER or
+        self.scanner.currentToken.type == FUNCTION):
+            root.addChild((yield self.assignmentSteps()))
+
+        if (self.scanner.currentToken is not None and
+        self.scanner.currentToken.type == RETURN):
+            root.addChild((yield self.returnstmtSteps()))
+
+        yield root
+
+###########################################################
+# Top-level script tests
+###########################################################
+import sys
+if __name__ == '__main__':
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    texts = [
+        'a = ' + '(' * depth + '1' + ')' * depth,
+        'a = ' + '- ' * depth + '1',
+        'a = ' + 'f(' * depth + ')' * depth,
+        'function f() ' + 'g = function() ' * depth + 'end ' * depth + 'end',
+        ]
+    for text in texts:
+        root = StackParser(RegexScanner(CharStream(text))).statements()
+        levels = 0
+        while root.children:
+            root = root.children[-1]
+            levels += 1
+        print('{text}... : {levels} levels'.format(text = text[:16],
+                                                    levels = levels))
@@ -0,0 +1,307 @@
+###########################################################
+# Stack VM -- bytecode compiler and stack-based virtual machine
+###########################################################
+
+from array import array
+from interpreter import *
+from tokenbuffer import POSITION_TYPECODE
+
+# Opcodes; every instruction is an opcode followed by one operand
+LOAD_CONST, LOAD_NAME, STORE_NAME, BINARY_ADD, BINARY_SUBTRACT,       \
+BINARY_MULTIPLY, BINARY_DIVIDE, UNARY_NEGATIVE, CALL, STORE_ANS,      \
+RETURN = range(11)
+
+OPCODE_NAMES = (
+    'LOAD_CONST', 'LOAD_NAME', 'STORE_NAME', 'BINARY_ADD', 'BINARY_SUBTRACT',
+    'BINARY_MULTIPLY', 'BINARY_DIVIDE', 'UNARY_NEGATIVE', 'CALL', 'STORE_ANS',
+    'RETURN')
+
+BINARY_OPCODES = {
+    PLUS: BINARY_ADD, MINUS: BINARY_SUBTRACT, MUL: BINARY_MULTIPLY,
+    DIV: BINARY_DIVIDE}
+
+class Code(object):
+    '''
+    Compiled statements: the instructions as (opcode, operand) pairs in an
+    array, the constant pool (integers and the Code of function
+    definitions), the name table, the token position of every instruction
+    and, for a function, its parameter names. A Code in the constant pool
+    is the value of its function definition.
+    '''
+    def __init__(self, name, parameters = ()):
+        self.name = name
+        self.parameters = parameters
+        self.instructions = array('i')
+        self.positions = array(POSITION_TYPECODE) # by instruction number
+        self.constants = []
+        self.constantIndex = {}
+        self.names = []
+        self.nameIndex = {}
+
+    def emit(self, opcode, operand = 0, position = 0):
+        self.instructions.append(opcode)
+        self.instructions.append(operand)
+        self.positions.append(position)
+
+    def constant(self, value):
+        '''
+        Return the index of an integer in the constant pool.
+        '''
+        index = self.constantIndex.get(value)
+        if index is None:
+            index = self.constantIndex[value] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def function(self, code):
+        # function definitions are never shared
+        self.constants.append(code)
+        return len(self.constants) - 1
+
+    def intern(self, text):
+        index = self.nameIndex.get(text)
+        if index is None:
+            index = self.nameIndex[text] = len(self.names)
+            self.names.append(text)
+        return index
+
+###########################################################
+# BytecodeCompiler
+###########################################################
+class BytecodeCompiler(AbstractNodeVisitor):
+    '''
+    Emits the instructions of the nodes into the Code being compiled:
+    expressions leave their value on the stack, statements leave it empty.
+    '''
+    def __init__(self):
+        self.code = None
+
+    def compile(self, root, name = '_main_', parameters = ()):
+        '''
+        Return the Code of the statements (a StatementListNode or one
+        statement) of the root.
+        '''
+        saveCode = self.code
+        self.code = Code(name, parameters)
+        self.visit(root)
+        self.code.emit(RETURN)
+        code, self.code = self.code, saveCode
+        return code
+
+    def visitBinaryExpressionNode(self, node):
+        if node.token.type == ASSIGN:
+            self.visit(node.children[1])
+            target = node.children[0].token
+            self.code.emit(STORE_NAME, self.code.intern(target.text),
+                           target.position)
+        else:
+            self.visit(node.children[0])
+            self.visit(node.children[1])
+            self.code.emit(BINARY_OPCODES[node.token.type], 0,
+                           node.token.position)
+
+    def visitIntegerNode(self, node):
+        self.code.emit(LOAD_CONST, self.code.constant(int(node.token.text)),
+                       node.token.position)
+
+    def visitUnaryExpressionNode(self, node):
+        self.visit(node.children[0])
+        if node.token.type == MINUS:
+            self.code.emit(UNARY_NEGATIVE, 0, node.token.position)
+
+    def visitIdentifierNode(self, node):
+        self.code.emit(LOAD_NAME, self.code.intern(node.token.text),
+                       node.token.position)
+
+    def visitStatementListNode(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visitFunctionArgumentsNode(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visitFunctionParametersNode(self, node):
+        pass # compiled with the function definition
+
+    def visitFunctionCallNode(self, node):
+        self.visit(node.children[0])
+        self.visit(node.children[1])
+        self.code.emit(CALL, len(node.children[1].children),
+                       node.token.position)
+
+    def visitFunctionDefinitionNode(self, node):
+        parameters = tuple(child.token.text
+                           for child in node.children[0].children)
+        function = self.compile(node.children[1], node.token.text, parameters)
+        self.code.emit(LOAD_CONST, self.code.function(function),
+                       node.token.position)
+
+    def visitReturnStatementNode(self, node):
+        self.visit(node.children[0])
+        self.code.emit(STORE_ANS, 0, node.token.position)
+
+###########################################################
+# Disassembler
+###########################################################
+def disassemble(code, lines = None):
+    '''
+    Return the listing of a Code and of the functions it defines.
+    '''
+    if lines is None:
+        lines = []
+    lines.append('code {name}({parameters}):'.format(
+        name = code.name, parameters = ', '.join(code.parameters)))
+    functions = []
+    instructions = code.instructions
+    for pc in range(0, len(instructions), 2):
+        opcode, operand = instructions[pc], instructions[pc + 1]
+        if opcode == LOAD_CONST:
+            value = code.constants[operand]
+            if isinstance(value, Code):
+                functions.append(value)
+                argument = '{operand} (function)'.format(operand = operand)
+            else:
+                argument = '{operand} ({value})'.format(operand = operand,
+                                                        value = value)
+        elif opcode in (LOAD_NAME, STORE_NAME):
+            argument = '{operand} ({name})'.format(
+                operand = operand, name = code.names[operand])
+        elif opcode == CALL:
+            argument = str(operand)
+        else:
+            argument = ''
+        lines.append('{pc:>6} {opcode:<16} {argument}'.format(
+            pc = pc, opcode = OPCODE_NAMES[opcode],
+            argument = argument).rstrip())
+    for function in functions:
+        disassemble(function, lines)
+    return lines
+
+###########################################################
+# StackVM
+###########################################################
+class Frame:
+    '''
+    Saved state of a calling function: its code, the program counter to
+    go on at and its symbol table.
+    '''
+    def __init__(self, code, pc, symbols):
+        self.code = code
+        self.pc = pc
+        self.symbols = symbols
+
+class StackVM(Interpreter):
+    '''
+    Runs Code on a value stack shared by all frames, in one dispatch loop
+    without Python recursion: a call saves the Frame of the caller and
+    switches to the code of the function, a return switches back.
+    '''
+    def __init__(self, charStream = None):
+        Interpreter.__init__(self, charStream)
+        self.compiler = BytecodeCompiler()
+
+    def compile(self, root):
+        return self.compiler.compile(root)
+
+    def run(self, root):
+        return self.execute(self.compile(root))
+
+    def visit(self, node):
+        # accept() and runStream() run nodes through here
+        return self.run(node)
+
+    def error(self, message, code, pc):
+        raise Exception('{position}{message}'.format(
+            position = describePosition(self.charStream,
+                                        code.positions[pc // 2]),
+            message = message))
+
+    def execute(self, code):
+        '''
+        Run Code on the global memory.
+        '''
+        globalSymbols = symbols = self.globalSpace.symval
+        callStack = self.callStack
+        frames = []
+        stack = []
+        push, pop = stack.append, stack.pop
+        instructions, constants, names = (code.instructions, code.constants,
+                                          code.names)
+        pc = 0
+        while True:
+            opcode = instructions[pc]
+            operand = instructions[pc + 1]
+            pc += 2
+            if opcode == LOAD_NAME:
+                name = names[operand]
+                value = symbols.get(name)
+                if value is None:
+                    value = globalSymbols.get(name)
+                    if value is None:
+                        self.error(' : Undefined symbol \'{name}\'!'.format(
+                            name = name), code, pc - 2)
+                push(value)
+            elif opcode == LOAD_CONST:
+                push(constants[operand])
+            elif opcode == STORE_NAME:
+                name = names[operand]
+                value = pop()
+                # a global of the name is updated, unless it is shadowed
+                if (symbols.get(name) is None and
+                    globalSymbols.get(name) is not None):
+                    globalSymbols[name] = value
+                symbols[name] = value
+            elif opcode == BINARY_ADD:
+                rhs = pop()
+                stack[-1] = stack[-1] + rhs
+            elif opcode == BINARY_SUBTRACT:
+                rhs = pop()
+                stack[-1] = stack[-1] - rhs
+            elif opcode == BINARY_MULTIPLY:
+                rhs = pop()
+                stack[-1] = stack[-1] * rhs
+            elif opcode == BINARY_DIVIDE:
+                rhs = pop()
+                stack[-1] = stack[-1] / rhs
+            elif opcode == UNARY_NEGATIVE:
+                stack[-1] = -stack[-1]
+            elif opcode == CALL:
+                start = len(stack) - operand
+                function = stack[start - 1]
+                if len(function.parameters) != operand:
+                    self.error(': Arguments mismatch!', code, pc - 2)
+                funcspace = MemorySpace(function.name)
+                funcsymbols = funcspace.symval
+                funcsymbols['ans'] = None # return value
+                for parameter, value in zip(function.parameters,
+                                            stack[start:]):
+                    funcsymbols[parameter] = value
+                del stack[start - 1:]
+                callStack.append(funcspace)
+                frames.append(Frame(code, pc, symbols))
+                code, symbols, pc = function, funcsymbols, 0
+                instructions, constants, names = (
+                    code.instructions, code.constants, code.names)
+            elif opcode == STORE_ANS:
+                symbols['ans'] = pop()
+            elif opcode == RETURN:
+                if not frames:
+                    return None
+                value = symbols['ans']
+                callStack.pop()
+                frame = frames.pop()
+                code, symbols, pc = frame.code, frame.symbols, frame.pc
+                instructions, constants, names = (
+                    code.instructions, code.constants, code.names)
+                push(value)
+
+###########################################################
+# Top-level script tests
+###########################################################
+if __name__ == '__main__':
+    texts = ENGINE_TEST_TEXTS
+    for engine, result in compareWithInterpreter(StackVM, texts):
+        print(result)
+    root = Parser(Scanner(CharStream(texts[0]))).statements()
+    print('\n'.join(disassemble(BytecodeCompiler().compile(root))))
@@ -0,0 +1,233 @@
+###########################################################
+# Streaming Scanner -- tokens from source arriving in chunks
+###########################################################
+
+import codecs, os
+from collections import deque
+from parser import *
+
+# Tokens that may still grow when more input arrives
+OPEN_TOKEN_TYPES = (INTEGER, IDENTIFIER, FUNCTION, END, RETURN)
+
+###########################################################
+# StreamScanner -- push-based scanner
+###########################################################
+class StreamScanner:
+    '''
+    Scanner fed with chunks of bytes or text. Only the not yet tokenized
+    tail of the input is kept, which is at most one chunk plus a token split
+    across the chunk boundary.
+    '''
+    def __init__(self, encoding = 'ascii'):
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.window = ''  # received text that is not tokenized yet
+        self.offset = 0   # source position of window[0]
+        self.closed = False
+        self.lineIndex = LineIndex() # the window is dropped, lines are not
+
+    def error(self, position):
+        raise Exception('{position} : Invalid character \'{char}\'!'.format(
+            position = describePosition(self, self.offset + position),
+            char = self.window[position]))
+
+    def lineColumn(self, position):
+        return self.lineIndex.lineColumn(position)
+
+    def decode(self, chunk, final = False):
+        # bytes are decoded incrementally (on Python 2 str is bytes and is
+        # used as it is), so a character split across chunks is kept back
+        if isinstance(chunk, bytes) and not isinstance(chunk, str):
+            return self.decoder.decode(chunk, final)
+        return chunk
+
+    def feed(self, chunk):
+        '''
+        Add a chunk of input and return the list of tokens it completed.
+        '''
+        if self.closed:
+            raise Exception('Can not feed a closed scanner!')
+        self.append(self.decode(chunk))
+        return self.scan()
+
+    def close(self):
+        '''
+        Mark the end of input and return the remaining tokens, EOF last.
+        '''
+        self.append(self.decode(b'', True))
+        self.closed = True
+        return self.scan()
+
+    def append(self, text):
+        self.lineIndex.add(text, self.offset + len(self.window))
+        self.window += text
+
+    def scan(self):
+        tokens = []
+        window = self.window
+        position = 0
+        while True:
+            match = TOKEN_PATTERN.match(window, position)
+            if match is None:
+                self.error(WHITESPACE_PATTERN.match(window, position).end())
+
+            type = TOKEN_TYPES[match.lastgroup]
+            if type == EOF:
+                position = match.end()
+                if self.closed:
+                    # the last position of the source, as in CharStream
+                    tokens.append(Token(EOF, None, self.offset + position - 1))
+                break
+            if (match.end() == len(window) and not self.closed and
+                type in OPEN_TOKEN_TYPES):
+                position = match.start(type) # wait for the rest of the token
+                break
+
+            tokens.append(Token(type, match.group(type),
+                                self.offset + match.start(type)))
+            position = match.end()
+
+        self.window = window[position:]
+        self.offset += position
+        return tokens
+
+###########################################################
+# FileScanner -- pull-based scanner over a file or a pipe
+###########################################################
+class StreamPosition:
+    '''
+    Stands in for the CharStream of a Scanner: the parser only asks it for
+    the position after the current token and for line numbers.
+    '''
+    def __init__(self, streamScanner):
+        self.streamScanner = streamScanner
+        self.position = -1
+
+    def lineColumn(self, position):
+        return self.streamScanner.lineColumn(position)
+
+def availableReader(file):
+    '''
+    Return a function reading at most the given number of bytes of a file,
+    only waiting while nothing is available: what a pipe or a socket has
+    received is returned at once, not when a whole chunk has arrived.
+    '''
+    if hasattr(file, 'read1'):
+        return file.read1
+    if hasattr(getattr(file, 'buffer', None), 'read1'):
+        return file.buffer.read1 # a text file of Python 3, e.g. sys.stdin
+    try:
+        fileno = file.fileno()
+    except (AttributeError, EnvironmentError, ValueError):
+        return file.read # e.g. a StringIO, everything is there anyway
+    # a file of Python 2, unread so far: its buffer is bypassed
+    return lambda size: os.read(fileno, size)
+
+class FileScanner:
+    '''
+    Scanner interface (currentToken, nextToken) over a file object that is
+    read chunk by chunk while the parser asks for tokens.
+    '''
+    def __init__(self, file, chunkSize = 65536, encoding = 'ascii'):
+        self.read = availableReader(file)
+        self.chunkSize = chunkSize
+        self.streamScanner = StreamScanner(encoding)
+        self.tokens = deque()  # scanned tokens not consumed yet
+        self.received = 0      # number of source characters seen so far
+        self.charStream = StreamPosition(self.streamScanner)
+        self.nextToken()
+
+    def fill(self):
+        scanner = self.streamScanner
+        chunk = self.read(self.chunkSize)
+        if chunk:
+            tokens = scanner.feed(chunk)
+        else:
+            tokens = scanner.close()
+        self.tokens.extend(tokens)
+        self.received = scanner.offset + len(scanner.window)
+
+    def nextToken(self):
+        '''
+        Consume the current token and return the next token.
+        '''
+        # Make sure it is known whether anything follows the next token, the
+        # position after it depends on that.
+        while (not self.streamScanner.closed and
+        (not self.tokens or self.tokens[0].position + len(self.tokens[0].text)
+         >= self.received)):
+            self.fill()
+
+        token = self.tokens[0]
+        if token.type == EOF: # EOF stays the current token for good
+            self.charStream.position = token.position
+        else:
+            self.tokens.popleft()
+            self.charStream.position = min(token.position + len(token.text),
+                                           self.received - 1)
+        self.currentToken = token
+        self.currentType = token.type
+
+###########################################################
+# Top-level script tests
+###########################################################
+import sys, threading, time
+if __name__ == '__main__':
+    '''
+    Pipe a script in, for example:
+    python streaming.py < script.txt
+    '''
+    # the tokens of a slow producer are there before it closes the pipe
+    readEnd, writeEnd = os.pipe()
+    scanned = threading.Event()
+    def produce():
+        os.write(writeEnd, b'a = 1\nb = a\n')
+        produce.waited = scanned.wait(10)
+        os.write(writeEnd, b'c = 2\n')
+        os.close(writeEnd)
+    producer = threading.Thread(target = produce)
+    producer.start()
+    with os.fdopen(readEnd, 'rb') as file:
+        scanner = FileScanner(file)
+        texts = []
+        while scanner.currentToken.type != EOF:
+            texts.append(scanner.currentToken.text)
+            if len(texts) == 6: # 'a', the last token written first
+                scanned.set()
+            scanner.nextToken()
+    producer.join()
+    assert produce.waited, 'tokens waited for the end of the input'
+    assert texts == ['a', '=', '1', 'b', '=', 'a', 'c', '=', '2'], texts
+
+    # Interpreter.runStream() runs a piped statement before the producer
+    # closes the pipe
+    from interpreter import Interpreter
+    interpreter = Interpreter()
+    readEnd, writeEnd = os.pipe()
+    def produce():
+        # 'a = 1' is complete once the parser has seen the 'b' after it
+        os.write(writeEnd, b'a = 1\nb = 2\n')
+        deadline = time.time() + 10
+        while (interpreter.globalSpace.retrieve('a') is None and
+               time.time() < deadline):
+            time.sleep(0.01)
+        produce.ran = interpreter.globalSpace.retrieve('a') == 1
+        os.write(writeEnd, b'c = 3\n')
+        os.close(writeEnd)
+    producer = threading.Thread(target = produce)
+    producer.start()
+    with os.fdopen(readEnd, 'rb') as file:
+        scanner = FileScanner(file)
+        interpreter.charStream = scanner.charStream
+        interpreter.runStream(Parser(scanner).statementStream())
+    producer.join()
+    assert produce.ran, 'statements waited for the end of the input'
+    assert interpreter.globalSpace.retrieve('c') == 3
+
+    if sys.stdin.isatty():
+        sys.exit(0)
+    scanner = FileScanner(sys.stdin)
+    while True:
+        print(scanner.currentToken)
+        if scanner.currentToken.type == EOF:
+            break
+        scanner.nextToken()
@@ -0,0 +1,484 @@
+###########################################################
+# Table-driven LL(1) Parser generated from the EBNF syntax
+###########################################################
+
+import re
+from collections import deque
+from parser import *
+
+# Copy of the Syntax section of README.md, transcribed by hand: the module
+# does not read README.md, the self-test checks that both still agree
+GRAMMAR = '''
+    statements ::= assignment * returnstmt ?
+    returnstmt ::= 'return' expression
+    assignment ::= identifier '=' expression | 'function' identifier definition
+    expression ::= term (('+'|'-') term)* | function
+    arguments ::= (expression(',' expression)*)?
+    function ::= 'function' definition
+    definition ::= '(' parameters ')' statements 'end'
+    parameters ::= (identifier(',' identifier)*) ?
+    term ::= factor (('*'|'/') factor)*
+    factor ::= integer | ('+'|'-') factor | prefixexp
+    prefixexp ::= (identifier | '(' expression ')') ('(' arguments ')')*
+    integer ::= digit +
+    identifier ::= letter (letter | digit) *
+'''
+
+# Grammar symbols the scanner turns into tokens
+TERMINALS = {
+    "'+'": PLUS, "'-'": MINUS, "'*'": MUL, "'/'": DIV,
+    "'('": LPAREN, "')'": RPAREN, "'='": ASSIGN, "','": COMMA,
+    "'function'": FUNCTION, "'end'": END, "'return'": RETURN,
+    'integer': INTEGER, 'identifier': IDENTIFIER,
+    }
+
+###########################################################
+# EBNF Reader
+# An EBNF expression is read into nested tuples:
+# ('alt', [sequences]), ('seq', [items]), ('star', item), ('plus', item),
+# ('opt', item), ('terminal', type) or ('nonterminal', name).
+###########################################################
+EBNF_TOKEN_PATTERN = re.compile(r"\s*('[^']*'|[A-Za-z]+|[|()*+?])")
+
+def readRules(ebnf):
+    '''
+    Return the list of (name, expression) of the rules of an EBNF text, in
+    order. Rules defining terminals (identifier, integer) are left out.
+    '''
+    rules = []
+    for line in ebnf.splitlines():
+        if '::=' not in line:
+            continue
+        name, body = line.split('::=', 1)
+        name = name.strip()
+        if name in TERMINALS:
+            continue
+        tokens = EBNF_TOKEN_PATTERN.findall(body)
+        expression, position = readAlternatives(tokens, 0)
+        if position != len(tokens):
+            raise Exception('Unexpected \'{token}\' in rule \'{name}\'!'.format(
+                token = tokens[position], name = name))
+        rules.append((name, expression))
+    return rules
+
+def readAlternatives(tokens, position):
+    sequences = []
+    while True:
+        sequence, position = readSequence(tokens, position)
+        sequences.append(sequence)
+        if position < len(tokens) and tokens[position] == '|':
+            position += 1
+        else:
+            return ('alt', sequences), position
+
+def readSequence(tokens, position):
+    items = []
+    while position < len(tokens) and tokens[position] not in '|)':
+        token = tokens[position]
+        if token == '(':
+            item, position = readAlternatives(tokens, position + 1)
+            if position >= len(tokens) or tokens[position] != ')':
+                raise Exception('Missing \')\' in the grammar!')
+            if len(item[1]) == 1: # a group without alternatives
+                item = item[1][0]
+        elif token in TERMINALS:
+            item = ('terminal', TERMINALS[token])
+        elif token.startswith("'"):
+            raise Exception('Unknown terminal {token}!'.format(token = token))
+        else:
+            item = ('nonterminal', token)
+        position += 1
+        while position < len(tokens) and tokens[position] in ('*', '+', '?'):
+            item = ({'*': 'star', '+': 'plus', '?': 'opt'}[tokens[position]],
+                    item)
+            position += 1
+        items.append(item)
+    return ('seq', items), position
+
+###########################################################
+# Grammar -- BNF productions with FIRST/FOLLOW sets and the
+# LL(1) parse table
+###########################################################
+EPSILON = None # stands for the empty string in FIRST sets
+
+def groupValue(values):
+    '''
+    Value of an anonymous sequence: its only value or a tuple of them.
+    '''
+    if len(values) == 1:
+        return values[0]
+    return tuple(values)
+
+class Production:
+    def __init__(self, lhs, rhs, action):
+        self.lhs = lhs        # nonterminal name
+        self.rhs = rhs        # list of terminal types and nonterminal names
+        self.action = action  # builds the value of lhs from those of rhs
+
+    def __str__(self):
+        return '{lhs} ::= {rhs}'.format(
+            lhs = self.lhs,
+            rhs = ' '.join(self.rhs) if self.rhs else '<empty>')
+
+class Grammar:
+    '''
+    Turns EBNF rules into BNF productions and computes the FIRST and FOLLOW
+    sets and the LL(1) parse table. actions maps every rule name to a
+    function of the number of the alternative taken and the list of the
+    values of its items; a repeated item has a deque of values, an optional
+    one its value or None and a parenthesized one the value of its only
+    item or a tuple of its items' values.
+    '''
+    def __init__(self, ebnf, actions, start = 'statements'):
+        self.productions = []
+        self.nonterminals = []  # names, helper nonterminals included
+        self.terminals = set()
+        self.start = start
+        self.helpers = 0
+        for name, expression in readRules(ebnf):
+            self.addRule(name, expression, actions[name])
+        self.computeFirst()
+        self.computeFollow()
+        self.computeTable()
+
+    def addRule(self, name, expression, action):
+        self.nonterminals.append(name)
+        for alternative, sequence in enumerate(expression[1]):
+            self.productions.append(Production(
+                name, self.symbols(name, sequence[1]),
+                lambda values, alternative = alternative:
+                    action(alternative, values)))
+
+    def symbols(self, name, items):
+        return [self.symbol(name, item) for item in items]
+
+    def helper(self, name):
+        self.helpers += 1
+        helper = '{name}_{number}'.format(name = name, number = self.helpers)
+        self.nonterminals.append(helper)
+        return helper
+
+    def add(self, lhs, rhs, action):
+        self.productions.append(Production(lhs, rhs, action))
+
+    def symbol(self, name, item):
+        '''
+        Return the grammar symbol for an EBNF item, adding productions for
+        helper nonterminals of the parts of rule name.
+        '''
+        kind = item[0]
+        if kind == 'terminal':
+            self.terminals.add(item[1])
+            return item[1]
+        elif kind == 'nonterminal':
+            return item[1]
+
+        helper = self.helper(name)
+        if kind == 'star' or kind == 'plus':
+            # helper ::= item helper | <empty>, the values are prepended
+            sequence = self.items(item[1])
+            repeated = helper if kind == 'star' else self.helper(name)
+            def prepend(values):
+                rest = values[-1]
+                rest.appendleft(groupValue(values[:-1]))
+                return rest
+            self.add(repeated, self.symbols(name, sequence) + [repeated],
+                     prepend)
+            self.add(repeated, [], lambda values: deque())
+            if kind == 'plus':
+                self.add(helper, self.symbols(name, sequence) + [repeated],
+                         prepend)
+        elif kind == 'opt':
+            self.add(helper, self.symbols(name, self.items(item[1])),
+                     groupValue)
+            self.add(helper, [], lambda values: None)
+        elif kind == 'seq':
+            self.add(helper, self.symbols(name, item[1]), groupValue)
+        elif kind == 'alt':
+            for sequence in item[1]:
+                self.add(helper, self.symbols(name, sequence[1]), groupValue)
+        return helper
+
+    def items(self, item):
+        if item[0] == 'seq':
+            return item[1]
+        return [item]
+
+    def firstOfSymbols(self, symbols):
+        '''
+        Return the FIRST set of a string of grammar symbols.
+        '''
+        first = set()
+        for symbol in symbols:
+            if symbol in self.terminals:
+                first.add(symbol)
+                return first
+            first |= self.first[symbol] - set([EPSILON])
+            if EPSILON not in self.first[symbol]:
+                return first
+        first.add(EPSILON)
+        return first
+
+    def computeFirst(self):
+        self.first = dict((name, set()) for name in self.nonterminals)
+        changed = True
+        while changed:
+            changed = False
+            for production in self.productions:
+                first = self.firstOfSymbols(production.rhs)
+                if not first <= self.first[production.lhs]:
+                    self.first[production.lhs] |= first
+                    changed = True
+
+    def computeFollow(self):
+        self.follow = dict((name, set()) for name in self.nonterminals)
+        self.follow[self.start].add(EOF)
+        changed = True
+        while changed:
+            changed = False
+            for production in self.productions:
+                for index, symbol in enumerate(production.rhs):
+                    if symbol in self.terminals:
+                        continue
+                    follow = self.firstOfSymbols(production.rhs[index + 1:])
+                    if EPSILON in follow:
+                        follow.discard(EPSILON)
+                        follow |= self.follow[production.lhs]
+                    if not follow <= self.follow[symbol]:
+                        self.follow[symbol] |= follow
+                        changed = True
+
+    def computeTable(self):
+        '''
+        Fill table[nonterminal][terminal] with the production to expand;
+        raise an exception if the grammar is not LL(1).
+        '''
+        self.table = dict((name, {}) for name in self.nonterminals)
+        for index, production in enumerate(self.productions):
+            lookaheads = self.firstOfSymbols(production.rhs)
+            if EPSILON in lookaheads:
+                lookaheads.discard(EPSILON)
+                lookaheads |= self.follow[production.lhs]
+            row = self.table[production.lhs]
+            for terminal in lookaheads:
+                if terminal in row:
+                    raise Exception('Grammar is not LL(1), {terminal} selects '
+                                    'both {first} and {second}!'.format(
+                        terminal = terminal,
+                        first = self.productions[row[terminal]],
+                        second = production))
+                row[terminal] = index
+
+###########################################################
+# AST Actions -- build the nodes of ast.py from rule values
+###########################################################
+def statementsAction(alternative, values):
+    assignments, returnstmt = values
+    root = StatementListNode(PhonyToken(STATEMENTS, 0))
+    for assignment in assignments:
+        root.addChild(assignment)
+    if returnstmt is not None:
+        root.addChild(returnstmt)
+    return root
+
+def returnstmtAction(alternative, values):
+    token, expression = values
+    root = ReturnStatementNode(token)
+    root.addChild(expression)
+    return root
+
+def assignmentAction(alternative, values):
+    if alternative == 0:
+        target, token, expression = values
+    else:
+        function, target, (expression, lparen) = values
+        # phony assign token, at the position after '(' as in Parser
+        token = Token(ASSIGN, '=', lparen.position + 1)
+    root = BinaryExpressionNode(token)
+    root.addChild(IdentifierNode(target))
+    root.addChild(expression)
+    return root
+
+def binaryAction(alternative, values):
+    if alternative == 1: # function, the definition and its '('
+        return values[0][0]
+    root, operations = values
+    for token, operand in operations: # left associative
+        lhs = root
+        root = BinaryExpressionNode(token)
+        root.addChild(lhs)
+        root.addChild(operand)
+    return root
+
+def listAction(nodeClass, type, item):
+    '''
+    Return the action of a comma separated list rule, building a node of
+    nodeClass from the nodes item() makes of the values.
+    '''
+    def action(alternative, values):
+        root = nodeClass(PhonyToken(type, 0))
+        if values[0] is not None:
+            first, rest = values[0]
+            root.addChild(item(first))
+            for comma, other in rest:
+                root.addChild(item(other))
+        return root
+    return action
+
+def factorAction(alternative, values):
+    if alternative == 0:
+        return IntegerNode(values[0])
+    elif alternative == 1:
+        root = UnaryExpressionNode(values[0])
+        root.addChild(values[1])
+        return root
+    return values[0]
+
+def prefixexpAction(alternative, values):
+    head, calls = values
+    if isinstance(head, tuple): # '(' expression ')'
+        root = head[1]
+    else:
+        root = IdentifierNode(head)
+    for lparen, arguments, rparen in calls:
+        prefix = root
+        root = FunctionCallNode(PhonyToken(CALL, 0))
+        root.addChild(prefix)
+        root.addChild(arguments)
+    return root
+
+def definitionAction(alternative, values):
+    lparen, parameters, rparen, statements, end = values
+    root = FunctionDefinitionNode(PhonyToken(DEFINE, 0))
+    root.addChild(parameters)
+    root.addChild(statements)
+    return root, lparen # the position of '(' makes the phony assign token
+
+ACTIONS = {
+    'statements': statementsAction,
+    'returnstmt': returnstmtAction,
+    'assignment': assignmentAction,
+    'expression': binaryAction,
+    'term': binaryAction,
+    'arguments': listAction(FunctionArgumentsNode, ARGUMENTS,
+                            lambda expression: expression),
+    'parameters': listAction(FunctionParametersNode, PARAMETERS,
+                             IdentifierNode),
+    'function': lambda alternative, values: values[1],
+    'definition': definitionAction,
+    'factor': factorAction,
+    'prefixexp': prefixexpAction,
+    }
+
+###########################################################
+# TableParser -- LL(1) driver loop
+###########################################################
+class ParseTable:
+    '''
+    The parse table of a Grammar in the form the driver loop wants it:
+    nonterminals are numbered, terminals are token types and the symbols a
+    production pushes, last symbol first, are precomputed. A production
+    pushes a reduce marker, the complement ~index of its number, below its
+    symbols; popping the marker applies the production's action.
+    '''
+    def __init__(self, grammar):
+        numbers = dict((name, number)
+                       for number, name in enumerate(grammar.nonterminals))
+        self.start = numbers[grammar.start]
+        self.rows = [dict(grammar.table[name]) for name in grammar.nonterminals]
+        self.pushes = []
+        self.lengths = []
+        self.actions = []
+        for index, production in enumerate(grammar.productions):
+            symbols = [numbers.get(symbol, symbol) for symbol in production.rhs]
+            self.pushes.append(tuple([~index] + symbols[::-1]))
+            self.lengths.append(len(symbols))
+            self.actions.append(production.action)
+
+class TableParser(Parser):
+    '''
+    Parser whose procedures are replaced by the LL(1) parse table of the
+    syntax and a loop over an explicit stack. It accepts exactly the EBNF
+    syntax: unlike Parser, arguments and parameters must be separated by
+    commas and no tokens may follow the statements.
+    '''
+    def __init__(self, scanner, table = None):
+        Parser.__init__(self, scanner)
+        self.table = table if table is not None else PARSE_TABLE
+
+    def statements(self):
+        table = self.table
+        rows, pushes, lengths, actions = (
+            table.rows, table.pushes, table.lengths, table.actions)
+        scanner = self.scanner
+        token = scanner.currentToken
+        stack = [table.start]
+        values = []
+        pop, extend, push = stack.pop, stack.extend, values.append
+
+        while stack:
+            symbol = pop()
+            if symbol.__class__ is str:   # terminal
+                if token.type != symbol:
+                    self.error()
+                push(token)
+                scanner.nextToken()
+                token = scanner.currentToken
+            elif symbol >= 0:             # nonterminal
+                production = rows[symbol].get(token.type)
+                if production is None:
+                    self.error()
+                extend(pushes[production])
+            else:                         # reduce marker
+                production = ~symbol
+                start = len(values) - lengths[production]
+                value = actions[production](values[start:])
+                del values[start:]
+                push(value)
+
+        if token.type != EOF:
+            self.error()
+        return values[0]
+
+GRAMMAR_TABLES = Grammar(GRAMMAR, ACTIONS)
+PARSE_TABLE = ParseTable(GRAMMAR_TABLES)
+
+###########################################################
+# Top-level script tests
+###########################################################
+import os
+def readmeSyntax(path):
+    '''
+    Return the indented lines of the Syntax section of README.md.
+    '''
+    lines = []
+    with open(path) as file:
+        section = False
+        for line in file:
+            if line.startswith('#'):
+                section = line.strip() == '## Syntax'
+            elif section and line.startswith('    '):
+                lines.append(line)
+    return ''.join(lines)
+
+if __name__ == '__main__':
+    readme = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          os.pardir, os.pardir, 'README.md')
+    assert readRules(readmeSyntax(readme)) == readRules(GRAMMAR), \
+        'GRAMMAR differs from the syntax of README.md'
+
+    grammar = GRAMMAR_TABLES
+    for name in grammar.nonterminals:
+        print('{name}: FIRST {first}, FOLLOW {follow}'.format(
+            name = name,
+            first = sorted('<empty>' if terminal is EPSILON else terminal
+                           for terminal in grammar.first[name]),
+            follow = sorted(grammar.follow[name])))
+    for index, production in enumerate(grammar.productions):
+        print('{index:3}: {production}'.format(index = index,
+                                              production = production))
+
+    text = 'f = function(x, y) return x+y end\nfunction g(z) return -z end\n' \
+           'a = f(3, 4) * (2 - g(1))\nreturn a\n'
+    root = TableParser(Scanner(CharStream(text))).statements()
+    root.accept(PrintVisitor())
@@ -0,0 +1,194 @@
+###########################################################
+# TokenBuffer -- struct-of-arrays storage of a token stream
+###########################################################
+
+from array import array
+from parser import *
+
+# Token types by their one-byte code
+TOKEN_CODES = (
+    INTEGER, PLUS, MINUS, MUL, DIV, LPAREN, RPAREN, IDENTIFIER, ASSIGN, EOF,
+    COMMA, FUNCTION, END, RETURN)
+CODE_OF_TYPE = dict((type, code) for code, type in enumerate(TOKEN_CODES))
+
+# 64-bit positions; Python 2 arrays have no 'q', there 'l' is 64 bits wide
+try:
+    array('q')
+    POSITION_TYPECODE = 'q'
+except ValueError:
+    POSITION_TYPECODE = 'l'
+
+class TokenBuffer:
+    '''
+    Tokens kept as parallel typed arrays (type code, start, length, lexeme
+    index) plus a table of interned lexemes, instead of one Token object per
+    token. EOF is not stored, its position is kept in eofPosition.
+    '''
+    def __init__(self):
+        self.types = array('B')                 # token type codes
+        self.starts = array(POSITION_TYPECODE)  # positions of the tokens
+        self.lengths = array('I')               # lengths of the tokens
+        self.lexemes = array('I')               # indexes into lexemeTable
+        self.lexemeTable = []                   # interned lexemes
+        self.lexemeIndex = {}                   # lexeme -> its index
+        self.eofPosition = -1
+        self.source = None     # scanned text, for line numbers only
+        self.lineIndex = None  # built on the first lineColumn() call
+
+    def __len__(self):
+        return len(self.types)
+
+    def intern(self, lexeme):
+        '''
+        Return the index of the lexeme in the lexeme table.
+        '''
+        index = self.lexemeIndex.get(lexeme)
+        if index is None:
+            index = self.lexemeIndex[lexeme] = len(self.lexemeTable)
+            self.lexemeTable.append(lexeme)
+        return index
+
+    def append(self, type, text, position):
+        self.types.append(CODE_OF_TYPE[type])
+        self.starts.append(position)
+        self.lengths.append(len(text))
+        self.lexemes.append(self.intern(text))
+
+    def token(self, index):
+        '''
+        Build the Token at the index; the index past the last token is EOF.
+        '''
+        if index >= len(self.types):
+            return Token(EOF, None, self.eofPosition)
+        return Token(TOKEN_CODES[self.types[index]],
+                     self.lexemeTable[self.lexemes[index]],
+                     self.starts[index])
+
+    def tokenType(self, index):
+        '''
+        Return the type of the token at the index, EOF past the last token.
+        '''
+        if index >= len(self.types):
+            return EOF
+        return TOKEN_CODES[self.types[index]]
+
+    def lineColumn(self, position):
+        '''
+        Return the line and the column (both counted from 1) of a position.
+        '''
+        if self.lineIndex is None:
+            self.lineIndex = LineIndex(self.source or '')
+        return self.lineIndex.lineColumn(position)
+
+    def nbytes(self):
+        '''
+        Return the number of bytes held by the arrays.
+        '''
+        return sum(column.buffer_info()[1] * column.itemsize for column in
+                   (self.types, self.starts, self.lengths, self.lexemes))
+
+def tokenize(text, buffer = None):
+    '''
+    Scan the whole text into a TokenBuffer.
+    '''
+    if buffer is None:
+        buffer = TokenBuffer()
+    buffer.source = text
+    appendType = buffer.types.append
+    appendStart = buffer.starts.append
+    appendLength = buffer.lengths.append
+    appendLexeme = buffer.lexemes.append
+    intern = buffer.intern
+    match = TOKEN_PATTERN.match
+
+    position = 0
+    while True:
+        found = match(text, position)
+        if found is None:
+            position = WHITESPACE_PATTERN.match(text, position).end()
+            raise Exception('{position} : Invalid character \'{char}\'!'.format(
+                position = describePosition(buffer, position),
+                char = text[position]))
+        type = found.lastgroup
+        if type == EOF:
+            break
+        start, position = found.span(type)
+        appendType(CODE_OF_TYPE[type])
+        appendStart(start)
+        appendLength(position - start)
+        appendLexeme(intern(text[start:position]))
+
+    buffer.eofPosition = len(text) - 1 # the last position, as in CharStream
+    return buffer
+
+###########################################################
+# TokenCursor -- scanner interface over a TokenBuffer
+###########################################################
+class TokenCursor(object):
+    '''
+    Feeds a TokenBuffer to the Parser. The parser decides on currentType,
+    read from the type array; a Token object is only built when it asks
+    for currentToken, for a token a node keeps or for an error message.
+    '''
+    def __init__(self, buffer, index = 0):
+        self.buffer = buffer
+        self.index = index   # index of the current token
+        self.currentType = buffer.tokenType(index)
+        self.token = None    # current Token, built on demand
+        self.charStream = self # the parser asks 'charStream.position'
+
+    @property
+    def currentToken(self):
+        if self.token is None:
+            self.token = self.buffer.token(self.index)
+        return self.token
+
+    @property
+    def position(self):
+        '''
+        Position after the current token, as CharStream.position would be.
+        '''
+        buffer = self.buffer
+        if self.index >= len(buffer):
+            return buffer.eofPosition
+        return min(buffer.starts[self.index] + buffer.lengths[self.index],
+                   buffer.eofPosition)
+
+    def lineColumn(self, position):
+        return self.buffer.lineColumn(position)
+
+    def nextToken(self):
+        '''
+        Consume the current token and move to the next token.
+        '''
+        if self.index < len(self.buffer):
+            self.index += 1
+            self.currentType = self.buffer.tokenType(self.index)
+            self.token = None
+
+###########################################################
+# Top-level script tests
+###########################################################
+from ast import PrintVisitor
+import sys
+if __name__ == '__main__':
+    text = 'f = function(x, y) return x+y end\na = f(3, 4)\nb = f(a, a)\n'
+    buffer = tokenize(text)
+    print('{count} tokens in {nbytes} bytes, lexemes: {lexemes}'.format(
+        count = len(buffer),
+        nbytes = buffer.nbytes(),
+        lexemes = buffer.lexemeTable))
+    root = Parser(TokenCursor(buffer)).statements()
+    root.accept(PrintVisitor())
+
+    # Tokens are only built for the 18 tokens the nodes keep, not for '(',
+    # ')', ',', 'function', 'end' or EOF
+    class CountingCursor(TokenCursor):
+        built = 0
+        @property
+        def currentToken(self):
+            if self.token is None:
+                CountingCursor.built += 1
+            return TokenCursor.currentToken.fget(self)
+    Parser(CountingCursor(buffer)).statements()
+    assert CountingCursor.built == 18, CountingCursor.built
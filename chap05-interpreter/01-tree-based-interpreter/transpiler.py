@@ -0,0 +1,304 @@
+###########################################################
+# Transpiler -- scripts turned into Python source and run by CPython
+###########################################################
+
+import linecache, sys
+from collections import OrderedDict
+from interpreter import *
+from parsecache import sourceKey
+
+# File name of the generated code in code objects and tracebacks, one for
+# every generated source so that linecache keeps the lines of each
+SOURCE_FILENAME = '<transpiled script {key}>'
+
+class PythonTranspiler(AbstractNodeVisitor):
+    '''
+    Generates Python source from a tree. Every function definition becomes
+    a module-level def, local symbols become Python locals (l_<name>) and
+    the global symbols stay in the global memory G, a dict. Expressions
+    become Python expressions, statements lines, and every line is mapped
+    to the token position of its statement.
+
+    The symbol rules of Interpreter are kept: None is undefined, a local
+    is looked up before the global of the same name, and an assignment in
+    a function updates a global of the name unless a local shadows it.
+    '''
+    def transpile(self, root):
+        '''
+        Return the source of a tree (a StatementListNode or one statement)
+        and the token positions of its lines (line 1 first).
+        '''
+        self.definitions = [] # [(text, position)] of the defs
+        self.lines = []       # [(text, position)] being generated
+        self.locals = None    # local names of the function being generated
+        self.position = 0     # of the statement being generated
+        self.visit(root)
+        lines = self.definitions + self.lines
+        return ('\n'.join(text for text, position in lines) + '\n',
+                [position for text, position in lines])
+
+    def emit(self, text):
+        self.lines.append((text, self.position))
+
+    def visitBinaryExpressionNode(self, node):
+        if node.token.type == ASSIGN:
+            target = node.children[0].token
+            self.position = target.position
+            value = self.visit(node.children[1])
+            if self.locals is None:
+                self.emit('G[{name!r}] = {value}'.format(
+                    name = target.text, value = value))
+            else:
+                local = 'l_' + target.text
+                self.emit('_value = {value}'.format(value = value))
+                self.emit('if {local} is None and G.get({name!r}) is not None:'
+                          ' G[{name!r}] = _value'.format(
+                              local = local, name = target.text))
+                self.emit('{local} = _value'.format(local = local))
+            return None
+        return '({lhs} {operator} {rhs})'.format(
+            lhs = self.visit(node.children[0]),
+            operator = node.token.text,
+            rhs = self.visit(node.children[1]))
+
+    def visitIntegerNode(self, node):
+        return str(int(node.token.text)) # no leading zeros
+
+    def visitUnaryExpressionNode(self, node):
+        operand = self.visit(node.children[0])
+        if node.token.type == MINUS:
+            return '(-{operand})'.format(operand = operand)
+        return operand
+
+    def visitIdentifierNode(self, node):
+        name = node.token.text
+        load = 'load({name!r}, {position})'.format(
+            name = name, position = node.token.position)
+        if self.locals is None or name not in self.locals:
+            return load
+        return '({local} if {local} is not None else {load})'.format(
+            local = 'l_' + name, load = load)
+
+    def visitStatementListNode(self, node):
+        for child in node.children:
+            self.visit(child)
+
+    def visitFunctionArgumentsNode(self, node):
+        pass # generated with the function call
+
+    def visitFunctionParametersNode(self, node):
+        pass # generated with the function definition
+
+    def visitFunctionCallNode(self, node):
+        arguments = node.children[1].children
+        return 'function({function}, {count}, {position})({values})'.format(
+            function = self.visit(node.children[0]),
+            count = len(arguments),
+            position = node.token.position,
+            values = ', '.join(self.visit(child) for child in arguments))
+
+    def visitFunctionDefinitionNode(self, node):
+        parameters = [child.token.text
+                      for child in node.children[0].children]
+        body = node.children[1]
+        saved = self.lines, self.locals, self.position
+        self.lines = []
+        self.locals = set(parameters)
+        self.locals.add('ans')
+        for statement in body.children:
+            if isinstance(statement, BinaryExpressionNode):
+                self.locals.add(statement.children[0].token.text)
+
+        # the symbols of the function space: 'ans', then the parameters
+        # (the last of equal names wins), then the other locals
+        name = '_f{number}'.format(number = len(self.definitions))
+        self.position = node.token.position
+        arguments = ['_p{i}'.format(i = i) for i in range(len(parameters))]
+        self.emit('def {name}({arguments}):'.format(
+            name = name, arguments = ', '.join(arguments)))
+        if 'ans' not in parameters:
+            self.emit('    l_ans = None')
+        for parameter, argument in zip(parameters, arguments):
+            self.emit('    l_{parameter} = {argument}'.format(
+                parameter = parameter, argument = argument))
+        for local in sorted(self.locals - set(parameters) - set(['ans'])):
+            self.emit('    l_{local} = None'.format(local = local))
+        start = len(self.lines)
+        self.visit(body)
+        for i in range(start, len(self.lines)):
+            self.lines[i] = ('    ' + self.lines[i][0], self.lines[i][1])
+        self.position = node.token.position
+        self.emit('    return l_ans')
+        self.emit('{name}.parameterCount = {count}'.format(
+            name = name, count = len(parameters)))
+        self.definitions.extend(self.lines)
+        self.lines, self.locals, self.position = saved
+        return name
+
+    def visitReturnStatementNode(self, node):
+        self.position = node.token.position
+        value = self.visit(node.children[0])
+        if self.locals is None:
+            self.emit('G[\'ans\'] = {value}'.format(value = value))
+        else:
+            self.emit('l_ans = {value}'.format(value = value))
+
+class TranspiledInterpreter(Interpreter):
+    '''
+    Interpreter running a tree as Python: its source is compiled with
+    compile() and executed with the global memory as G. The code objects
+    of the last maxEntries trees run are kept, so running a tree again,
+    e.g. one of a ParseCache, neither transpiles nor compiles it. Trees
+    must not be changed once they have been run.
+    '''
+    def __init__(self, charStream = None, maxEntries = 256):
+        Interpreter.__init__(self, charStream)
+        self.transpiler = PythonTranspiler()
+        # id of a tree -> (the tree, code object, line positions); the
+        # tree is kept so that its id is not reused while it is cached
+        self.codes = OrderedDict()
+        self.linePositions = {} # file name -> line positions
+        self.maxEntries = maxEntries
+        self.hits = self.misses = 0
+
+    def compile(self, root):
+        '''
+        Return the code object of a tree and the token positions of its
+        lines.
+        '''
+        key = id(root)
+        entry = self.codes.pop(key, None)
+        if entry is None:
+            self.misses += 1
+            entry = (root,) + self.translate(root)
+            if len(self.codes) >= self.maxEntries:
+                self.forget(self.codes.popitem(False)[1][1])
+        else:
+            self.hits += 1
+        self.codes[key] = entry
+        return entry[1], entry[2]
+
+    def translate(self, root):
+        '''
+        Return the code object of a new tree and the token positions of its
+        lines.
+        '''
+        source, positions = self.transpiler.transpile(root)
+        filename = SOURCE_FILENAME.format(key = sourceKey(source))
+        # no __future__ flags of this module, '/' divides as in Interpreter
+        code = compile(source, filename, 'exec', 0, True)
+        # shown by tracebacks of the generated code
+        lines = source.splitlines(True)
+        linecache.cache[filename] = (len(source), None, lines, filename)
+        self.linePositions[filename] = positions
+        return code, positions
+
+    def forget(self, code):
+        '''
+        Drop the lines of a code object no longer cached, unless another
+        tree has the same source.
+        '''
+        filename = code.co_filename
+        for root, other, positions in self.codes.values():
+            if other.co_filename == filename:
+                return
+        linecache.cache.pop(filename, None)
+        self.linePositions.pop(filename, None)
+
+    def run(self, root):
+        code, positions = self.compile(root)
+        return self.execute(code, positions)
+
+    def execute(self, code, positions):
+        '''
+        Run the code object of a tree on the global memory.
+        '''
+        try:
+            exec(code, self.namespace())
+        except Exception as error:
+            # an error of the generated code itself, not of load() or
+            # function(), gets the script position of its line, which may
+            # be in a function of an earlier tree
+            traceback = sys.exc_info()[2]
+            while traceback.tb_next is not None:
+                traceback = traceback.tb_next
+            filename = traceback.tb_frame.f_code.co_filename
+            if filename != code.co_filename:
+                positions = self.linePositions.get(filename)
+            if positions is not None:
+                error.args = ('{position} : {message}'.format(
+                    position = describePosition(
+                        self.charStream, positions[traceback.tb_lineno - 1]),
+                    message = error),)
+            raise
+
+    def visit(self, node):
+        # accept() and runStream() run nodes through here
+        return self.run(node)
+
+    def namespace(self):
+        '''
+        Return the module namespace the generated code runs in.
+        '''
+        return {'G': self.globalSpace.symval, 'load': self.load,
+                'function': self.function}
+
+    def load(self, name, position):
+        value = self.globalSpace.symval.get(name)
+        if value is None:
+            raise Exception('{position} : Undefined symbol \'{name}\'!'.format(
+                position = describePosition(self.charStream, position),
+                name = name))
+        return value
+
+    def function(self, function, count, position):
+        '''
+        Return the function value called with count arguments.
+        '''
+        if function.parameterCount != count:
+            raise Exception('{position}: Arguments mismatch!'.format(
+                position = describePosition(self.charStream, position)))
+        return function
+
+###########################################################
+# Top-level script tests
+###########################################################
+import traceback
+if __name__ == '__main__':
+    texts = ENGINE_TEST_TEXTS + [
+        'a = 0\nb = a + 007\nc = - + - b / 2 * 7\n',
+        'function d(if, if) return if end\nv = d(1, 2)\n',
+        ]
+    for engine, result in compareWithInterpreter(TranspiledInterpreter,
+                                                 texts):
+        print(result)
+
+    # errors of Python operations point at the script statement
+    text = 'a = 1\nb = 0\nc = a / b\n'
+    interpreter = TranspiledInterpreter(CharStream(text))
+    root = Parser(Scanner(interpreter.charStream)).statements()
+    print(interpreter.transpiler.transpile(root)[0])
+    try:
+        root.accept(interpreter)
+    except ZeroDivisionError as error:
+        print(error)
+
+    # a tree run again is neither transpiled nor compiled again, and the
+    # lines of every tree stay where tracebacks find them
+    interpreter.transpiler = None
+    try:
+        root.accept(interpreter)
+    except ZeroDivisionError as error:
+        pass
+    assert (interpreter.hits, interpreter.misses) == (1, 1)
+    interpreter = TranspiledInterpreter() # of two sources
+    first = Parser(Scanner(CharStream(
+        'function f(x) y = x / 0 return y end\n'))).statements()
+    second = Parser(Scanner(CharStream('a = 1\nb = f(a)\n'))).statements()
+    first.accept(interpreter)
+    try:
+        second.accept(interpreter)
+    except ZeroDivisionError:
+        frame = traceback.extract_tb(sys.exc_info()[2])[-1]
+        assert frame[3].startswith('_value = ((l_x'), frame # not of second
+        print(sys.exc_info()[1])
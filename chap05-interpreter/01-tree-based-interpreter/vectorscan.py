@@ -0,0 +1,143 @@
+###########################################################
+# Vectorized Scanning -- token boundaries computed by NumPy
+###########################################################
+
+from array import array
+import tokenbuffer
+from tokenbuffer import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None # optional, tokenize() falls back to tokenbuffer.tokenize()
+
+# Character classes
+SPACE, DIGIT, LETTER, OPERATOR, INVALID = range(5)
+
+OPERATOR_TYPES = {
+    '+': PLUS, '-': MINUS, '*': MUL, '/': DIV,
+    '(': LPAREN, ')': RPAREN, '=': ASSIGN, ',': COMMA,
+    }
+KEYWORD_TYPES = {'function': FUNCTION, 'end': END, 'return': RETURN}
+
+if numpy is not None:
+    CLASS_TABLE = numpy.full(256, INVALID, dtype = numpy.uint8)
+    CODE_TABLE = numpy.zeros(256, dtype = numpy.uint8) # codes of operators
+    for char in ' \t\n\r\v\f':
+        CLASS_TABLE[ord(char)] = SPACE
+    for char in '0123456789':
+        CLASS_TABLE[ord(char)] = DIGIT
+    for char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ':
+        CLASS_TABLE[ord(char)] = LETTER
+    for char, type in OPERATOR_TYPES.items():
+        CLASS_TABLE[ord(char)] = OPERATOR
+        CODE_TABLE[ord(char)] = CODE_OF_TYPE[type]
+
+def asciiBytes(text):
+    '''
+    Return the source as a uint8 array, or None if it is not plain ASCII.
+    '''
+    if not isinstance(text, bytes):
+        try:
+            text = text.encode('ascii')
+        except UnicodeError:
+            return None
+    data = numpy.frombuffer(text, dtype = numpy.uint8)
+    if data.size and data.max() >= 128:
+        return None
+    return data
+
+def boundaries(data):
+    '''
+    Classify all characters at once and return the starts, ends and type
+    codes of the tokens (keywords are still typed as identifiers), or None
+    if the source has an invalid character.
+    '''
+    classes = CLASS_TABLE[data]
+    if (classes == INVALID).any():
+        return None
+
+    # runs of letters and digits
+    word = (classes == DIGIT) | (classes == LETTER)
+    edges = numpy.flatnonzero(numpy.diff(
+        numpy.concatenate(([0], word.view(numpy.int8), [0]))))
+    runStarts, runEnds = edges[0::2], edges[1::2]
+
+    # a run starting with a digit is an integer up to its first letter
+    letters = numpy.flatnonzero(classes == LETTER)
+    letters = numpy.append(letters, len(data)) # sentinel
+    firstLetters = letters[numpy.searchsorted(letters, runStarts)]
+    integers = classes[runStarts] == DIGIT
+    integerEnds = numpy.where(integers, numpy.minimum(firstLetters, runEnds),
+                              runStarts)
+    identifiers = integerEnds < runEnds
+
+    operators = numpy.flatnonzero(classes == OPERATOR)
+    starts = numpy.concatenate(
+        (runStarts[integers], integerEnds[identifiers], operators))
+    ends = numpy.concatenate(
+        (integerEnds[integers], runEnds[identifiers], operators + 1))
+    codes = numpy.concatenate((
+        numpy.full(integers.sum(), CODE_OF_TYPE[INTEGER], numpy.uint8),
+        numpy.full(identifiers.sum(), CODE_OF_TYPE[IDENTIFIER], numpy.uint8),
+        CODE_TABLE[data[operators]]))
+
+    order = numpy.argsort(starts, kind = 'mergesort')
+    return starts[order], ends[order], codes[order]
+
+def tokenize(text, buffer = None):
+    '''
+    Scan the whole text into a TokenBuffer, finding the token boundaries
+    with vectorized NumPy operations. Falls back to tokenbuffer.tokenize()
+    without NumPy, for non-ASCII sources and for invalid characters (which
+    it reports).
+    '''
+    data = asciiBytes(text) if numpy is not None else None
+    found = boundaries(data) if data is not None else None
+    if found is None:
+        return tokenbuffer.tokenize(text, buffer)
+
+    if buffer is None:
+        buffer = TokenBuffer()
+    buffer.source = text
+    starts, ends, codes = found
+
+    # thin emitter: only words and integers need their lexemes looked at
+    lexemes = numpy.zeros(len(starts), dtype = numpy.uint32)
+    integerCode = CODE_OF_TYPE[INTEGER]
+    identifierCode = CODE_OF_TYPE[IDENTIFIER]
+    for char, type in OPERATOR_TYPES.items():
+        lexemes[codes == CODE_OF_TYPE[type]] = buffer.intern(char)
+    words = numpy.flatnonzero((codes == integerCode) |
+                              (codes == identifierCode))
+    wordLexemes = []
+    intern = buffer.intern
+    for index, start, end in zip(words.tolist(), starts[words].tolist(),
+                                 ends[words].tolist()):
+        lexeme = text[start:end]
+        if lexeme in KEYWORD_TYPES and codes[index] == identifierCode:
+            codes[index] = CODE_OF_TYPE[KEYWORD_TYPES[lexeme]]
+        wordLexemes.append(intern(lexeme))
+    lexemes[words] = wordLexemes
+
+    buffer.types.extend(array('B', codes.tobytes()))
+    buffer.starts.extend(array(POSITION_TYPECODE,
+                               starts.astype(numpy.int64).tobytes()))
+    buffer.lengths.extend(array('I', (ends - starts).astype(
+        numpy.uint32).tobytes()))
+    buffer.lexemes.extend(array('I', lexemes.tobytes()))
+    buffer.eofPosition = len(text) - 1 # the last position, as in CharStream
+    return buffer
+
+###########################################################
+# Top-level script tests
+###########################################################
+if __name__ == '__main__':
+    text = 'f = function(x, y) return x+y end\na2 = f(3, 4)\nb = f(12ab, a)\n'
+    buffer = tokenize(text)
+    expected = tokenbuffer.tokenize(text)
+    for index in range(len(expected) + 1):
+        token, other = buffer.token(index), expected.token(index)
+        print(token)
+        assert str(token) == str(other)
+    print('NumPy: {numpy}'.format(numpy = numpy is not None))